@@ -1,10 +1,32 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 import pymysql
 import os
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from urllib.parse import urlencode
 import logging
+import threading
+import time
+import json
+import traceback
+import heapq
+import operator
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from db_pool import ConnectionPool, PoolTimeout
+from result_cache import ResultCache, MemoryBackend, DiskBackend
+import rollup
+from country_codes import CountryCodeDirectory, aggregate_by_country, aggregate_sketches_by_country
+from extension_directory import ExtensionDirectory
+from single_flight import SingleFlight
+from http_cache import json_entry, cache_headers, is_not_modified
+from db_registry import DatabaseRegistry, load_database_entries
+from filter_profiles import DEFAULT_PROFILE, load_filter_profiles
+import query_compiler
+import sketches
+import metrics
+from metrics import span
 
 
 # Load environment variables
@@ -17,290 +39,678 @@ app.json.sort_keys = False  # This ensures that jsonify doesn't sort the keys al
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Database configurations
+# API authentication token
+API_TOKEN = os.getenv('API_TOKEN')
+
+# Filter profiles (extension ranges, internal destinations, dispositions) from FILTER_PROFILES_FILE;
+# requests choose one with profile=NAME, and a profile's own token can only read that profile
+filter_profiles = load_filter_profiles(os.environ)
+
+# Default per-database query timeout (seconds) and size of the shared fan-out thread pool
+DB_QUERY_TIMEOUT = float(os.getenv('DB_QUERY_TIMEOUT', 30))
+DB_FANOUT_WORKERS = int(os.getenv('DB_FANOUT_WORKERS', 16))
+
+# Circuit breaker: consecutive failed requests that take a database out of the fan-out,
+# and seconds between the background probes that bring it back
+DB_CIRCUIT_FAILURES = int(os.getenv('DB_CIRCUIT_FAILURES', 3))
+DB_CIRCUIT_PROBE_INTERVAL = float(os.getenv('DB_CIRCUIT_PROBE_INTERVAL', 30))
+
+# Bounded pool shared by all requests; each request submits one task per database
+fanout_executor = ThreadPoolExecutor(max_workers=DB_FANOUT_WORKERS, thread_name_prefix='db-fanout')
+
+# Connection pool settings (one pool per configured database, shared by all threads of a worker)
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 5))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', 10))
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 5))
+
+# Run the stat queries as server-side prepared statements (PREPARE once per pooled connection)
+DB_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', '0') != '0'
+
+db_pools = {}
+db_pools_lock = threading.Lock()
+statements = query_compiler.PreparedStatements(enabled=DB_PREPARED_STATEMENTS)
+
+def open_connection(db_config):
+    """Create a new database connection"""
+    logger.info(f"Connecting to database {db_config['name']} at {db_config['host']}:{db_config['port']}")
+    return pymysql.connect(
+        host=db_config['host'],
+        port=db_config['port'],
+        user=db_config['user'],
+        password=db_config['password'],
+        charset=db_config['charset'],
+        cursorclass=db_config['cursorclass'],
+        connect_timeout=min(10, db_config['timeout']),
+        read_timeout=db_config['timeout'],
+        # Pooled connections are reused; autocommit keeps each SELECT on a fresh snapshot
+        autocommit=True
+    )
+
+def probe_database(db_config):
+    """Health probe of an open circuit: raises unless a fresh connection answers a ping"""
+    connection = open_connection(db_config)
+    try:
+        connection.ping(reconnect=False)
+    finally:
+        connection.close()
+
+# Databases from DATABASES_FILE or DB<n>_* variables; disabled ones are left out, the rest
+# are queried heaviest weight first
+db_registry = DatabaseRegistry(
+    load_database_entries(os.environ, DB_QUERY_TIMEOUT),
+    failure_threshold=DB_CIRCUIT_FAILURES,
+    probe_interval=DB_CIRCUIT_PROBE_INTERVAL,
+    probe=probe_database
+)
 db_configs = [
-    {
-        'name': os.getenv('DB1_HOST'),
-        'host': os.getenv('DB1_HOST'),
-        'port': int(os.getenv('DB1_PORT', 3306)),
-        'user': os.getenv('DB1_USER'),
-        'password': os.getenv('DB1_PASSWORD'),
-        'charset': 'utf8mb4',
-        'cursorclass': pymysql.cursors.DictCursor
-    },
-    {
-        'name': os.getenv('DB2_HOST'),
-        'host': os.getenv('DB2_HOST'),
-        'port': int(os.getenv('DB2_PORT', 3306)),
-        'user': os.getenv('DB2_USER'),
-        'password': os.getenv('DB2_PASSWORD'),
-        'charset': 'utf8mb4',
-        'cursorclass': pymysql.cursors.DictCursor
-    },
-    {
-        'name': os.getenv('DB3_HOST'),
-        'host': os.getenv('DB3_HOST'),
-        'port': int(os.getenv('DB3_PORT', 3306)),
-        'user': os.getenv('DB3_USER'),
-        'password': os.getenv('DB3_PASSWORD'),
-        'charset': 'utf8mb4',
-        'cursorclass': pymysql.cursors.DictCursor
-    }
+    dict(entry, cursorclass=pymysql.cursors.DictCursor)
+    for entry in db_registry.databases
 ]
 
-# API authentication token
-API_TOKEN = os.getenv('API_TOKEN')
+def get_pool(db_config):
+    """Return the connection pool for a database, creating it on first use"""
+    pool = db_pools.get(db_config['name'])
+    if pool is None:
+        with db_pools_lock:
+            pool = db_pools.get(db_config['name'])
+            if pool is None:
+                pool = ConnectionPool(
+                    db_config['name'],
+                    lambda: open_connection(db_config),
+                    max_size=DB_POOL_MAX_SIZE,
+                    idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                    acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+                    ping_after=DB_POOL_PING_AFTER
+                )
+                db_pools[db_config['name']] = pool
+    return pool
 
 def get_connection(db_config):
-    """Create a database connection"""
+    """Check out a pooled database connection, or None when none is available.
+
+    Connect errors count towards the database's circuit breaker; a checkout that times out
+    because every pooled connection is busy does not (the database is loaded, not down).
+    """
     try:
-        logger.info(f"Connecting to database {db_config['name']} at {db_config['host']}:{db_config['port']}")
-        return pymysql.connect(
-            host=db_config['host'],
-            port=db_config['port'],
-            user=db_config['user'],
-            password=db_config['password'],
-            charset=db_config['charset'],
-            cursorclass=db_config['cursorclass']
-        )
+        with span('connect', db_config['name']):
+            return get_pool(db_config).acquire()
+    except PoolTimeout as e:
+        logger.error(f"Failed to connect to {db_config['name']}: {str(e)}")
+        return None
     except Exception as e:
         logger.error(f"Failed to connect to {db_config['name']}: {str(e)}")
+        db_registry.record(db_config, False)
         return None
-def query_database(db_config, date_param=None, start_dt=None, end_dt=None):
+
+def release_connection(db_config, connection, discard=False):
+    """Return a connection to its pool; discard it when it may be in a broken state"""
+    get_pool(db_config).release(connection, discard=discard)
+
+# Cache for closed week/month periods; set RESULT_CACHE_PATH to keep entries on disk across restarts
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 256))
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH')
+
+if RESULT_CACHE_PATH:
+    result_cache = ResultCache(DiskBackend(RESULT_CACHE_PATH, max_entries=RESULT_CACHE_SIZE))
+else:
+    result_cache = ResultCache(MemoryBackend(max_entries=RESULT_CACHE_SIZE))
+
+def closed_period_bounds(period, today=None):
+    """Return (start, end, rollover) dates for date='week' or 'month'.
+
+    'week' is Monday-Friday of the previous week and 'month' the previous calendar month,
+    matching the queries. `end` is exclusive; `rollover` is the day the period changes.
+    """
+    today = today or date.today()
+    if period == 'week':
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=5), start + timedelta(days=14)
+    if period == 'month':
+        end = today.replace(day=1)
+        start = (end - timedelta(days=1)).replace(day=1)
+        rollover = (end + timedelta(days=32)).replace(day=1)
+        return start, end, rollover
+    raise ValueError(f"Unknown period: {period}")
+
+def period_cache_key(endpoint, period, db_name):
+    """Return (key, expires_at) of the cached result of a closed week/month period.
+
+    expires_at is None during the first ROLLUP_SETTLE_HOURS after the period ended: late CDR
+    rows of calls that spanned the boundary may still arrive, so the result is not cached yet.
+    """
+    start, end, rollover = closed_period_bounds(period)
+    key = f"{endpoint}:{period}:{start.isoformat()}:{db_name}"
+    if datetime.combine(end, datetime.min.time()) + timedelta(hours=ROLLUP_SETTLE_HOURS) > datetime.now():
+        return key, None
+    return key, datetime.combine(rollover, datetime.min.time()).timestamp()
+
+def profile_endpoint(endpoint, profile=None):
+    """Endpoint part of cache keys under a filter profile; the built-in default profile keeps the plain name"""
+    if profile is None or profile == DEFAULT_PROFILE:
+        return endpoint
+    return f"{endpoint}@{profile.key}"
+
+def period_cache_endpoint(endpoint, approx=False, profile=None, source=None):
+    """Endpoint part of period_cache_key; approx=1 results are cached apart, per sketch precision,
+    and so are the results of each filter profile and of source=local|live
+    """
+    endpoint = profile_endpoint(endpoint, profile)
+    source = source or STATS_SOURCE
+    if source != 'remote':
+        endpoint = f"{endpoint}:{source}"
+    return f"{endpoint}:approx{APPROX_PRECISION}" if approx else endpoint
+
+def query_period_cached(db_config, endpoint, query_func, date_param, **kwargs):
+    """Serve closed week/month periods from the result cache, querying the database on a miss.
+
+    Entries are keyed by endpoint, period (with its start date) and database, and expire
+    when the period rolls over; they are stored once the period has settled (see
+    period_cache_key). Other date modes are passed straight to query_func.
+    """
+    period = date_param.lower() if date_param else None
+    if period not in ('week', 'month'):
+        return query_func(db_config, date_param, **kwargs)
+
+    key, expires_at = period_cache_key(endpoint, period, db_config['name'])
+    result = result_cache.get(key)
+    if result is not None:
+        return result
+
+    result = query_func(db_config, date_param, **kwargs)
+    if 'error' not in result and expires_at is not None:
+        result_cache.set(key, result, expires_at)
+    return result
+
+# Daily per-extension rollups for custom ranges; enabled by setting ROLLUP_PATH (SQLite file)
+ROLLUP_PATH = os.getenv('ROLLUP_PATH')
+# Hours to wait after midnight before a day is considered final (late CDR rows of long calls)
+ROLLUP_SETTLE_HOURS = float(os.getenv('ROLLUP_SETTLE_HOURS', 2))
+
+rollup_store = rollup.RollupStore(ROLLUP_PATH) if ROLLUP_PATH else None
+
+# asteriskcdrdb.country_codes is loaded once per database and reloaded after this many seconds
+COUNTRY_CODES_REFRESH = float(os.getenv('COUNTRY_CODES_REFRESH', 3600))
+
+country_directory = CountryCodeDirectory(refresh_interval=COUNTRY_CODES_REFRESH)
+
+# asterisk.sip extension lists are cached per database: reloaded after EXTENSIONS_TTL seconds,
+# or earlier when the checksum probed every EXTENSIONS_CHECK_INTERVAL seconds changes
+EXTENSIONS_TTL = float(os.getenv('EXTENSIONS_TTL', 3600))
+EXTENSIONS_CHECK_INTERVAL = float(os.getenv('EXTENSIONS_CHECK_INTERVAL', 300))
+
+extension_directory = ExtensionDirectory(ttl=EXTENSIONS_TTL, check_interval=EXTENSIONS_CHECK_INTERVAL)
+
+# Local copy of the CDR tables kept up to date by a background ingester; enabled by setting INGEST_PATH
+INGEST_PATH = os.getenv('INGEST_PATH')
+INGEST_INTERVAL = float(os.getenv('INGEST_INTERVAL', 60))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 5000))
+# Seconds before the watermark re-read on every poll (CDR rows are written when a call ends)
+INGEST_LOOKBACK = float(os.getenv('INGEST_LOOKBACK', 7200))
+# Days copied on the first run; older windows are always served by the remote databases
+INGEST_BACKFILL_DAYS = int(os.getenv('INGEST_BACKFILL_DAYS', 35))
+# Default source of /callstat and /asrstat: 'remote' (PBX databases), 'local' (ingested copy)
+# or 'live' (in-memory rolling aggregates, see LIVE_STATS)
+STATS_SOURCE = os.getenv('STATS_SOURCE', 'remote').lower()
+
+local_store = None
+if INGEST_PATH:
+    # Optional feature: the ingester module is only imported when enabled
+    from ingest import LocalCdrStore, CdrIngester
+
+    # A copy whose last completed poll is older than this no longer answers windows reaching now
+    local_store = LocalCdrStore(INGEST_PATH, filter_profiles.default, max_lag=max(3 * INGEST_INTERVAL, 30))
+    CdrIngester(
+        local_store,
+        db_configs,
+        open_connection,
+        interval=INGEST_INTERVAL,
+        batch_size=INGEST_BATCH_SIZE,
+        lookback=INGEST_LOOKBACK,
+        backfill_days=INGEST_BACKFILL_DAYS,
+        directory_refresh=COUNTRY_CODES_REFRESH
+    ).start()
+
+# In-memory aggregates of today and the last LIVE_HOURS hours, fed by incremental reads; enabled by LIVE_STATS=1
+LIVE_STATS = os.getenv('LIVE_STATS', '0') != '0'
+LIVE_INTERVAL = float(os.getenv('LIVE_INTERVAL', 5))
+LIVE_HOURS = int(os.getenv('LIVE_HOURS', 24))
+# Late CDR rows (calls longer than the poll interval) are picked up by re-reading LIVE_LOOKBACK
+# seconds every LIVE_SWEEP_INTERVAL seconds
+LIVE_LOOKBACK = float(os.getenv('LIVE_LOOKBACK', 7200))
+LIVE_SWEEP_INTERVAL = float(os.getenv('LIVE_SWEEP_INTERVAL', 60))
+LIVE_BATCH_SIZE = int(os.getenv('LIVE_BATCH_SIZE', 5000))
+
+live_stats = None
+if LIVE_STATS:
+    # Optional feature: only imported when enabled
+    from live_stats import LiveStats
+
+    live_stats = LiveStats(
+        db_configs,
+        open_connection,
+        lambda db_name, cursor: (extension_directory.get(db_name, cursor, filter_profiles.default),
+                                 country_directory.get(db_name, cursor)),
+        interval=LIVE_INTERVAL,
+        hours=LIVE_HOURS,
+        lookback=LIVE_LOOKBACK,
+        sweep_interval=LIVE_SWEEP_INTERVAL,
+        batch_size=LIVE_BATCH_SIZE,
+        profile=filter_profiles.default
+    )
+    live_stats.start()
+
+def use_live_source(db_config, start, end, source, profile=None):
+    """True when a calldate window should be answered from the in-memory aggregates.
+
+    Falls back to the remote database when the window is not covered (not aligned to an hour,
+    older than LIVE_HOURS, or the aggregates are behind after failed polls). The aggregates
+    only count the default filter profile.
+    """
+    if (source or STATS_SOURCE) != 'live' or live_stats is None:
+        return False
+    if (profile or filter_profiles.default) != live_stats.profile:
+        return False
+    if live_stats.covers(db_config['name'], start, end):
+        return True
+    logger.debug(f"Live stats of {db_config['name']} do not cover {start} - {end}; querying the database")
+    return False
+
+def use_local_source(db_config, start, end, source, profile=None):
+    """True when a calldate window should be answered from the ingested copy.
+
+    Falls back to the remote database when the window starts before the ingested range, or
+    for another filter profile than the default one (the only extension list copied).
+    """
+    if (source or STATS_SOURCE) != 'local' or local_store is None:
+        return False
+    if (profile or filter_profiles.default) != local_store.profile:
+        return False
+    if local_store.covers(db_config['name'], start, end):
+        return True
+    logger.info(f"Local copy of {db_config['name']} does not cover {start} - {end}; querying the database")
+    return False
+
+def calldate_window(date_param=None, start_dt=None, end_dt=None):
+    """Translate any date mode into a half-open [start, end) calldate range.
+
+    Every query filters with `cdr.calldate >= %s AND cdr.calldate < %s` so the calldate index
+    is used (wrapping the column, e.g. DATE(cdr.calldate) = %s, forces a full table scan).
+      - start_dt/end_dt 'YYYY-MM-DD HH:MM[:SS]': custom range, the end minute is inclusive
+      - 'week' / 'month': the closed period from closed_period_bounds
+      - 'YYYY-MM-DD' (or nothing, meaning today): that whole day
+    """
+    if start_dt and end_dt:
+        start = datetime.strptime(start_dt[:16], '%Y-%m-%d %H:%M')
+        end = datetime.strptime(end_dt[:16], '%Y-%m-%d %H:%M') + timedelta(minutes=1)
+        return start, end
+
+    period = date_param.lower() if date_param else None
+    if period in ('week', 'month'):
+        first_day, end_day, _ = closed_period_bounds(period)
+    else:
+        first_day = datetime.strptime(date_param, '%Y-%m-%d').date() if date_param else date.today()
+        end_day = first_day + timedelta(days=1)
+    return datetime.combine(first_day, datetime.min.time()), datetime.combine(end_day, datetime.min.time())
+
+# SQL statements are composed in query_compiler.py from named metrics, filters and grouping keys;
+# `profile` is a filter profile (the configured default when None)
+# approx=1 distinct counts: HyperLogLog sketches with 2^APPROX_PRECISION registers (see sketches.py)
+APPROX_PRECISION = int(os.getenv('APPROX_PRECISION', sketches.DEFAULT_PRECISION))
+
+def build_batch_query(windows, metrics=('callstat', 'asrstat'), profile=None):
+    """One grouped scan answering the requested metric families for several [start, end) windows"""
+    families = tuple(metric for metric in BATCH_METRICS if metric in metrics)
+    return (query_compiler.compile_batch(len(windows), families, profile or filter_profiles.default),
+            query_compiler.batch_params(windows, families))
+
+def build_callstat_query(start, end, profile=None):
+    """Per-extension call statistics for calldate in [start, end)"""
+    return query_compiler.compile_query('callstat', 0, profile or filter_profiles.default), (start, end)
+
+def build_daily_aggregates_query(start, end, profile=None):
+    """Mergeable per-day, per-extension aggregates for calldate in [start, end)"""
+    return query_compiler.compile_query('daily_aggregates', 0, profile or filter_profiles.default), (start, end)
+
+def build_hourly_aggregates_query(start, end, profile=None):
+    """Mergeable per-hour, per-extension aggregates for calldate in [start, end)"""
+    return query_compiler.compile_query('hourly_aggregates', 0, profile or filter_profiles.default), (start, end)
+
+def build_asr_query(start, end, profile=None):
+    """Per-destination ASR aggregates for calldate in [start, end)"""
+    return query_compiler.compile_query('asr', 0, profile or filter_profiles.default), (start, end)
+
+def build_callstat_sketch_query(start, end, profile=None):
+    """Per-extension HyperLogLog registers and exact billsec sums for calldate in [start, end) (approx=1)"""
+    return (query_compiler.compile_sketch_query('callstat', APPROX_PRECISION, 0, profile or filter_profiles.default),
+            query_compiler.sketch_params('callstat', start, end))
+
+def build_asr_sketch_query(start, end, prefix_length, profile=None):
+    """Per-destination-prefix HyperLogLog registers and talk billsec for calldate in [start, end) (approx=1)"""
+    return (query_compiler.compile_sketch_query('asr', APPROX_PRECISION, prefix_length,
+                                                profile or filter_profiles.default),
+            query_compiler.sketch_params('asr', start, end))
+
+def build_export_query(start, end, cnums=None, profile=None):
+    """Raw CDR rows for calldate in [start, end) ordered by calldate, optionally of some extensions only"""
+    cnums = tuple(cnums or ())
+    return query_compiler.compile_query('export', len(cnums), profile or filter_profiles.default), (start, end) + cnums
+
+def fetch_aggregates(cursor, query, bucket_of):
+    """Run a per-bucket aggregates query; returns {bucket_of(row): {(cnum, cnam): aggregate}}"""
+    cursor.execute("SET SESSION group_concat_max_len = 4294967295")
+    statements.execute(cursor, *query)
+
+    aggregates_by_bucket = {}
+    for row in cursor.fetchall():
+        aggregates = aggregates_by_bucket.setdefault(bucket_of(row), {})
+        aggregates[(row['cnum'], row['cnam'])] = {
+            'call_count': int(row['call_count']),
+            'billsec': int(row['billsec'] or 0),
+            'long_calls_count': int(row['long_calls_count']),
+            'long_billsec': int(row['long_billsec'] or 0),
+            'dsts': set(row['dsts'].split('\n')) if row['dsts'] else set(),
+        }
+    return aggregates_by_bucket
+
+def fetch_daily_aggregates(cursor, start, end, profile=None):
+    """Per-day, per-extension callstat aggregates for calldate in [start, end).
+
+    Returns {date: {(cnum, cnam): aggregate}} with raw billsec sums and the exact set of
+    distinct destinations, so days can be merged (see rollup.merge_aggregates).
+    """
+    return fetch_aggregates(cursor, build_daily_aggregates_query(start, end, profile), operator.itemgetter('day'))
+
+def fetch_hourly_aggregates(cursor, start, end, profile=None):
+    """Per-hour, per-extension callstat aggregates for calldate in [start, end), keyed by the hour's datetime"""
+    return fetch_aggregates(
+        cursor,
+        build_hourly_aggregates_query(start, end, profile),
+        lambda row: datetime.combine(row['day'], datetime.min.time()) + timedelta(hours=int(row['hour']))
+    )
+
+def rollup_name(db_config, profile=None):
+    """Name the rollups of a database are stored under; other filter profiles than the built-in
+    default get their own, which change with the profile's filters
+    """
+    return profile_endpoint(db_config['name'], profile)
+
+def rollup_daily_aggregates(cursor, db_config, start, end, profile=None):
+    """Per-day aggregates of a calldate window [start, end) from daily rollups plus live partial edge days.
+
+    Only days that are settled (older than ROLLUP_SETTLE_HOURS past midnight) are served from
+    rollups; missing ones are built with one grouped scan per run of consecutive days. Returns
+    {date: {(cnum, cnam): aggregate}}, or None when the window has no settled complete day.
+    Rollups are kept per filter profile (rollup_name).
+    """
+    settled_end = (datetime.now() - timedelta(hours=ROLLUP_SETTLE_HOURS)).date()
+
+    first_day = start.date() if start.time() == datetime.min.time() else start.date() + timedelta(days=1)
+    end_day = min(end.date(), settled_end)
+    if first_day >= end_day:
+        return None
+
+    name = rollup_name(db_config, profile)
+    missing = rollup_store.missing_days(name, first_day, end_day)
+    for run_start, run_end in rollup.contiguous_runs(missing):
+        logger.info(f"Building daily rollups {run_start} - {run_end} (exclusive) for {name}")
+        aggregates_by_day = fetch_daily_aggregates(cursor, run_start, run_end, profile)
+        rollup_store.store_days(name, list(rollup.iter_days(run_start, run_end)), aggregates_by_day)
+
+    aggregates_by_day = rollup_store.load_by_day(name, first_day, end_day)
+
+    # Partial days at either edge of the window come from the live CDR
+    first_full = datetime.combine(first_day, datetime.min.time())
+    end_full = datetime.combine(end_day, datetime.min.time())
+    for edge_start, edge_end in ((start, first_full), (end_full, end)):
+        if edge_start < edge_end:
+            for day, day_aggregates in fetch_daily_aggregates(cursor, edge_start, edge_end, profile).items():
+                rollup.merge_aggregates(aggregates_by_day.setdefault(day, {}), day_aggregates)
+
+    return aggregates_by_day
+
+def query_range_from_rollup(cursor, db_config, start, end, profile=None):
+    """Answer a calldate window [start, end) from daily rollups plus live partial edge days.
+
+    Returns rows shaped like the callstat query, or None when the window has no settled
+    complete day (see rollup_daily_aggregates).
+    """
+    aggregates_by_day = rollup_daily_aggregates(cursor, db_config, start, end, profile)
+    if aggregates_by_day is None:
+        return None
+
+    aggregates = {}
+    for day_aggregates in aggregates_by_day.values():
+        rollup.merge_aggregates(aggregates, day_aggregates)
+    return rollup.aggregates_to_rows(aggregates)
+
+def fan_out(query_func, *args, **kwargs):
+    """Run query_func against every configured database concurrently.
+
+    Returns a dict keyed by database name (heaviest weight first). A database that does not
+    answer within its timeout, or whose circuit is open, gets an error entry instead, so
+    callers can still return partial results from the other hosts. The circuit breakers are
+    fed by the query functions, only for attempts that use a MySQL connection.
+    """
+    started = time.monotonic()
+    futures = []
+    all_results = {}
+    for db_config in db_configs:
+        unavailable = db_registry.unavailable(db_config)
+        if unavailable:
+            metrics.db_errors.inc(db=db_config['name'], kind='circuit_open')
+            all_results[db_config['name']] = unavailable
+            continue
+        futures.append((db_config, fanout_executor.submit(query_func, db_config, *args, **kwargs)))
+
+    for db_config, future in futures:
+        db_name = db_config['name']
+        try:
+            result = future.result(timeout=max(0, started + db_config['timeout'] - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            metrics.db_errors.inc(db=db_name, kind='timeout')
+            logger.error(f"Timed out querying {db_name} after {db_config['timeout']:g}s")
+            result = {
+                'error': f"Timed out querying {db_name} after {db_config['timeout']:g}s"
+            }
+        except Exception as e:
+            metrics.db_errors.inc(db=db_name, kind='error')
+            logger.error(f"Error querying {db_name}: {str(e)}")
+            result = {
+                'error': f"Error querying {db_name}: {str(e)}"
+            }
+        else:
+            if 'error' in result:
+                metrics.db_errors.inc(db=db_name, kind='error')
+        all_results[db_name] = result
+
+    # Keep database order even when some were skipped by their circuit
+    return {db_config['name']: all_results[db_config['name']] for db_config in db_configs}
+
+def merge_extension_rows(results, extensions, db_name=''):
+    """Return one row per extension: its stats from `results`, or zero stats when it had no calls
+
+    Args:
+        results: callstat rows (minute values may be Decimal).
+        extensions: rows with cnum and cnam from asterisk.sip.
+        db_name: database label of the timing spans.
+    """
+    # Convert Decimal objects to float for JSON serialization and ensure 2 decimal places
+    stats_by_cnum = {}
+    with span('convert', db_name):
+        for row in results:
+            if 'total_call_time_minutes' in row:
+                row['total_call_time_minutes'] = round(float(row['total_call_time_minutes']), 2)
+            if 'total_long_calls_minutes' in row:
+                row['total_long_calls_minutes'] = round(float(row['total_long_calls_minutes']), 2)
+
+            # Index stats by extension for later merge with extension list
+            stats_by_cnum[row['cnum']] = row
+
+    final_rows = []
+    with span('merge', db_name):
+        for ext in extensions:
+            cnum = ext['cnum']
+            ext_name = ext.get('cnam') or ''
+
+            if cnum in stats_by_cnum:
+                row = stats_by_cnum[cnum]
+                # Prefer non-empty name from sip if cnam is empty in stats
+                if not row.get('cnam') and ext_name:
+                    row['cnam'] = ext_name
+            else:
+                # No stats for this extension on the requested date/period – add zero stats
+                row = {
+                    'cnum': cnum,
+                    'cnam': ext_name,
+                    'unique_calls': 0,
+                    'call_count': 0,
+                    'total_call_time_minutes': 0.00,
+                    'long_calls_count': 0,
+                    'total_long_calls_minutes': 0.00,
+                }
+
+            final_rows.append(row)
+    return final_rows
+
+# Distinct counts of the approx=1 callstat query, sent as HyperLogLog registers per extension
+CALLSTAT_SKETCHES = ('unique_calls', 'call_count', 'long_calls_count')
+
+def estimate_callstat_sketches(sketch_rows):
+    """Turn approx=1 callstat rows into callstat rows with estimated counts, ordered like the exact query.
+
+    Every database is estimated on its own; combine_results adds the estimates up like it adds
+    up the exact per-database counts.
+    """
+    rows = []
+    for row in sketch_rows:
+        estimated = {
+            'cnum': row['cnum'],
+            'cnam': row['cnam'],
+            'total_call_time_minutes': round(int(row['billsec'] or 0) / 60, 2),
+            'total_long_calls_minutes': round(int(row['long_billsec'] or 0) / 60, 2),
+        }
+        for name in CALLSTAT_SKETCHES:
+            estimated[name] = sketches.HyperLogLog.from_registers(row[name], APPROX_PRECISION).estimate()
+        rows.append(estimated)
+    rows.sort(key=lambda row: row['total_call_time_minutes'], reverse=True)
+    return rows
+
+# Identical concurrent per-database queries share one execution; SINGLE_FLIGHT_SHARED_DIR extends
+# this across the Gunicorn workers of a host (lock files plus a short-lived shared result store)
+SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', '1') != '0'
+SINGLE_FLIGHT_SHARED_DIR = os.getenv('SINGLE_FLIGHT_SHARED_DIR')
+SINGLE_FLIGHT_SHARED_TTL = float(os.getenv('SINGLE_FLIGHT_SHARED_TTL', 5))
+
+single_flight = SingleFlight(SINGLE_FLIGHT_SHARED_DIR, shared_ttl=SINGLE_FLIGHT_SHARED_TTL,
+                             lock_timeout=DB_QUERY_TIMEOUT)
+
+def query_coalesced(db_config, query_func, *args, **kwargs):
+    """Run query_func(db_config, *args, **kwargs), sharing one execution with identical concurrent calls.
+
+    The key covers the function, the database and every argument. The result may be shared
+    between requests, so callers must not modify it.
+    """
+    if not SINGLE_FLIGHT:
+        return query_func(db_config, *args, **kwargs)
+    key = single_flight_key(db_config, query_func, args, kwargs)
+    return single_flight.do(key, lambda: query_func(db_config, *args, **kwargs))
+
+def single_flight_key(db_config, query_func, args, kwargs):
+    """Coalescing key of query_func(db_config, *args, **kwargs)"""
+    # Functions passed as arguments are keyed by name so keys match across worker processes
+    parts = [value.__name__ if callable(value) else repr(value) for value in args]
+    parts += [f"{name}={value!r}" for name, value in sorted(kwargs.items())]
+    return f"{query_func.__name__}:{db_config['name']}:{','.join(parts)}"
+
+def query_database(db_config, date_param=None, start_dt=None, end_dt=None, source=None, approx=False, profile=None):
     """Query a single database for call statistics
 
     Args:
         db_config: Database connection configuration.
         date_param: 'week' | 'month' | specific date string 'YYYY-MM-DD' (kept for backward compatibility).
         start_dt: start of range as 'YYYY-MM-DD HH:MM[:SS]'. Used when a custom date range is requested.
-        end_dt: end of range as 'YYYY-MM-DD HH:MM[:SS]'. Used when a custom date range is requested.
+        end_dt: end of range as 'YYYY-MM-DD HH:MM[:SS]' (minute inclusive). Used when a custom date range is requested.
+        source: 'local' to answer from the ingested copy, 'live' from the in-memory aggregates, when they
+            cover the window (default STATS_SOURCE).
+        approx: estimate the distinct counts of a CDR scan with HyperLogLog sketches. Rollups, local
+            and live sources stay exact.
+        profile: filter profile (default: the configured default profile).
     """
+    profile = profile or filter_profiles.default
+    start, end = calldate_window(date_param, start_dt, end_dt)
+    if use_live_source(db_config, start, end, source, profile):
+        return live_stats.view(
+            db_config['name'], 'callstat', start, end,
+            lambda rows, extensions: {
+                'status': 'success',
+                'data': merge_extension_rows(rows, extensions, db_config['name'])
+            }
+        )
+    if use_local_source(db_config, start, end, source, profile):
+        return {
+            'status': 'success',
+            'data': merge_extension_rows(
+                local_store.callstat_rows(db_config['name'], start, end),
+                local_store.extensions(db_config['name']),
+                db_config['name']
+            )
+        }
+
     connection = get_connection(db_config)
     if not connection:
         return {
             'error': f"Failed to connect to {db_config['name']} at {db_config['host']}:{db_config['port']}"
         }
 
+    failed = False
     try:
         with connection.cursor() as cursor:
-            # Determine which query to use based on date_param
-            if date_param and date_param.lower() == 'week':
-                query = """
-                SELECT
-                    cdr.cnum,
-                    IFNULL(cdr.cnam, '') AS cnam,
-                    COUNT(DISTINCT cdr.dst) AS unique_calls,
-                    COUNT(DISTINCT cdr.uniqueid) AS call_count,
-                    ROUND(SUM(CASE
-                        WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED'
-                        THEN cdr.billsec
-                        ELSE 0
-                    END) / 60, 2) AS total_call_time_minutes,
-                    COUNT(DISTINCT CASE
-                        WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                        THEN cdr.uniqueid
-                        ELSE NULL
-                    END) AS long_calls_count,
-                    ROUND(SUM(CASE
-                        WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                        THEN cdr.billsec
-                        ELSE 0
-                    END) / 60, 2) AS total_long_calls_minutes
-                FROM
-                    asteriskcdrdb.cdr
-                WHERE
-                    calldate >= DATE_SUB(CURRENT_DATE, INTERVAL WEEKDAY(CURRENT_DATE) + 7 DAY)
-                    AND calldate < DATE_SUB(CURRENT_DATE, INTERVAL WEEKDAY(CURRENT_DATE) + 2 DAY)
-                    AND cdr.cnum >= 2000 AND cdr.cnum <= 3999
-                    AND cdr.lastapp IN ('Dial', 'Busy', 'Congestion')
-                    AND cdr.disposition != 'FAILED'
-                    AND cdr.dst NOT REGEXP '^[0-9]{4}$'
-                GROUP BY
-                    cdr.cnum, cdr.cnam
-                ORDER BY
-                    total_call_time_minutes DESC
-                """
-                cursor.execute(query)
-            elif date_param and date_param.lower() == 'month':
-                query = """
-                SELECT
-                    cdr.cnum,
-                    IFNULL(cdr.cnam, '') AS cnam,
-                    COUNT(DISTINCT cdr.dst) AS unique_calls,
-                    COUNT(DISTINCT cdr.uniqueid) AS call_count,
-                    ROUND(SUM(CASE
-                        WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED'
-                        THEN cdr.billsec
-                        ELSE 0
-                    END) / 60, 2) AS total_call_time_minutes,
-                    COUNT(DISTINCT CASE
-                        WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                        THEN cdr.uniqueid
-                        ELSE NULL
-                    END) AS long_calls_count,
-                    ROUND(SUM(CASE
-                        WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                        THEN cdr.billsec
-                        ELSE 0
-                    END) / 60, 2) AS total_long_calls_minutes
-                FROM
-                    asteriskcdrdb.cdr
-                WHERE
-                    calldate >= DATE_FORMAT(DATE_SUB(CURRENT_DATE, INTERVAL 1 MONTH), '%Y-%m-01')
-                    AND calldate < DATE_FORMAT(CURRENT_DATE, '%Y-%m-01')
-                    AND cdr.cnum >= 2000 AND cdr.cnum <= 3999
-                    AND cdr.lastapp IN ('Dial', 'Busy', 'Congestion')
-                    AND cdr.disposition != 'FAILED'
-                    AND cdr.dst NOT REGEXP '^[0-9]{4}$'
-                GROUP BY
-                    cdr.cnum, cdr.cnam
-                ORDER BY
-                    total_call_time_minutes DESC
-                """
-                cursor.execute(query)
-            else:
-                # Query for specific date or custom date range
-                if start_dt and end_dt:
-                    query = """
-                    SELECT
-                        cdr.cnum,
-                        IFNULL(cdr.cnam, '') AS cnam,
-                        COUNT(DISTINCT cdr.dst) AS unique_calls,
-                        COUNT(DISTINCT cdr.uniqueid) AS call_count,
-                        ROUND(SUM(CASE
-                            WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED'
-                            THEN cdr.billsec
-                            ELSE 0
-                        END) / 60, 2) AS total_call_time_minutes,
-                        COUNT(DISTINCT CASE
-                            WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                            THEN cdr.uniqueid
-                            ELSE NULL
-                        END) AS long_calls_count,
-                        ROUND(SUM(CASE
-                            WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                            THEN cdr.billsec
-                            ELSE 0
-                        END) / 60, 2) AS total_long_calls_minutes
-                    FROM
-                        asteriskcdrdb.cdr
-                    WHERE
-                        cdr.calldate >= %s AND cdr.calldate <= %s
-                        AND cdr.cnum >= 2000 AND cdr.cnum <= 3999
-                        AND cdr.lastapp IN ('Dial', 'Busy', 'Congestion')
-                        AND cdr.disposition != 'FAILED'
-                        AND cdr.dst NOT REGEXP '^[0-9]{4}$'
-                    GROUP BY
-                        cdr.cnum, cdr.cnam
-                    ORDER BY
-                        total_call_time_minutes DESC
-                    """
-                    cursor.execute(query, (start_dt, end_dt))
-                else:
-                    # Backward-compatible: single date means whole day
-                    query = """
-                    SELECT
-                        cdr.cnum,
-                        IFNULL(cdr.cnam, '') AS cnam,
-                        COUNT(DISTINCT cdr.dst) AS unique_calls,
-                        COUNT(DISTINCT cdr.uniqueid) AS call_count,
-                        ROUND(SUM(CASE
-                            WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED'
-                            THEN cdr.billsec
-                            ELSE 0
-                        END) / 60, 2) AS total_call_time_minutes,
-                        COUNT(DISTINCT CASE
-                            WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                            THEN cdr.uniqueid
-                            ELSE NULL
-                        END) AS long_calls_count,
-                        ROUND(SUM(CASE
-                            WHEN cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED' AND cdr.billsec > 90
-                            THEN cdr.billsec
-                            ELSE 0
-                        END) / 60, 2) AS total_long_calls_minutes
-                    FROM
-                        asteriskcdrdb.cdr
-                    WHERE
-                        DATE(cdr.calldate) = %s
-                        AND cdr.cnum >= 2000 AND cdr.cnum <= 3999
-                        AND cdr.lastapp IN ('Dial', 'Busy', 'Congestion')
-                        AND cdr.disposition != 'FAILED'
-                        AND cdr.dst NOT REGEXP '^[0-9]{4}$'
-                    GROUP BY
-                        cdr.cnum, cdr.cnam
-                    ORDER BY
-                        total_call_time_minutes DESC
-                    """
-                    cursor.execute(query, (date_param,))
-
-            results = cursor.fetchall()
-
-            # Convert Decimal objects to float for JSON serialization and ensure 2 decimal places
-            stats_by_cnum = {}
-            for row in results:
-                if 'total_call_time_minutes' in row:
-                    row['total_call_time_minutes'] = round(float(row['total_call_time_minutes']), 2)
-                if 'total_long_calls_minutes' in row:
-                    row['total_long_calls_minutes'] = round(float(row['total_long_calls_minutes']), 2)
-
-                # Index stats by extension for later merge with extension list
-                stats_by_cnum[row['cnum']] = row
-
-            # --- Get full extension list from asterisk.sip and add zero-stat rows where needed ---
-            ext_query = """
-                SELECT
-                    id AS cnum,
-                    SUBSTRING_INDEX(SUBSTRING_INDEX(data, ',', -1), '<', 1) AS cnam
-                FROM asterisk.sip
-                WHERE keyword = 'callerid'
-                  AND id >= 2000
-                  AND id <= 3999
-            """
-            cursor.execute(ext_query)
-            extensions = cursor.fetchall()
-
-            final_rows = []
-            for ext in extensions:
-                cnum = ext['cnum']
-                ext_name = ext.get('cnam') or ''
-
-                if cnum in stats_by_cnum:
-                    row = stats_by_cnum[cnum]
-                    # Prefer non-empty name from sip if cnam is empty in stats
-                    if not row.get('cnam') and ext_name:
-                        row['cnam'] = ext_name
-                else:
-                    # No stats for this extension on the requested date/period – add zero stats
-                    row = {
-                        'cnum': cnum,
-                        'cnam': ext_name,
-                        'unique_calls': 0,
-                        'call_count': 0,
-                        'total_call_time_minutes': 0.00,
-                        'long_calls_count': 0,
-                        'total_long_calls_minutes': 0.00,
-                    }
+            results = None
+            if rollup_store is not None:
+                with span('rollup', db_config['name']):
+                    results = query_range_from_rollup(cursor, db_config, start, end, profile)
+            if results is None and approx:
+                with span('execute', db_config['name']):
+                    cursor.execute("SET SESSION group_concat_max_len = 4294967295")
+                    statements.execute(cursor, *build_callstat_sketch_query(start, end, profile))
+                with span('fetchall', db_config['name']):
+                    sketch_rows = cursor.fetchall()
+                with span('estimate', db_config['name']):
+                    results = estimate_callstat_sketches(sketch_rows)
+            elif results is None:
+                with span('execute', db_config['name']):
+                    statements.execute(cursor, *build_callstat_query(start, end, profile))
+                with span('fetchall', db_config['name']):
+                    results = cursor.fetchall()
 
-                final_rows.append(row)
+            # --- Full extension list from asterisk.sip (cached) to add zero-stat rows where needed ---
+            with span('extensions', db_config['name']):
+                extensions = extension_directory.get(db_config['name'], cursor, profile)
 
             return {
                 'status': 'success',
-                'data': final_rows
+                'data': merge_extension_rows(results, extensions, db_config['name'])
             }
 
     except Exception as e:
         logger.error(f"Error querying {db_config['name']}: {str(e)}")
+        failed = True
         return {
             'error': f"Error querying {db_config['name']}: {str(e)}"
         }
 
     finally:
-        if connection and connection.open:
-            connection.close()
+        release_connection(db_config, connection, discard=failed)
+        db_registry.record(db_config, not failed)
+
+def combine_results(all_results, top=None):
+    """Combine results from multiple databases by cnum
 
-def combine_results(all_results):
-    """Combine results from multiple databases by cnum"""
+    Rows are ordered by total time; with `top` only the first `top` rows are returned
+    (heapq.nlargest, same order as the full sort).
+    """
     combined = {}
     errors = []
 
@@ -340,10 +750,191 @@ def combine_results(all_results):
         item['total_call_time_minutes'] = round(item['total_call_time_minutes'], 2)
         item['total_long_calls_minutes'] = round(item['total_long_calls_minutes'], 2)
 
-    combined_list.sort(key=lambda x: x['total_call_time_minutes'], reverse=True)
+    if top is None:
+        combined_list.sort(key=lambda x: x['total_call_time_minutes'], reverse=True)
+    else:
+        combined_list = heapq.nlargest(top, combined_list, key=lambda x: x['total_call_time_minutes'])
 
     return combined_list, errors
 
+def parse_datetime_param(value, is_start):
+    """Parse 'YYYY-MM-DD HH:MM' or 'YYYY-MM-DD'; a missing time defaults to 00:00 (start) or 23:59 (end)"""
+    value = value.strip()
+    fmts = ['%Y-%m-%d %H:%M', '%Y-%m-%d']
+    last_exc = None
+    for fmt in fmts:
+        try:
+            dt = datetime.strptime(value, fmt)
+            # If format had no time (date only), set default time
+            if fmt == '%Y-%m-%d':
+                if is_start:
+                    dt = dt.replace(hour=0, minute=0)
+                else:
+                    dt = dt.replace(hour=23, minute=59)
+            return dt
+        except ValueError as e:
+            last_exc = e
+    raise ValueError(str(last_exc) if last_exc else 'Invalid date-time')
+
+# Longest window of the hours parameter
+HOURS_MAX = 168
+
+def parse_range_params(date_param, start_param, end_param, hours_param=None):
+    """Validate the date/start/end/hours query parameters shared by the stat endpoints.
+
+    Returns (start_dt, end_dt, range_label) strings for a custom range, the last `hours` hours
+    (from the start of the hour hours - 1 hours ago up to now) or a single date (today when
+    nothing is given), or (None, None, None) for date=week|month.
+    Raises ValueError with a client-facing message on invalid input.
+    """
+    if date_param and date_param.lower() in ['week', 'month']:
+        return None, None, None
+
+    if hours_param:
+        if start_param or end_param:
+            raise ValueError('Use either hours or start and end')
+        if not hours_param.isdigit() or not 1 <= int(hours_param) <= HOURS_MAX:
+            raise ValueError(f'Invalid hours. Use an integer between 1 and {HOURS_MAX}')
+        now = datetime.now()
+        start_dt_obj = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=int(hours_param) - 1)
+        end_dt_obj = now.replace(second=0, microsecond=0)
+    elif start_param or end_param:
+        if not start_param or not end_param:
+            raise ValueError('Both start and end must be provided when using a custom range')
+        try:
+            start_dt_obj = parse_datetime_param(start_param, is_start=True)
+            end_dt_obj = parse_datetime_param(end_param, is_start=False)
+        except ValueError:
+            raise ValueError('Invalid date-time format. Use YYYY-MM-DD HH:MM or YYYY-MM-DD') from None
+    else:
+        # Backward-compatible behavior with ?date=YYYY-MM-DD or missing both -> today
+        if not date_param:
+            base_date = datetime.now().strftime('%Y-%m-%d')
+        else:
+            # Validate plain date
+            try:
+                datetime.strptime(date_param, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError('Invalid date format. Use YYYY-MM-DD, "week", or "month"') from None
+            base_date = date_param
+        start_dt_obj = datetime.strptime(base_date + ' 00:00', '%Y-%m-%d %H:%M')
+        end_dt_obj = datetime.strptime(base_date + ' 23:59', '%Y-%m-%d %H:%M')
+
+    # Validate ordering
+    if start_dt_obj > end_dt_obj:
+        raise ValueError('Invalid range: start must be less than or equal to end')
+
+    # Format as strings with seconds for MySQL
+    start_dt = start_dt_obj.strftime('%Y-%m-%d %H:%M:%S')
+    end_dt = end_dt_obj.strftime('%Y-%m-%d %H:%M:%S')
+    range_label = f"{start_dt_obj.strftime('%Y-%m-%d %H:%M')} - {end_dt_obj.strftime('%Y-%m-%d %H:%M')}"
+    return start_dt, end_dt, range_label
+
+# Output formats of /callstat: one JSON document, the same document streamed in chunks, or NDJSON
+STATS_OUTPUT_FORMATS = ('json', 'stream', 'ndjson')
+# Rows serialized per chunk when streaming
+STREAM_CHUNK_ROWS = 500
+# Values of the source parameter of the stat endpoints
+STATS_SOURCES = ('remote', 'local', 'live')
+
+def parse_top_param(value):
+    """Validate the top parameter: None (all rows) or a positive row count"""
+    if value is None or value == '':
+        return None
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError('Invalid top. Use a positive integer')
+    return int(value)
+
+def parse_approx_param(value):
+    """Validate the approx parameter: True for 1, False when missing or 0"""
+    if value is None or value in ('', '0'):
+        return False
+    if value != '1':
+        raise ValueError('Invalid approx. Use 0 or 1')
+    return True
+
+def request_profile(token, name):
+    """Filter profile of a statistics request, or None when the token may not read it.
+
+    API_TOKEN reads every profile (profile=NAME, the default one when missing); a profile's own
+    token only reads that profile. Raises ValueError for an unknown profile name.
+    """
+    if token == API_TOKEN:
+        return filter_profiles.get(name)
+    profile = filter_profiles.for_token(token)
+    if profile is None or (name and name != profile.name):
+        return None
+    return profile
+
+def approx_meta():
+    """Response field describing the approx=1 estimates"""
+    return OrderedDict([
+        ('precision', APPROX_PRECISION),
+        ('standard_error', round(sketches.standard_error(APPROX_PRECISION), 4)),
+    ])
+
+def compact_json_dumps(obj):
+    """Serialize like jsonify() outside debug mode (app JSON settings, compact separators)"""
+    return app.json.dumps(obj, separators=(',', ':'))
+
+def iter_json_document(rows, meta):
+    """Stream {"data": [rows...], **meta} as JSON text, serializing rows in chunks.
+
+    Produces the same bytes as jsonify() without building the whole body in memory.
+    """
+    dumps = compact_json_dumps
+    yield '{"data":['
+    for offset in range(0, len(rows), STREAM_CHUNK_ROWS):
+        chunk = ','.join(dumps(row) for row in rows[offset:offset + STREAM_CHUNK_ROWS])
+        yield chunk if offset == 0 else ',' + chunk
+    yield ']'
+    for key, value in meta.items():
+        yield f",{dumps(key)}:{dumps(value)}"
+    yield '}\n'
+
+def iter_ndjson(rows, meta):
+    """Stream a {"meta": {...}} line followed by one JSON object per row"""
+    dumps = compact_json_dumps
+    yield dumps({'meta': meta}) + '\n'
+    for offset in range(0, len(rows), STREAM_CHUNK_ROWS):
+        yield ''.join(dumps(row) + '\n' for row in rows[offset:offset + STREAM_CHUNK_ROWS])
+
+# Serialized JSON responses of closed windows, served again (or answered with 304) without querying
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 128))
+# Cache-Control max-age of closed past dates and ranges; week/month are capped at their rollover
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 86400))
+
+response_cache = ResultCache(MemoryBackend(max_entries=RESPONSE_CACHE_SIZE))
+
+def closed_window_expiry(date_param=None, start_dt=None, end_dt=None):
+    """Return until when the response of a date mode can be reused, or None while its data can still change.
+
+    A window is closed ROLLUP_SETTLE_HOURS after its end (late CDR rows of long calls).
+    date=week|month is reused from then until the period rolls over.
+    """
+    now = time.time()
+    period = date_param.lower() if date_param else None
+    if period in ('week', 'month'):
+        _, end, rollover = closed_period_bounds(period)
+        if datetime.combine(end, datetime.min.time()) + timedelta(hours=ROLLUP_SETTLE_HOURS) > datetime.now():
+            return None
+        return min(datetime.combine(rollover, datetime.min.time()).timestamp(), now + HTTP_CACHE_MAX_AGE)
+
+    _, end = calldate_window(date_param, start_dt, end_dt)
+    if end + timedelta(hours=ROLLUP_SETTLE_HOURS) > datetime.now():
+        return None
+    return now + HTTP_CACHE_MAX_AGE
+
+def response_cache_key(endpoint, params):
+    """Key of a response: endpoint plus the sorted (name, value) query parameters"""
+    return f"{endpoint}?{urlencode(sorted(params))}"
+
+def cached_json_response(entry, expires_at=None):
+    """Response of a json_entry with ETag/Last-Modified; 304 when the client already has it"""
+    headers = cache_headers(entry, expires_at)
+    if is_not_modified(entry, request.headers):
+        return Response(status=304, headers=headers)
+    return Response(entry['body'], mimetype='application/json', headers=headers)
 
 @app.route('/api/v1/<token>/callstat', methods=['GET'])
 def get_call_stats(token):
@@ -354,9 +945,22 @@ def get_call_stats(token):
       - If HH:MM missing: start defaults to 00:00, end defaults to 23:59
       - Validate start <= end
       - When date='week' or 'month' is provided, existing aggregation logic is used unchanged.
+      - format=json (default) | stream (same document, sent in chunks) | ndjson (one object per line)
+      - source=remote | local (ingested copy, see INGEST_PATH) | live (in-memory aggregates, see
+        LIVE_STATS); defaults to STATS_SOURCE
+      - hours=N: from the start of the hour N - 1 hours ago up to now (instead of start/end)
+      - top=N: only the N extensions with the most call time
+      - approx=1: unique_calls, call_count and long_calls_count estimated with HyperLogLog sketches
+        (CDR scans only, see sketches.py)
+      - profile=NAME: filter profile (extension ranges, internal destinations, dispositions; see
+        FILTER_PROFILES_FILE); a profile's own token reads only that profile
     """
-    # Validate token
-    if token != API_TOKEN:
+    # Validate token and filter profile
+    try:
+        profile = request_profile(token, request.args.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if profile is None:
         return jsonify({'error': 'Invalid token'}), 401
 
     # Get parameters
@@ -364,121 +968,290 @@ def get_call_stats(token):
     start_param = request.args.get('start')
     end_param = request.args.get('end')
 
-    # Helper to parse date or date-time with defaults for time
-    def _parse_dt(value: str, is_start: bool):
-        value = value.strip()
-        fmts = ['%Y-%m-%d %H:%M', '%Y-%m-%d']
-        last_exc = None
-        for fmt in fmts:
-            try:
-                dt = datetime.strptime(value, fmt)
-                # If format had no time (date only), set default time
-                if fmt == '%Y-%m-%d':
-                    if is_start:
-                        dt = dt.replace(hour=0, minute=0)
-                    else:
-                        dt = dt.replace(hour=23, minute=59)
-                return dt
-            except ValueError as e:
-                last_exc = e
-        raise ValueError(str(last_exc) if last_exc else 'Invalid date-time')
+    output_format = (request.args.get('format') or 'json').lower()
+    if output_format not in STATS_OUTPUT_FORMATS:
+        return jsonify({'error': 'Invalid format. Use json, stream or ndjson'}), 400
+
+    source = (request.args.get('source') or STATS_SOURCE).lower()
+    if source not in STATS_SOURCES:
+        return jsonify({'error': 'Invalid source. Use remote, local or live'}), 400
+
+    try:
+        top = parse_top_param(request.args.get('top'))
+        approx = parse_approx_param(request.args.get('approx'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Determine mode: week/month vs date range
     use_week_or_month = bool(date_param and date_param.lower() in ['week', 'month'])
 
-    start_dt = None
-    end_dt = None
-    range_label = None
+    try:
+        start_dt, end_dt, range_label = parse_range_params(date_param, start_param, end_param,
+                                                           request.args.get('hours'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Closed windows are answered from the response cache (304 when the client has the ETag)
+    expires_at = None
+    if output_format == 'json':
+        expires_at = closed_window_expiry(date_param if use_week_or_month else None, start_dt, end_dt)
+        cache_key = response_cache_key(profile_endpoint('callstat', profile), request.args.items(multi=True))
+        entry = response_cache.get(cache_key) if expires_at else None
+        if entry is not None:
+            return cached_json_response(entry, expires_at)
 
+    # Query all databases in parallel
     if use_week_or_month:
-        # No additional validation needed here; handled in query functions
-        pass
+        all_results = fan_out(query_coalesced, query_period_cached,
+                              period_cache_endpoint('callstat', approx, profile, source),
+                              query_database, date_param, source=source, approx=approx, profile=profile)
     else:
-        # Build a date range
-        try:
-            if start_param or end_param:
-                if not start_param or not end_param:
-                    return jsonify({'error': 'Both start and end must be provided when using a custom range'}), 400
-                start_dt_obj = _parse_dt(start_param, is_start=True)
-                end_dt_obj = _parse_dt(end_param, is_start=False)
-            else:
-                # Backward-compatible behavior with ?date=YYYY-MM-DD or missing both -> today
-                if not date_param:
-                    base_date = datetime.now().strftime('%Y-%m-%d')
-                else:
-                    # Validate plain date
-                    try:
-                        datetime.strptime(date_param, '%Y-%m-%d')
-                    except ValueError:
-                        return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD, "week", or "month"'}), 400
-                    base_date = date_param
-                start_dt_obj = datetime.strptime(base_date + ' 00:00', '%Y-%m-%d %H:%M')
-                end_dt_obj = datetime.strptime(base_date + ' 23:59', '%Y-%m-%d %H:%M')
-
-            # Validate ordering
-            if start_dt_obj > end_dt_obj:
-                return jsonify({'error': 'Invalid range: start must be less than or equal to end'}), 400
-
-            # Format as strings with seconds for MySQL
-            start_dt = start_dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-            end_dt = end_dt_obj.strftime('%Y-%m-%d %H:%M:%S')
-            range_label = f"{start_dt_obj.strftime('%Y-%m-%d %H:%M')} - {end_dt_obj.strftime('%Y-%m-%d %H:%M')}"
-        except ValueError:
-            return jsonify({'error': 'Invalid date-time format. Use YYYY-MM-DD HH:MM or YYYY-MM-DD'}), 400
+        all_results = fan_out(query_coalesced, query_database, date_param=None, start_dt=start_dt, end_dt=end_dt,
+                              source=source, approx=approx, profile=profile)
+
+    # Combine results; combine_results already builds each row with the response field order
+    with span('combine'):
+        combined_data, errors = combine_results(all_results, top=top)
+    del all_results
 
-    # Query all databases
-    all_results = {}
-    for db_config in db_configs:
-        if use_week_or_month:
-            all_results[db_config['name']] = query_database(db_config, date_param=date_param)
-        else:
-            all_results[db_config['name']] = query_database(db_config, date_param=None, start_dt=start_dt, end_dt=end_dt)
-
-    # Combine results
-    combined_data, errors = combine_results(all_results)
-    
-    # Reorder fields in each record using OrderedDict
-    reordered_data = []
-    for item in combined_data:
-        reordered_item = OrderedDict([
-            ('cnum', item['cnum']),
-            ('cnam', item['cnam']),
-            ('call_count', item['call_count']),
-            ('total_call_time_minutes', item['total_call_time_minutes']),
-            ('long_calls_count', item['long_calls_count']),
-            ('total_long_calls_minutes', item['total_long_calls_minutes']),
-            ('unique_calls', item['unique_calls'])
-        ])
-        reordered_data.append(reordered_item)
-    
-    # Prepare response with OrderedDict
     if use_week_or_month:
-        response = OrderedDict([
-            ('data', reordered_data),
+        meta = OrderedDict([
             ('date', date_param)
         ])
     else:
-        response = OrderedDict([
-            ('data', reordered_data),
+        meta = OrderedDict([
             ('start', start_dt),
             ('end', end_dt),
             ('date', range_label)
         ])
 
+    if profile != filter_profiles.default:
+        meta['profile'] = profile.name
+    if approx:
+        meta['approx'] = approx_meta()
     if errors:
-        response['errors'] = errors
+        meta['errors'] = errors
+
+    # X-Accel-Buffering: nginx buffers (and caches) responses; streams are passed through as they are produced
+    if output_format == 'ndjson':
+        return Response(iter_ndjson(combined_data, meta), mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'})
+    if output_format == 'stream':
+        return Response(iter_json_document(combined_data, meta), mimetype='application/json',
+                        headers={'X-Accel-Buffering': 'no'})
+
+    response = OrderedDict([('data', combined_data)])
+    response.update(meta)
+
+    with span('serialize'):
+        entry = json_entry(compact_json_dumps(response) + '\n')
+    if errors:
+        expires_at = None
+    elif expires_at:
+        response_cache.set(cache_key, entry, expires_at)
+    return cached_json_response(entry, expires_at)
+
+@app.route('/api/v1/<token>/pool', methods=['GET'])
+def get_pool_stats(token):
+    """Connection pool statistics per database, for sizing DB_POOL_MAX_SIZE"""
+    # Validate token
+    if token != API_TOKEN:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    stats = OrderedDict()
+    for db_config in db_configs:
+        stats[db_config['name']] = get_pool(db_config).stats()
+
+    return jsonify(stats)
+
+@app.route('/api/v1/<token>/databases', methods=['GET'])
+def get_database_stats(token):
+    """Configured databases with their weight, timeout and circuit breaker state"""
+    # Validate token
+    if token != API_TOKEN:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    return jsonify(db_registry.stats())
+
+@app.route('/api/v1/<token>/cache', methods=['GET'])
+def get_cache_stats(token):
+    """Week/month result cache statistics"""
+    # Validate token
+    if token != API_TOKEN:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    return jsonify(result_cache.stats())
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint != 'get_metrics':
+        metrics.request_seconds.observe(
+            time.perf_counter() - started, endpoint=request.endpoint or 'unknown', status=response.status_code
+        )
+    return response
+
+@metrics.registry.collector
+def collect_component_stats():
+    """Pool, result cache and extension directory counters at scrape time"""
+    pool_samples = {}
+    for db_config in db_configs:
+        pool = db_pools.get(db_config['name'])
+        if pool is None:
+            continue
+        for key, value in pool.stats().items():
+            pool_samples.setdefault(key, []).append(({'db': db_config['name']}, value))
+
+    collected = []
+    gauges = ('max_size', 'open', 'idle', 'in_use')
+    for key, samples in pool_samples.items():
+        if key in gauges:
+            collected.append((f"callstat_pool_{key}", 'gauge', f"Connection pool {key.replace('_', ' ')}", samples))
+        else:
+            collected.append((f"callstat_pool_{key}_total", 'counter', f"Connection pool {key.replace('_', ' ')}", samples))
+
+    collected.append(("callstat_boot_seconds", 'gauge', "Seconds spent per worker boot phase",
+                      [({'phase': phase}, seconds) for phase, seconds in boot_seconds.items()]))
+    collected.append(("callstat_ready", 'gauge', "1 once warm-up has finished with a valid configuration",
+                      [({}, int(warmup_state['finished'] and not warmup_state['problems']))]))
+
+    database_stats = db_registry.stats()
+    collected.append(("callstat_db_circuit_open", 'gauge', "Database skipped by an open circuit breaker",
+                      [({'db': name}, int(stats['circuit_open'])) for name, stats in database_stats.items()]))
+    collected.append(("callstat_db_circuit_trips_total", 'counter', "Circuit breaker trips",
+                      [({'db': name}, stats['trips']) for name, stats in database_stats.items()]))
 
-    return jsonify(response)
+    cache_stats = result_cache.stats()
+    for key in ('hits', 'misses', 'expired', 'stores', 'evictions'):
+        collected.append((f"callstat_result_cache_{key}_total", 'counter', f"Result cache {key}", [({}, cache_stats[key])]))
+    collected.append(("callstat_result_cache_entries", 'gauge', "Result cache entries", [({}, cache_stats['entries'])]))
+
+    response_stats = response_cache.stats()
+    for key in ('hits', 'misses', 'expired', 'stores', 'evictions'):
+        collected.append((f"callstat_response_cache_{key}_total", 'counter', f"Response cache {key}",
+                          [({}, response_stats[key])]))
+    collected.append(("callstat_response_cache_entries", 'gauge', "Response cache entries",
+                      [({}, response_stats['entries'])]))
+
+    flight_stats = single_flight.stats()
+    for key in ('leaders', 'followers', 'shared_hits', 'lock_timeouts'):
+        collected.append((f"callstat_single_flight_{key}_total", 'counter',
+                          f"Single-flight {key.replace('_', ' ')}", [({}, flight_stats[key])]))
+
+    if live_stats is not None:
+        collected.append(("callstat_live_lag_seconds", 'gauge', "Seconds since the last successful live stats poll",
+                          [({'db': name}, lag) for name, lag in live_stats.lag_seconds().items() if lag is not None]))
+
+    statement_stats = query_compiler.cache_stats()
+    for key in ('hits', 'misses'):
+        collected.append((f"callstat_statement_cache_{key}_total", 'counter', f"Compiled statement cache {key}",
+                          [({}, statement_stats[key])]))
+
+    directory_stats = extension_directory.stats()
+    for key in ('hits', 'probes', 'reloads', 'changes'):
+        collected.append((f"callstat_extension_directory_{key}_total", 'counter',
+                          f"Extension directory {key}", [({}, directory_stats[key])]))
+    return collected
+
+@app.route('/api/v1/<token>/metrics', methods=['GET'])
+def get_metrics(token):
+    """Prometheus text exposition of phase timings, request durations and component counters"""
+    # Validate token
+    if token != API_TOKEN:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/v1/<token>/ingest', methods=['GET'])
+def get_ingest_status(token):
+    """Progress of the local CDR copy per database"""
+    # Validate token
+    if token != API_TOKEN:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    if local_store is None:
+        return jsonify({'error': 'Local ingestion is disabled (set INGEST_PATH)'}), 404
+
+    return jsonify(local_store.status())
+
+@app.route('/api/v1/<token>/live', methods=['GET'])
+def get_live_status(token):
+    """Coverage and lag of the in-memory aggregates per database"""
+    # Validate token
+    if token != API_TOKEN:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    if live_stats is None:
+        return jsonify({'error': 'Live stats are disabled (set LIVE_STATS=1)'}), 404
+
+    return jsonify(live_stats.status())
 
 @app.route('/api/v1/<token>/asrstat', methods=['GET'])
 def get_asr_stats(token):
-        """Get ASR statistics by country code prefix from multiple databases"""
-        # Validate token
-        if token != API_TOKEN:
+        """Get ASR statistics by country code prefix from multiple databases.
+
+        Accepts date=YYYY-MM-DD|week|month, a custom range start=YYYY-MM-DD[ HH:MM]&end=YYYY-MM-DD[ HH:MM]
+        or hours=N with the same rules as /callstat, source=remote|local|live, approx=1 (counts
+        estimated with HyperLogLog sketches per destination prefix) and profile=NAME.
+        """
+        # Validate token and filter profile
+        try:
+            profile = request_profile(token, request.args.get('profile'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if profile is None:
             return jsonify({'error': 'Invalid token'}), 401
 
-        # Get date parameter
+        # Get date parameters
         date_param = request.args.get('date')
+        start_param = request.args.get('start')
+        end_param = request.args.get('end')
+        hours_param = request.args.get('hours')
+
+        source = (request.args.get('source') or STATS_SOURCE).lower()
+        if source not in STATS_SOURCES:
+            return jsonify({'error': 'Invalid source. Use remote, local or live'}), 400
+
+        try:
+            approx = parse_approx_param(request.args.get('approx'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        use_range = bool((start_param or end_param or hours_param)
+                         and not (date_param and date_param.lower() in ['week', 'month']))
+
+        cache_key = response_cache_key(profile_endpoint('asrstat', profile), request.args.items(multi=True))
+
+        if use_range:
+            try:
+                start_dt, end_dt, range_label = parse_range_params(None, start_param, end_param, hours_param)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            expires_at = closed_window_expiry(None, start_dt, end_dt)
+            entry = response_cache.get(cache_key) if expires_at else None
+            if entry is not None:
+                return cached_json_response(entry, expires_at)
+
+            # Query all databases in parallel
+            all_results = fan_out(query_coalesced, query_asr_database, None, start_dt=start_dt, end_dt=end_dt,
+                                  source=source, approx=approx, profile=profile)
+
+            response = OrderedDict([
+                ('date', range_label),
+                ('start', start_dt),
+                ('end', end_dt),
+                ('databases', all_results)
+            ])
+            if profile != filter_profiles.default:
+                response['profile'] = profile.name
+            if approx:
+                response['approx'] = approx_meta()
+            return asr_json_response(response, cache_key, expires_at)
 
         # Validate date format
         if not date_param:
@@ -490,116 +1263,91 @@ def get_asr_stats(token):
             except ValueError:
                 return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD, "week", or "month"'}), 400
 
-        # Query all databases
-        all_results = {}
-        for db_config in db_configs:
-            all_results[db_config['name']] = query_asr_database(db_config, date_param)
+        expires_at = closed_window_expiry(date_param)
+        entry = response_cache.get(cache_key) if expires_at else None
+        if entry is not None:
+            return cached_json_response(entry, expires_at)
+
+        # Query all databases in parallel
+        all_results = fan_out(query_coalesced, query_period_cached,
+                              period_cache_endpoint('asrstat', approx, profile, source),
+                              query_asr_database, date_param, source=source, approx=approx, profile=profile)
 
         # Prepare response with results from each database separately
         response = OrderedDict([
             ('date', date_param),
             ('databases', all_results)
         ])
+        if profile != filter_profiles.default:
+            response['profile'] = profile.name
+        if approx:
+            response['approx'] = approx_meta()
 
-        return jsonify(response)
+        return asr_json_response(response, cache_key, expires_at)
+
+def asr_json_response(response, cache_key, expires_at):
+        """Serialize an /asrstat response, caching it when the window is closed and every database answered"""
+        entry = json_entry(compact_json_dumps(response) + '\n')
+        if any('error' in result for result in response['databases'].values()):
+            expires_at = None
+        elif expires_at:
+            response_cache.set(cache_key, entry, expires_at)
+        return cached_json_response(entry, expires_at)
+
+def query_asr_database(db_config, date_param=None, start_dt=None, end_dt=None, source=None, approx=False,
+                       profile=None):
+        """Query a single database for ASR statistics by country code prefix
+
+        Date, source, approx and profile arguments are interpreted as in query_database (see calldate_window).
+        """
+        profile = profile or filter_profiles.default
+        start, end = calldate_window(date_param, start_dt, end_dt)
+        if use_live_source(db_config, start, end, source, profile):
+            return live_stats.view(
+                db_config['name'], 'asr', start, end,
+                lambda dst_rows, trie: {
+                    'status': 'success',
+                    'data': aggregate_by_country(dst_rows, trie)
+                }
+            )
+        if use_local_source(db_config, start, end, source, profile):
+            return {
+                'status': 'success',
+                'data': aggregate_by_country(
+                    local_store.asr_dst_rows(db_config['name'], start, end),
+                    local_store.country_trie(db_config['name'])
+                )
+            }
 
-def query_asr_database(db_config, date_param):
-        """Query a single database for ASR statistics by country code prefix"""
         connection = get_connection(db_config)
         if not connection:
             return {
                 'error': f"Failed to connect to {db_config['name']} at {db_config['host']}:{db_config['port']}"
             }
 
+        failed = False
         try:
             with connection.cursor() as cursor:
-                # Determine which query to use based on date_param
-                if date_param.lower() == 'week':
-                    cursor.execute("USE asteriskcdrdb")
-                    query = """
-                        SELECT 
-                            get_country_code(cdr.dst) AS country_code,
-                            cc.country,
-                            COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) AS answered_calls,
-                            COUNT(DISTINCT cdr.uniqueid) AS total_calls,
-                            ROUND((COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) / 
-                                   COUNT(DISTINCT cdr.uniqueid)) * 100, 2) AS asr_percentage,
-                            COUNT(DISTINCT cdr.dst) AS unique_destinations,
-                            ROUND(SUM(CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.billsec ELSE 0 END) / 60, 2) AS total_talk_minutes
-                        FROM asteriskcdrdb.cdr
-                        LEFT JOIN asteriskcdrdb.country_codes cc ON cc.code = get_country_code(cdr.dst)
-                        WHERE calldate >= DATE_SUB(CURRENT_DATE, INTERVAL WEEKDAY(CURRENT_DATE) + 7 DAY)
-                          AND calldate < DATE_SUB(CURRENT_DATE, INTERVAL WEEKDAY(CURRENT_DATE) + 2 DAY)
-                          AND cdr.lastapp = 'Dial'
-                          AND cdr.disposition IN ('ANSWERED', 'NO ANSWER', 'BUSY', 'FAILED')
-                          AND cdr.dst NOT REGEXP '^[0-9]{4}$' -- Excluding 4-digit internal calls
-                        GROUP BY get_country_code(cdr.dst), cc.country
-                        ORDER BY total_calls DESC
-                    """
-                    cursor.execute(query)
-                elif date_param.lower() == 'month':
-                    cursor.execute("USE asteriskcdrdb")
-                    query = """
-                       SELECT 
-                            get_country_code(cdr.dst) AS country_code,
-                            cc.country,
-                            COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) AS answered_calls,
-                            COUNT(DISTINCT cdr.uniqueid) AS total_calls,
-                            ROUND((COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) / 
-                                   COUNT(DISTINCT cdr.uniqueid)) * 100, 2) AS asr_percentage,
-                            COUNT(DISTINCT cdr.dst) AS unique_destinations,
-                            ROUND(SUM(CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.billsec ELSE 0 END) / 60, 2) AS total_talk_minutes
-                        FROM asteriskcdrdb.cdr
-                        LEFT JOIN asteriskcdrdb.country_codes cc ON cc.code = get_country_code(cdr.dst)
-                        WHERE calldate >= DATE_FORMAT(DATE_SUB(CURRENT_DATE, INTERVAL 1 MONTH), '%Y-%m-01')
-                          AND calldate < DATE_FORMAT(CURRENT_DATE, '%Y-%m-01')
-                          AND cdr.lastapp = 'Dial'
-                          AND cdr.disposition IN ('ANSWERED', 'NO ANSWER', 'BUSY', 'FAILED')
-                          AND cdr.dst NOT REGEXP '^[0-9]{4}$' -- Excluding 4-digit internal calls
-                        GROUP BY get_country_code(cdr.dst), cc.country
-                        ORDER BY total_calls DESC
-                    """
-                    cursor.execute(query)
+                with span('country_codes', db_config['name']):
+                    trie = country_directory.get(db_config['name'], cursor)
+                if approx:
+                    # Destinations are grouped by their first characters, enough to find the country (+ a leading '+')
+                    with span('execute', db_config['name']):
+                        cursor.execute("SET SESSION group_concat_max_len = 4294967295")
+                        statements.execute(cursor, *build_asr_sketch_query(start, end, trie.max_code_length + 1, profile))
+                    with span('fetchall', db_config['name']):
+                        prefix_rows = cursor.fetchall()
+                    with span('group', db_config['name']):
+                        results = aggregate_sketches_by_country(prefix_rows, trie, APPROX_PRECISION)
                 else:
-                    cursor.execute("USE asteriskcdrdb")
-                    # Query for specific date
-                    query = """
-                        SELECT 
-                            get_country_code(cdr.dst) AS country_code,
-                            cc.country,
-                            COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) AS answered_calls,
-                            COUNT(DISTINCT cdr.uniqueid) AS total_calls,
-                            ROUND((COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) / 
-                                   COUNT(DISTINCT cdr.uniqueid)) * 100, 2) AS asr_percentage,
-                            COUNT(DISTINCT cdr.dst) AS unique_destinations,
-                            ROUND(SUM(CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.billsec ELSE 0 END) / 60, 2) AS total_talk_minutes
-                        FROM asteriskcdrdb.cdr
-                        LEFT JOIN asteriskcdrdb.country_codes cc ON cc.code = get_country_code(cdr.dst)
-                        WHERE DATE(cdr.calldate) = %s -- You can adjust this date range as needed
-                          AND cdr.lastapp = 'Dial'
-                          AND cdr.disposition IN ('ANSWERED', 'NO ANSWER', 'BUSY', 'FAILED')
-                          AND cdr.dst NOT REGEXP '^[0-9]{4}$' -- Excluding 4-digit internal calls
-                        GROUP BY get_country_code(cdr.dst), cc.country
-                        ORDER BY total_calls DESC
-                    """
-                    cursor.execute(query, (date_param,))
-
-                results = cursor.fetchall()
-
-                # Convert Decimal objects to float for JSON serialization and add country name
-                for row in results:
-                    if 'answered_calls' in row:
-                        row['answered_calls'] = int(row['answered_calls'])
-                    if 'total_calls' in row:
-                        row['total_calls'] = int(row['total_calls'])
-                    if 'asr_percentage' in row:
-                        row['asr_percentage'] = round(float(row['asr_percentage']), 2)
-                    if 'unique_destinations' in row:
-                        row['unique_destinations'] = int(row['unique_destinations'])
-                    if 'total_talk_minutes' in row:
-                        row['total_talk_minutes'] = round(float(row['total_talk_minutes']), 2)
-                    if 'country_code' in row:
-                        row['country_code'] = str(row['country_code'])
+                    with span('execute', db_config['name']):
+                        statements.execute(cursor, *build_asr_query(start, end, profile))
+                    with span('fetchall', db_config['name']):
+                        dst_rows = cursor.fetchall()
+
+                    # Map destinations to countries by longest prefix and group them in Python
+                    with span('group', db_config['name']):
+                        results = aggregate_by_country(dst_rows, trie)
 
                 return {
                     'status': 'success',
@@ -608,16 +1356,760 @@ def query_asr_database(db_config, date_param):
 
         except Exception as e:
             logger.error(f"Error querying {db_config['name']} for ASR stats: {str(e)}")
-            import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
+            failed = True
             return {
                 'error': f"Error querying {db_config['name']}: {str(e)}"
             }
 
         finally:
-            if connection and connection.open:
-                connection.close()
+            release_connection(db_config, connection, discard=failed)
+            db_registry.record(db_config, not failed)
+
+# Upper bound on periods per /batch request (each adds a CASE bucket to the scan)
+BATCH_MAX_PERIODS = int(os.getenv('BATCH_MAX_PERIODS', 6))
+BATCH_METRICS = ('callstat', 'asrstat')
+# Values of /batch's source parameter: the in-memory aggregates cannot answer its periods
+BATCH_SOURCES = ('remote', 'local')
+
+def parse_batch_periods(periods_param, start_param, end_param):
+    """Turn the /batch `periods` list (plus an optional start/end range) into period specs.
+
+    Returns a list of dicts with key, kind ('period', 'date' or 'range'), date_param
+    ('week'/'month' for closed periods, else None), start_dt, end_dt, range_label and date.
+    Raises ValueError with a client-facing message on invalid input.
+    """
+    items = [item.strip() for item in (periods_param or '').split(',') if item.strip()]
+    periods = []
+    for item in items:
+        if item.lower() in ['week', 'month']:
+            periods.append({'key': item.lower(), 'kind': 'period', 'date_param': item.lower(),
+                            'start_dt': None, 'end_dt': None, 'range_label': None, 'date': item.lower()})
+            continue
+        date_param = None if item.lower() == 'today' else item
+        start_dt, end_dt, range_label = parse_range_params(date_param, None, None)
+        periods.append({'key': item, 'kind': 'date', 'date_param': None,
+                        'start_dt': start_dt, 'end_dt': end_dt, 'range_label': range_label,
+                        'date': start_dt[:10]})
+
+    if start_param or end_param:
+        start_dt, end_dt, range_label = parse_range_params(None, start_param, end_param)
+        periods.append({'key': range_label, 'kind': 'range', 'date_param': None,
+                        'start_dt': start_dt, 'end_dt': end_dt, 'range_label': range_label,
+                        'date': range_label})
+
+    if not periods:
+        raise ValueError('No periods given. Use periods=YYYY-MM-DD|today|week|month,... and/or start/end')
+    if len(periods) > BATCH_MAX_PERIODS:
+        raise ValueError(f"Too many periods (at most {BATCH_MAX_PERIODS})")
+    return periods
+
+def query_batch_database(db_config, periods, metrics, source=None, profile=None):
+    """Query a single database for several periods and metric families with one CDR scan.
+
+    Closed week/month periods already in the result cache (shared with /callstat and
+    /asrstat) are not scanned again. Returns {'status', 'data': {period key: {metric: rows}}}.
+    """
+    profile = profile or filter_profiles.default
+    data = OrderedDict((period['key'], {}) for period in periods)
+    pending = []  # (period, start, end, metrics still to compute)
+    for period in periods:
+        start, end = calldate_window(period['date_param'], period['start_dt'], period['end_dt'])
+        missing = []
+        for metric in metrics:
+            cached = None
+            if period['date_param']:
+                endpoint = period_cache_endpoint(metric, profile=profile, source=source)
+                cached = result_cache.get(period_cache_key(endpoint, period['date_param'], db_config['name'])[0])
+            if cached is not None:
+                data[period['key']][metric] = cached['data']
+            else:
+                missing.append(metric)
+        if missing:
+            pending.append((period, start, end, missing))
+
+    if not pending:
+        return {'status': 'success', 'data': data}
+
+    # Answer from the ingested copy when it covers every pending window
+    if all(use_local_source(db_config, start, end, source, profile) for _, start, end, _ in pending):
+        for period, start, end, missing in pending:
+            for metric in missing:
+                query_func = query_database if metric == 'callstat' else query_asr_database
+                result = query_func(db_config, period['date_param'], start_dt=period['start_dt'],
+                                    end_dt=period['end_dt'], source='local', profile=profile)
+                data[period['key']][metric] = result['data']
+        return {'status': 'success', 'data': data}
+
+    scan_metrics = [metric for metric in metrics if any(metric in missing for *_, missing in pending)]
+
+    connection = get_connection(db_config)
+    if not connection:
+        return {
+            'error': f"Failed to connect to {db_config['name']} at {db_config['host']}:{db_config['port']}"
+        }
+
+    failed = False
+    try:
+        with connection.cursor() as cursor:
+            with span('extensions', db_config['name']):
+                extensions = (extension_directory.get(db_config['name'], cursor, profile)
+                              if 'callstat' in scan_metrics else None)
+            with span('country_codes', db_config['name']):
+                trie = country_directory.get(db_config['name'], cursor) if 'asrstat' in scan_metrics else None
+
+            with span('execute', db_config['name']):
+                statements.execute(cursor, *build_batch_query([(start, end) for _, start, end, _ in pending],
+                                                              scan_metrics, profile))
+            with span('fetchall', db_config['name']):
+                batch_rows = cursor.fetchall()
+
+            callstat_rows = [[] for _ in pending]
+            asr_by_dst = [{} for _ in pending]
+            for row in batch_rows:
+                if row['dst'] is None:
+                    # Per-(cnum, cnam) rollup rows; the per-cnum and grand total rows are skipped
+                    if row['ext_cnam'] is None or 'callstat' not in scan_metrics:
+                        continue
+                    for i in range(len(pending)):
+                        if row[f'callstat_call_count_{i}']:
+                            callstat_rows[i].append({
+                                'cnum': row['ext_cnum'],
+                                'cnam': row['ext_cnam'],
+                                'unique_calls': int(row[f'callstat_unique_calls_{i}']),
+                                'call_count': int(row[f'callstat_call_count_{i}']),
+                                'total_call_time_minutes': round(int(row[f'callstat_billsec_{i}'] or 0) / 60, 2),
+                                'long_calls_count': int(row[f'callstat_long_calls_count_{i}']),
+                                'total_long_calls_minutes': round(int(row[f'callstat_long_billsec_{i}'] or 0) / 60, 2),
+                            })
+                elif 'asrstat' in scan_metrics:
+                    # (cnum, cnam, dst) rows: sum the destination's aggregates over extensions
+                    for i in range(len(pending)):
+                        if row[f'asrstat_total_calls_{i}']:
+                            agg = asr_by_dst[i].setdefault(
+                                row['dst'], {'dst': row['dst'], 'answered_calls': 0, 'total_calls': 0, 'talk_billsec': 0}
+                            )
+                            agg['answered_calls'] += int(row[f'asrstat_answered_calls_{i}'])
+                            agg['total_calls'] += int(row[f'asrstat_total_calls_{i}'])
+                            agg['talk_billsec'] += int(row[f'asrstat_talk_billsec_{i}'] or 0)
+
+            for i, (period, _, _, missing) in enumerate(pending):
+                results = {}
+                if 'callstat' in missing:
+                    callstat_rows[i].sort(key=lambda row: row['total_call_time_minutes'], reverse=True)
+                    results['callstat'] = merge_extension_rows(callstat_rows[i], extensions, db_config['name'])
+                if 'asrstat' in missing:
+                    with span('group', db_config['name']):
+                        results['asrstat'] = aggregate_by_country(asr_by_dst[i].values(), trie)
+
+                for metric, rows in results.items():
+                    data[period['key']][metric] = rows
+                    if period['date_param']:
+                        endpoint = period_cache_endpoint(metric, profile=profile, source=source)
+                        key, expires_at = period_cache_key(endpoint, period['date_param'], db_config['name'])
+                        if expires_at is not None:
+                            result_cache.set(key, {'status': 'success', 'data': rows}, expires_at)
+
+            return {
+                'status': 'success',
+                'data': data
+            }
+
+    except Exception as e:
+        logger.error(f"Error querying {db_config['name']} for batch stats: {str(e)}")
+        failed = True
+        return {
+            'error': f"Error querying {db_config['name']}: {str(e)}"
+        }
+
+    finally:
+        release_connection(db_config, connection, discard=failed)
+        db_registry.record(db_config, not failed)
+
+@app.route('/api/v1/<token>/batch', methods=['GET'])
+def get_batch_stats(token):
+    """Call and/or ASR statistics for several periods with one CDR scan per database.
+
+    Query params:
+      - periods=YYYY-MM-DD|today|week|month,... and/or start=YYYY-MM-DD[ HH:MM]&end=YYYY-MM-DD[ HH:MM]
+      - metrics=callstat,asrstat (default both)
+      - source=remote | local and profile=NAME, as for /callstat (source=live is rejected)
+    Each period entry holds the same documents /callstat and /asrstat return for it.
+    """
+    # Validate token and filter profile
+    try:
+        profile = request_profile(token, request.args.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if profile is None:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    metrics = [metric.strip().lower() for metric in (request.args.get('metrics') or ','.join(BATCH_METRICS)).split(',')]
+    if not metrics or any(metric not in BATCH_METRICS for metric in metrics):
+        return jsonify({'error': 'Invalid metrics. Use callstat and/or asrstat'}), 400
+    metrics = [metric for metric in BATCH_METRICS if metric in metrics]
+
+    # A live STATS_SOURCE default reads the databases
+    source = (request.args.get('source') or (STATS_SOURCE if STATS_SOURCE in BATCH_SOURCES else 'remote')).lower()
+    if source not in BATCH_SOURCES:
+        return jsonify({'error': 'Invalid source. Use remote or local'}), 400
+
+    try:
+        periods = parse_batch_periods(request.args.get('periods'), request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    all_results = fan_out(query_coalesced, query_batch_database, periods, metrics, source=source, profile=profile)
+
+    def period_results(period, metric):
+        """Per-database result dicts of one period and metric, shaped like fan_out's"""
+        return OrderedDict(
+            (db_name, result if 'error' in result else {'status': 'success', 'data': result['data'][period['key']][metric]})
+            for db_name, result in all_results.items()
+        )
+
+    response_periods = []
+    for period in periods:
+        entry = OrderedDict([('period', period['key'])])
+
+        if 'callstat' in metrics:
+            with span('combine'):
+                combined_data, errors = combine_results(period_results(period, 'callstat'))
+            callstat = OrderedDict([('data', combined_data)])
+            if period['kind'] == 'period':
+                callstat['date'] = period['date']
+            else:
+                callstat['start'] = period['start_dt']
+                callstat['end'] = period['end_dt']
+                callstat['date'] = period['range_label']
+            if errors:
+                callstat['errors'] = errors
+            entry['callstat'] = callstat
+
+        if 'asrstat' in metrics:
+            asrstat = OrderedDict([('date', period['date'])])
+            if period['kind'] == 'range':
+                asrstat['start'] = period['start_dt']
+                asrstat['end'] = period['end_dt']
+            asrstat['databases'] = period_results(period, 'asrstat')
+            entry['asrstat'] = asrstat
+
+        response_periods.append(entry)
+
+    response = OrderedDict([('periods', response_periods)])
+    if profile != filter_profiles.default:
+        response['profile'] = profile.name
+    with span('serialize'):
+        return jsonify(response)
+
+# Bucket sizes of /timeseries and the most buckets one request may span
+TIMESERIES_BUCKETS = ('hour', 'day', 'week')
+TIMESERIES_MAX_BUCKETS = int(os.getenv('TIMESERIES_MAX_BUCKETS', 2000))
+
+def bucket_label(moment, bucket):
+    """Label of the bucket containing a date or datetime: 'YYYY-MM-DD HH:00' (hour), the day, or the week's Monday"""
+    if bucket == 'hour':
+        return moment.strftime('%Y-%m-%d %H:00')
+    day = moment.date() if isinstance(moment, datetime) else moment
+    if bucket == 'week':
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+def timeseries_buckets(start, end, bucket):
+    """Labels of every bucket overlapping the calldate window [start, end), in order"""
+    if bucket == 'hour':
+        moment, step = start.replace(minute=0, second=0, microsecond=0), timedelta(hours=1)
+    else:
+        moment = datetime.combine(start.date(), datetime.min.time())
+        if bucket == 'week':
+            moment -= timedelta(days=moment.weekday())
+        step = timedelta(days=7 if bucket == 'week' else 1)
+
+    labels = []
+    while moment < end:
+        labels.append(bucket_label(moment, bucket))
+        moment += step
+    return labels
+
+def query_timeseries_database(db_config, date_param=None, start_dt=None, end_dt=None, bucket='day', source=None,
+                              profile=None):
+    """Query a single database for per-extension call statistics per hour, day or week.
+
+    Day and week buckets are built from per-day aggregates: settled days come from the daily
+    rollups when ROLLUP_PATH is set, the rest from one grouped scan. Hour buckets always scan
+    the CDR. Rows hold the bucket label, cnum, cnam, unique_calls, call_count, raw billsec and
+    long call counters; extensions without calls in a bucket have no row.
+    """
+    profile = profile or filter_profiles.default
+    start, end = calldate_window(date_param, start_dt, end_dt)
+    if use_local_source(db_config, start, end, source, profile):
+        return {
+            'status': 'success',
+            'data': local_store.timeseries_rows(db_config['name'], start, end, bucket)
+        }
+
+    connection = get_connection(db_config)
+    if not connection:
+        return {
+            'error': f"Failed to connect to {db_config['name']} at {db_config['host']}:{db_config['port']}"
+        }
+
+    failed = False
+    try:
+        with connection.cursor() as cursor:
+            if bucket == 'hour':
+                with span('execute', db_config['name']):
+                    aggregates_by_moment = fetch_hourly_aggregates(cursor, start, end, profile)
+            else:
+                aggregates_by_moment = None
+                if rollup_store is not None:
+                    with span('rollup', db_config['name']):
+                        aggregates_by_moment = rollup_daily_aggregates(cursor, db_config, start, end, profile)
+                if aggregates_by_moment is None:
+                    with span('execute', db_config['name']):
+                        aggregates_by_moment = fetch_daily_aggregates(cursor, start, end, profile)
+
+            with span('merge', db_config['name']):
+                aggregates_by_bucket = {}
+                for moment, aggregates in aggregates_by_moment.items():
+                    rollup.merge_aggregates(aggregates_by_bucket.setdefault(bucket_label(moment, bucket), {}), aggregates)
+
+                rows = [
+                    {
+                        'bucket': label,
+                        'cnum': cnum,
+                        'cnam': cnam,
+                        'unique_calls': len(agg['dsts']),
+                        'call_count': agg['call_count'],
+                        'billsec': agg['billsec'],
+                        'long_calls_count': agg['long_calls_count'],
+                        'long_billsec': agg['long_billsec'],
+                    }
+                    for label, aggregates in aggregates_by_bucket.items()
+                    for (cnum, cnam), agg in aggregates.items()
+                ]
+
+            return {
+                'status': 'success',
+                'data': rows
+            }
+
+    except Exception as e:
+        logger.error(f"Error querying {db_config['name']} for time series: {str(e)}")
+        failed = True
+        return {
+            'error': f"Error querying {db_config['name']}: {str(e)}"
+        }
+
+    finally:
+        release_connection(db_config, connection, discard=failed)
+        db_registry.record(db_config, not failed)
+
+def combine_timeseries(all_results, top=None):
+    """Combine per-database time-series rows into one series per cnum.
+
+    Extensions are ordered by total call time over the whole window (like combine_results);
+    each series lists only its buckets with calls, in bucket order. unique_calls is summed
+    over databases, as in /callstat.
+    """
+    combined = {}  # cnum -> [cnam, total billsec, {bucket: [unique_calls, call_count, billsec, long_calls_count, long_billsec]}]
+    errors = []
+
+    for db_name, result in all_results.items():
+        if 'error' in result:
+            errors.append({db_name: result['error']})
+            continue
+
+        for row in result['data']:
+            extension = combined.get(row['cnum'])
+            if extension is None:
+                extension = combined[row['cnum']] = [row['cnam'], 0, {}]
+            elif not extension[0] and row['cnam']:
+                # Use the non-empty cnam if available
+                extension[0] = row['cnam']
+            extension[1] += row['billsec']
+
+            sums = extension[2].get(row['bucket'])
+            if sums is None:
+                sums = extension[2][row['bucket']] = [0, 0, 0, 0, 0]
+            sums[0] += row['unique_calls']
+            sums[1] += row['call_count']
+            sums[2] += row['billsec']
+            sums[3] += row['long_calls_count']
+            sums[4] += row['long_billsec']
+
+    if top is None:
+        extensions = sorted(combined.items(), key=lambda item: item[1][1], reverse=True)
+    else:
+        extensions = heapq.nlargest(top, combined.items(), key=lambda item: item[1][1])
+
+    combined_list = [
+        {
+            'cnum': cnum,
+            'cnam': cnam,
+            'total_call_time_minutes': round(total_billsec / 60, 2),
+            'series': [
+                {
+                    'bucket': label,
+                    'call_count': sums[1],
+                    'total_call_time_minutes': round(sums[2] / 60, 2),
+                    'long_calls_count': sums[3],
+                    'total_long_calls_minutes': round(sums[4] / 60, 2),
+                    'unique_calls': sums[0]
+                }
+                for label, sums in sorted(buckets.items())
+            ]
+        }
+        for cnum, (cnam, total_billsec, buckets) in extensions
+    ]
+
+    return combined_list, errors
+
+@app.route('/api/v1/<token>/timeseries', methods=['GET'])
+def get_timeseries(token):
+    """Per-extension call statistics per hour, day or week of a date, week, month or custom range.
+
+    Query params:
+      - bucket=hour | day (default) | week (weeks start on Monday)
+      - date=YYYY-MM-DD|week|month or start=YYYY-MM-DD[ HH:MM]&end=YYYY-MM-DD[ HH:MM], as for /callstat
+      - source=remote | local and profile=NAME, as for /callstat (source=live is rejected)
+      - top=N: only the N extensions with the most call time over the whole window
+    """
+    # Validate token and filter profile
+    try:
+        profile = request_profile(token, request.args.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if profile is None:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    date_param = request.args.get('date')
+    bucket = (request.args.get('bucket') or 'day').lower()
+    if bucket not in TIMESERIES_BUCKETS:
+        return jsonify({'error': 'Invalid bucket. Use hour, day or week'}), 400
+
+    source = (request.args.get('source') or STATS_SOURCE).lower()
+    if source not in STATS_SOURCES:
+        return jsonify({'error': 'Invalid source. Use remote, local or live'}), 400
+
+    try:
+        top = parse_top_param(request.args.get('top'))
+        start_dt, end_dt, range_label = parse_range_params(date_param, request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    use_week_or_month = start_dt is None
+
+    buckets = timeseries_buckets(*calldate_window(date_param, start_dt, end_dt), bucket)
+    if len(buckets) > TIMESERIES_MAX_BUCKETS:
+        return jsonify({'error': f"Too many buckets ({len(buckets)}, at most {TIMESERIES_MAX_BUCKETS}). "
+                                 f"Use a larger bucket or a shorter range"}), 400
+
+    # Closed windows are answered from the response cache (304 when the client has the ETag)
+    expires_at = closed_window_expiry(date_param if use_week_or_month else None, start_dt, end_dt)
+    cache_key = response_cache_key(profile_endpoint('timeseries', profile), request.args.items(multi=True))
+    entry = response_cache.get(cache_key) if expires_at else None
+    if entry is not None:
+        return cached_json_response(entry, expires_at)
+
+    if use_week_or_month:
+        all_results = fan_out(query_coalesced, query_period_cached, period_cache_endpoint(f"timeseries:{bucket}",
+                                                                                          profile=profile,
+                                                                                          source=source),
+                              query_timeseries_database, date_param, bucket=bucket, source=source, profile=profile)
+    else:
+        all_results = fan_out(query_coalesced, query_timeseries_database, date_param=None, start_dt=start_dt,
+                              end_dt=end_dt, bucket=bucket, source=source, profile=profile)
+
+    with span('combine'):
+        combined_data, errors = combine_timeseries(all_results, top=top)
+    del all_results
+
+    response = OrderedDict([('data', combined_data), ('bucket', bucket), ('buckets', buckets)])
+    if use_week_or_month:
+        response['date'] = date_param
+    else:
+        response['start'] = start_dt
+        response['end'] = end_dt
+        response['date'] = range_label
+    if profile != filter_profiles.default:
+        response['profile'] = profile.name
+    if errors:
+        response['errors'] = errors
+
+    with span('serialize'):
+        entry = json_entry(compact_json_dumps(response) + '\n')
+    if errors:
+        expires_at = None
+    elif expires_at:
+        response_cache.set(cache_key, entry, expires_at)
+    return cached_json_response(entry, expires_at)
+
+# Raw CDR export: rows fetched per round trip, concurrent exports per worker (each holds one
+# connection per database for its whole duration) and the MySQL net_write_timeout of an export
+# session, so a slow client does not abort the server-side cursor
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', 1000))
+EXPORT_MAX_CONCURRENT = int(os.getenv('EXPORT_MAX_CONCURRENT', 2))
+EXPORT_NET_WRITE_TIMEOUT = int(os.getenv('EXPORT_NET_WRITE_TIMEOUT', 600))
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+def parse_cnum_param(value):
+    """Validate the cnum parameter: None (all extensions) or a list of extension numbers"""
+    if not value:
+        return None
+    cnums = [cnum.strip() for cnum in value.split(',') if cnum.strip()]
+    if not cnums or not all(cnum.isdigit() for cnum in cnums):
+        raise ValueError('Invalid cnum. Use comma-separated extension numbers')
+    return cnums
+
+def open_export_cursor(db_config, start, end, cnums, profile=None):
+    """Start the export query on a dedicated connection with an unbuffered (server-side) cursor.
+
+    Returns (connection, cursor); rows are read from the network as the cursor is iterated.
+    Export connections are not pooled: a streaming cursor keeps its connection busy until the
+    last row has been read.
+    """
+    connection = open_connection(dict(db_config, cursorclass=pymysql.cursors.SSCursor))
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET SESSION net_write_timeout = %s", (EXPORT_NET_WRITE_TIMEOUT,))
+        cursor.execute(*build_export_query(start, end, cnums, profile))
+        return connection, cursor
+    except Exception:
+        connection.close()
+        raise
+
+@app.route('/api/v1/<token>/export', methods=['GET'])
+def export_cdr(token):
+    """Stream the raw CDR rows behind /callstat from all databases, merged by calldate.
+
+    Query params:
+      - date=YYYY-MM-DD|week|month or start=YYYY-MM-DD[ HH:MM]&end=YYYY-MM-DD[ HH:MM], as for /callstat
+      - format=csv (default) | ndjson
+      - compress=gzip: send a .gz file
+      - cnum=2001[,2002...]: only these extensions
+      - profile=NAME: filter profile, as for /callstat
+    Databases that cannot be read are listed in the X-Export-Errors header (and the NDJSON meta line).
+    """
+    # Validate token and filter profile
+    try:
+        profile = request_profile(token, request.args.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if profile is None:
+        return jsonify({'error': 'Invalid token'}), 401
+
+    date_param = request.args.get('date')
+    output_format = (request.args.get('format') or 'csv').lower()
+    if output_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Invalid format. Use csv or ndjson'}), 400
+
+    compress = (request.args.get('compress') or '').lower()
+    if compress not in ('', 'gzip'):
+        return jsonify({'error': 'Invalid compress. Use gzip'}), 400
+
+    try:
+        cnums = parse_cnum_param(request.args.get('cnum'))
+        start_dt, end_dt, range_label = parse_range_params(date_param, request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    start, end = calldate_window(date_param, start_dt, end_dt)
+
+    if not export_slots.acquire(blocking=False):
+        return jsonify({'error': f"Too many exports in progress (at most {EXPORT_MAX_CONCURRENT}); retry later"}), 429
+
+    streams = []
+    errors = []
+    try:
+        for db_config in db_configs:
+            unavailable = db_registry.unavailable(db_config)
+            if unavailable:
+                errors.append({db_config['name']: unavailable['error']})
+                continue
+            try:
+                with span('connect', db_config['name']):
+                    connection, cursor = open_export_cursor(db_config, start, end, cnums, profile)
+            except Exception as e:
+                logger.error(f"Error starting export from {db_config['name']}: {str(e)}")
+                metrics.db_errors.inc(db=db_config['name'], kind='error')
+                db_registry.record(db_config, False)
+                errors.append({db_config['name']: f"Error querying {db_config['name']}: {str(e)}"})
+                continue
+            db_registry.record(db_config, True)
+            streams.append((db_config['name'], connection, cursor))
+    except BaseException:
+        for _, connection, _ in streams:
+            connection.close()
+        export_slots.release()
+        raise
+
+    closed = threading.Lock()
+
+    def close_export():
+        # Runs when the response is closed: after the last chunk, or when the client goes away
+        if closed.acquire(blocking=False):
+            for _, connection, _ in streams:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            export_slots.release()
+
+    def count_rows(db_name):
+        return lambda count: metrics.export_rows.inc(count, db=db_name)
+
+    if start_dt is None:
+        meta = OrderedDict([('date', date_param)])
+    else:
+        meta = OrderedDict([('start', start_dt), ('end', end_dt), ('date', range_label)])
+    if profile != filter_profiles.default:
+        meta['profile'] = profile.name
+    if errors:
+        meta['errors'] = errors
+
+    import cdr_export  # only needed by exports; keeps csv/zlib out of worker boot
+
+    def generate():
+        rows = cdr_export.merge_by_calldate(
+            cdr_export.iter_cursor_rows(cursor, db_name, EXPORT_FETCH_SIZE, count_rows(db_name))
+            for db_name, _, cursor in streams
+        )
+        chunks = cdr_export.csv_chunks(rows) if output_format == 'csv' else cdr_export.ndjson_chunks(rows, meta)
+        if compress:
+            chunks = cdr_export.gzip_chunks(chunks)
+        try:
+            yield from chunks
+        except Exception as e:
+            # Headers are already sent: abort the transfer so the client sees an incomplete download
+            logger.error(f"CDR export failed after the response started: {str(e)}")
+            raise
+
+    label = (date_param or f"{start:%Y%m%d%H%M}-{end - timedelta(minutes=1):%Y%m%d%H%M}").lower()
+    filename = f"cdr-{label}.{output_format}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else ('text/csv' if output_format == 'csv' else 'application/x-ndjson')
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'X-Accel-Buffering': 'no',
+    }
+    if errors:
+        headers['X-Export-Errors'] = json.dumps(errors, ensure_ascii=True)
+
+    response = Response(generate(), mimetype=mimetype, headers=headers)
+    response.call_on_close(close_export)
+    return response
+
+# Startup: validate the configuration, then open pooled connections and load the extension
+# lists and country codes of every database before the worker takes traffic (see gunicorn.conf.py)
+WARMUP = os.getenv('WARMUP', '1') != '0'
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', 10))
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', 1))
+
+# Seconds spent per boot phase ('import' is set by gunicorn.conf.py) and the warm-up outcome
+boot_seconds = OrderedDict()
+warmup_state = {'started': False, 'finished': False, 'problems': [], 'databases': {}}
+warmup_lock = threading.Lock()
+
+def config_problems():
+    """Configuration errors that make the service unusable; reported by /ready"""
+    problems = []
+    if not API_TOKEN:
+        problems.append('API_TOKEN is not set')
+    if not db_configs:
+        problems.append('No databases configured (set DB1_HOST or DATABASES_FILE)')
+    if STATS_SOURCE not in STATS_SOURCES:
+        problems.append(f"Invalid STATS_SOURCE {STATS_SOURCE!r}. Use remote, local or live")
+    if STATS_SOURCE == 'local' and local_store is None:
+        problems.append('STATS_SOURCE=local needs INGEST_PATH')
+    if STATS_SOURCE == 'live' and live_stats is None:
+        problems.append('STATS_SOURCE=live needs LIVE_STATS=1')
+    if not sketches.MIN_PRECISION <= APPROX_PRECISION <= sketches.MAX_PRECISION:
+        problems.append(f"Invalid APPROX_PRECISION {APPROX_PRECISION}. "
+                        f"Use {sketches.MIN_PRECISION} to {sketches.MAX_PRECISION}")
+    return problems
+
+def warm_up_database(db_config):
+    """Open WARMUP_CONNECTIONS pooled connections and load the extension lists (one per filter profile)
+    and country codes
+    """
+    connections = []
+    try:
+        for _ in range(WARMUP_CONNECTIONS):
+            connection = get_connection(db_config)
+            if not connection:
+                return {'error': f"Failed to connect to {db_config['name']} at {db_config['host']}:{db_config['port']}"}
+            connections.append(connection)
+        with connections[0].cursor() as cursor:
+            for profile in filter_profiles.profiles.values():
+                extension_directory.get(db_config['name'], cursor, profile)
+            country_directory.get(db_config['name'], cursor)
+        db_registry.record(db_config, True)
+        return {'status': 'success'}
+    except Exception as e:
+        logger.error(f"Warm-up of {db_config['name']} failed: {str(e)}")
+        db_registry.record(db_config, False)
+        return {'error': f"Error warming up {db_config['name']}: {str(e)}"}
+    finally:
+        for connection in connections:
+            release_connection(db_config, connection)
+
+def warm_up():
+    """Run the startup phase once per process; later calls return immediately.
+
+    Databases are warmed concurrently for at most WARMUP_TIMEOUT seconds (keep it below the
+    Gunicorn worker timeout); a database that fails or is slower is reported but does not
+    block readiness, the circuit breaker and the lazy paths take over from there.
+    """
+    with warmup_lock:
+        if warmup_state['started']:
+            return
+        warmup_state['started'] = True
+
+    started = time.perf_counter()
+    warmup_state['problems'] = config_problems()
+    for problem in warmup_state['problems']:
+        logger.error(f"Configuration problem: {problem}")
+
+    if WARMUP and db_configs:
+        futures = [(db_config, fanout_executor.submit(warm_up_database, db_config)) for db_config in db_configs]
+        deadline = started + WARMUP_TIMEOUT
+        for db_config, future in futures:
+            try:
+                result = future.result(timeout=max(0, deadline - time.perf_counter()))
+            except FutureTimeoutError:
+                result = {'error': f"Warm-up of {db_config['name']} did not finish within {WARMUP_TIMEOUT:g}s"}
+            warmup_state['databases'][db_config['name']] = 'ok' if 'error' not in result else 'error'
+            if 'error' in result:
+                logger.warning(result['error'])
+
+    boot_seconds['warmup'] = time.perf_counter() - started
+    warmup_state['finished'] = True
+    logger.info(f"Warm-up finished in {boot_seconds['warmup']:.2f}s: {dict(warmup_state['databases'])}")
+
+@app.route('/health', methods=['GET'])
+def get_health():
+    """Liveness: the process answers HTTP"""
+    return Response('healthy\n', mimetype='text/plain')
+
+@app.route('/ready', methods=['GET'])
+def get_ready():
+    """Readiness: 200 once warm-up has finished with a valid configuration, 503 before.
+
+    A server that does not call warm_up() itself (no gunicorn.conf.py) starts it on the first probe.
+    """
+    if not warmup_state['started']:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+    ready = warmup_state['finished'] and not warmup_state['problems']
+    body = OrderedDict([
+        ('ready', ready),
+        ('problems', warmup_state['problems']),
+        ('databases', warmup_state['databases']),
+        ('boot_seconds', OrderedDict((phase, round(seconds, 3)) for phase, seconds in boot_seconds.items())),
+    ])
+    return jsonify(body), 200 if ready else 503
 
 if __name__ == '__main__':
     # For development only
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
     app.run(debug=False)
\ No newline at end of file
@@ -40,11 +40,8 @@ function importCallStats(dateParam) {
   // Build API URL with dynamic date parameter
   var url = buildApiUrl_('callstat', { date: dateParam });
 
-  // Make the HTTP request
-  var response = UrlFetchApp.fetch(url);
-
-  // Parse the JSON response
-  var json = JSON.parse(response.getContentText());
+  // Make the HTTP request (unchanged results come back as 304 and are read from the script cache)
+  var json = fetchJsonConditional_(url);
 
   // Get the active sheet
   var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
@@ -129,11 +126,8 @@ function importWeeklyCallStats() {
   // Build API URL for weekly data
   var url = buildApiUrl_('callstat', { date: 'week' });
 
-  // Make the HTTP request
-  var response = UrlFetchApp.fetch(url);
-
-  // Parse the JSON response
-  var json = JSON.parse(response.getContentText());
+  // Make the HTTP request (unchanged results come back as 304 and are read from the script cache)
+  var json = fetchJsonConditional_(url);
 
   // Get the active sheet
   var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
@@ -190,11 +184,8 @@ function importMonthlyCallStats() {
   // Build API URL for monthly data
   var url = buildApiUrl_('callstat', { date: 'month' });
 
-  // Make the HTTP request
-  var response = UrlFetchApp.fetch(url);
-
-  // Parse the JSON response
-  var json = JSON.parse(response.getContentText());
+  // Make the HTTP request (unchanged results come back as 304 and are read from the script cache)
+  var json = fetchJsonConditional_(url);
 
   // Get the active sheet
   var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
@@ -252,9 +243,8 @@ function importAsrStats() {
   var url = buildApiUrl_('asrstat');
 
   try {
-    // Make the HTTP request
-    var response = UrlFetchApp.fetch(url);
-    var json = JSON.parse(response.getContentText());
+    // Make the HTTP request (unchanged results come back as 304 and are read from the script cache)
+    var json = fetchJsonConditional_(url);
 
     // Get the active sheet
     var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
@@ -526,11 +516,8 @@ function importCallStatsWithDateRange(startDateTime, endDateTime) {
   });
 
   try {
-    // Make the HTTP request
-    var response = UrlFetchApp.fetch(url);
-    
-    // Parse the JSON response
-    var json = JSON.parse(response.getContentText());
+    // Make the HTTP request (unchanged results come back as 304 and are read from the script cache)
+    var json = fetchJsonConditional_(url);
 
     // Get the active sheet
     var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
@@ -590,6 +577,229 @@ function importCallStatsWithDateRange(startDateTime, endDateTime) {
 
 // (Removed duplicate definition of showAlertSafe; see unified version above.)
 
+// =====================
+// Batch refresh
+// =====================
+
+// Sheets filled by refreshAllStats(); missing sheets are created
+var BATCH_SHEETS = {
+  today: 'Today',
+  week: 'Last Week',
+  month: 'Last Month',
+  asr: 'ASR'
+};
+
+/**
+ * Refreshes today's, last week's and last month's call stats plus today's ASR with a single
+ * request to the batch endpoint (one CDR scan per database instead of one per import).
+ * Can be used from a button or a time-driven trigger.
+ */
+function refreshAllStats() {
+  try {
+    var json = fetchBatchStats_(['today', 'week', 'month'], ['callstat', 'asrstat']);
+    var spreadsheet = SpreadsheetApp.getActiveSpreadsheet();
+    var labels = { today: null, week: 'Last Week', month: 'Last Month' };
+    var imported = [];
+
+    json.periods.forEach(function(period) {
+      var sheet = getOrCreateSheet_(spreadsheet, BATCH_SHEETS[period.period]);
+      var label = labels[period.period] || period.callstat.start.substring(0, 10);
+      var count = writeCallStatsRows_(sheet, period.callstat.data, label);
+      imported.push(BATCH_SHEETS[period.period] + ': ' + count + ' rows');
+
+      if (period.period === 'today') {
+        var asrSheet = getOrCreateSheet_(spreadsheet, BATCH_SHEETS.asr);
+        var asrCount = writeAsrRows_(asrSheet, period.asrstat.databases, label);
+        imported.push(BATCH_SHEETS.asr + ': ' + asrCount + ' rows');
+      }
+    });
+
+    showAlertSafe('Statistics refreshed.\n' + imported.join('\n'));
+  } catch (error) {
+    showAlertSafe('Error refreshing statistics: ' + error.toString());
+  }
+}
+
+/**
+ * Calls the batch endpoint.
+ * @param {string[]} periods - e.g. ['today', 'week', 'month', '2025-12-01']
+ * @param {string[]} metrics - 'callstat' and/or 'asrstat'
+ */
+function fetchBatchStats_(periods, metrics) {
+  var url = buildApiUrl_('batch', { periods: periods.join(','), metrics: metrics.join(',') });
+  var response = UrlFetchApp.fetch(url);
+  var json = JSON.parse(response.getContentText());
+  if (json.error) {
+    throw new Error(json.error);
+  }
+  return json;
+}
+
+/**
+ * GETs a stat endpoint with If-None-Match and returns the parsed JSON.
+ * Bodies that carry an ETag are kept in the script cache for 6 hours, so an unchanged
+ * result (e.g. last week's stats) is answered with an empty 304 and read from the cache.
+ * @param {string} url
+ */
+function fetchJsonConditional_(url) {
+  var cache = CacheService.getScriptCache();
+  // Cache keys are limited to 250 characters; the URL contains the API key, so hash it
+  var cacheKey = 'etag:' + Utilities.base64EncodeWebSafe(
+    Utilities.computeDigest(Utilities.DigestAlgorithm.SHA_1, url)
+  );
+  var cached = cache.get(cacheKey);
+  var entry = cached ? JSON.parse(cached) : null;
+
+  var options = entry ? { headers: { 'If-None-Match': entry.etag } } : {};
+  var response = UrlFetchApp.fetch(url, options);
+  if (response.getResponseCode() === 304 && entry) {
+    return JSON.parse(entry.body);
+  }
+
+  var body = response.getContentText();
+  var headers = response.getHeaders();
+  var etag = headers['ETag'] || headers['Etag'] || headers['etag'];
+  if (etag && response.getResponseCode() === 200) {
+    try {
+      cache.put(cacheKey, JSON.stringify({ etag: etag, body: body }), 21600);
+    } catch (e) {
+      // Larger than the 100 KB cache value limit: fetch the full body next time
+    }
+  }
+  return JSON.parse(body);
+}
+
+// =====================
+// Trends
+// =====================
+
+/**
+ * Imports call minutes per extension and day for the last 30 days into the "Trend" sheet
+ * with one request to the time-series endpoint: one row per extension, one column per day.
+ * @param {number=} days - number of days before today (default 30)
+ */
+function importDailyTrend(days) {
+  try {
+    var end = new Date();
+    end.setDate(end.getDate() - 1);
+    var start = new Date(end);
+    start.setDate(start.getDate() - ((days || 30) - 1));
+    var tz = Session.getScriptTimeZone();
+    var url = buildApiUrl_('timeseries', {
+      bucket: 'day',
+      start: Utilities.formatDate(start, tz, 'yyyy-MM-dd'),
+      end: Utilities.formatDate(end, tz, 'yyyy-MM-dd')
+    });
+    var json = fetchJsonConditional_(url);
+    if (json.error) {
+      throw new Error(json.error);
+    }
+
+    var header = ['Extension', 'Name', 'Total minutes'].concat(json.buckets);
+    var rows = json.data.map(function(item) {
+      var minutesByBucket = {};
+      item.series.forEach(function(point) {
+        minutesByBucket[point.bucket] = point.total_call_time_minutes;
+      });
+      return [item.cnum, item.cnam, item.total_call_time_minutes].concat(json.buckets.map(function(bucket) {
+        return minutesByBucket[bucket] || 0;
+      }));
+    });
+
+    var sheet = getOrCreateSheet_(SpreadsheetApp.getActiveSpreadsheet(), 'Trend');
+    sheet.clearContents();
+    sheet.getRange(1, 1, 1, header.length).setValues([header]);
+    if (rows.length > 0) {
+      sheet.getRange(2, 1, rows.length, header.length).setValues(rows);
+    }
+    showAlertSafe('Trend imported: ' + rows.length + ' extensions, ' + json.buckets.length + ' days.');
+  } catch (error) {
+    showAlertSafe('Error importing trend: ' + error.toString());
+  }
+}
+
+function getOrCreateSheet_(spreadsheet, name) {
+  return spreadsheet.getSheetByName(name) || spreadsheet.insertSheet(name);
+}
+
+// Writes callstat rows from A7 in the same column order as importCallStats(); returns the row count
+function writeCallStatsRows_(sheet, data, label) {
+  sheet.getRange("B2").setValue(label);
+  sheet.getRange("B3").clearContent();
+
+  var dataToImport = [];
+  (data || []).forEach(function(item) {
+    var cnumValue = parseInt(item.cnum);
+    if (cnumValue >= 2000 && cnumValue <= 3999) {
+      dataToImport.push([
+        item.cnum,
+        item.cnam,
+        item.call_count,
+        item.total_call_time_minutes,
+        item.unique_calls,
+        item.long_calls_count,
+        item.total_long_calls_minutes
+      ]);
+    }
+  });
+
+  var lastRow = sheet.getLastRow();
+  if (lastRow >= 7) {
+    sheet.getRange(7, 1, lastRow - 6, 7).clearContent();
+  }
+  if (dataToImport.length > 0) {
+    sheet.getRange(7, 1, dataToImport.length, 7).setValues(dataToImport);
+  }
+  return dataToImport.length;
+}
+
+// Writes ASR rows with headers in row 7 like importAsrStats(); returns the row count
+function writeAsrRows_(sheet, databases, label) {
+  var existingFilter = sheet.getFilter();
+  if (existingFilter) {
+    existingFilter.remove();
+  }
+  var lastRow = sheet.getLastRow();
+  if (lastRow >= 7) {
+    sheet.getRange(7, 1, lastRow - 6, 8).clear();
+  }
+  sheet.getRange("B2").setValue(label);
+
+  var allDataToImport = [];
+  for (var dbName in databases) {
+    if (databases.hasOwnProperty(dbName)) {
+      var dbResult = databases[dbName];
+      if (dbResult.error || !Array.isArray(dbResult.data)) continue;
+      dbResult.data.forEach(function(item) {
+        allDataToImport.push([
+          dbName,
+          item.country_code || "",
+          item.country || "",
+          item.answered_calls || 0,
+          item.total_calls || 0,
+          item.asr_percentage || 0,
+          item.unique_destinations || 0,
+          item.total_talk_minutes || 0
+        ]);
+      });
+    }
+  }
+
+  if (allDataToImport.length > 0) {
+    var headers = [
+      "Database", "Country Code", "Country", "Answered Calls",
+      "Total Calls", "ASR %", "Unique Destinations", "Total Talk Minutes"
+    ];
+    var headerRange = sheet.getRange(7, 1, 1, headers.length);
+    headerRange.setValues([headers]);
+    headerRange.setFontWeight("bold");
+    headerRange.setBackground("#d3d3d3");
+    sheet.getRange(8, 1, allDataToImport.length, headers.length).setValues(allDataToImport);
+    sheet.getRange(7, 1, allDataToImport.length + 1, headers.length).createFilter();
+  }
+  return allDataToImport.length;
+}
+
 // =====================
 // Helper functions
 // =====================
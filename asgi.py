@@ -0,0 +1,573 @@
+"""Optional ASGI entry point with non-blocking database I/O for the stat endpoints.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 2
+
+/callstat and /asrstat query the databases with aiomysql on the event loop, so one process
+keeps hundreds of slow requests in flight instead of one per Gunicorn worker thread. Their
+parameters, responses and errors are those of app.py. Every other route (/batch, /pool,
+/cache, /metrics, /ingest, /live) is the Flask app itself, run in a thread pool. Windows
+answered from the rollups or the local CDR copy (both SQLite) also go through the thread
+pool; windows answered from the live aggregates are served directly from memory.
+
+Needs the packages in requirements-async.txt.
+"""
+import asyncio
+import functools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import aiomysql
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as sync_app
+import metrics
+from country_codes import aggregate_by_country
+from extension_directory import checksum_query, extensions_query
+from http_cache import json_entry, cache_headers, is_not_modified
+from metrics import span
+
+
+logger = logging.getLogger(__name__)
+
+# aiomysql pools per database, created on first use inside the worker's event loop
+db_pools = {}
+db_pools_lock = asyncio.Lock()
+
+async def get_pool(db_config):
+    """Return the aiomysql pool for a database, creating it on first use"""
+    pool = db_pools.get(db_config['name'])
+    if pool is None:
+        async with db_pools_lock:
+            pool = db_pools.get(db_config['name'])
+            if pool is None:
+                logger.info(f"Creating async pool for {db_config['name']} at {db_config['host']}:{db_config['port']}")
+                pool = await aiomysql.create_pool(
+                    minsize=0,
+                    maxsize=sync_app.DB_POOL_MAX_SIZE,
+                    pool_recycle=sync_app.DB_POOL_IDLE_TIMEOUT,
+                    host=db_config['host'],
+                    port=db_config['port'],
+                    user=db_config['user'],
+                    password=db_config['password'],
+                    charset=db_config['charset'],
+                    connect_timeout=min(10, db_config['timeout']),
+                    autocommit=True
+                )
+                db_pools[db_config['name']] = pool
+    return pool
+
+async def get_connection(db_config):
+    """Check out a pooled connection, or None when none is available.
+
+    Connect errors count towards the circuit breaker, also a connect cut short by a timeout;
+    waiting in vain for a pool whose connections are all busy does not (see app.get_connection).
+    """
+    busy = False
+    try:
+        with span('connect', db_config['name']):
+            pool = await get_pool(db_config)
+            busy = pool.freesize == 0 and pool.size >= pool.maxsize
+            return await asyncio.wait_for(pool.acquire(), sync_app.DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.CancelledError:
+        if not busy:
+            sync_app.db_registry.record(db_config, False)
+        raise
+    except Exception as e:
+        logger.error(f"Failed to connect to {db_config['name']}: {str(e)}")
+        if not busy:
+            sync_app.db_registry.record(db_config, False)
+        return None
+
+def release_connection(db_config, connection, discard=False):
+    """Return a connection to its pool; close it first when it may be in a broken state"""
+    if discard:
+        connection.close()
+    db_pools[db_config['name']].release(connection)
+
+async def get_extensions(db_name, cursor, profile):
+    """extension_directory.get() with an aiomysql cursor"""
+    directory = sync_app.extension_directory
+    extensions, fresh = directory.cached(db_name, profile)
+    if fresh:
+        return extensions
+
+    try:
+        await cursor.execute(checksum_query(profile))
+        fingerprint = directory.fingerprint(await cursor.fetchone())
+        if directory.confirm(db_name, fingerprint, profile):
+            return extensions
+        await cursor.execute(extensions_query(profile))
+        return directory.store(db_name, await cursor.fetchall(), fingerprint, profile)
+    except Exception:
+        if extensions is None:
+            raise
+        return extensions
+
+async def get_country_trie(db_name, cursor):
+    """country_directory.get() with an aiomysql cursor"""
+    directory = sync_app.country_directory
+    trie, fresh = directory.cached(db_name)
+    if fresh:
+        return trie
+
+    try:
+        await cursor.execute(directory.QUERY)
+        return directory.store(db_name, await cursor.fetchall())
+    except Exception:
+        if trie is None:
+            raise
+        return trie
+
+def served_from_sqlite(source):
+    """True when query_database/query_asr_database may answer from the rollups or the local copy"""
+    if (source or sync_app.STATS_SOURCE) == 'local' and sync_app.local_store is not None:
+        return True
+    return sync_app.rollup_store is not None
+
+async def query_database(db_config, date_param=None, start_dt=None, end_dt=None, source=None, approx=False,
+                         profile=None):
+    """app.query_database on the event loop; arguments and result are the same.
+
+    approx=1 scans run app.query_database in the threadpool (PyMySQL).
+    """
+    profile = profile or sync_app.filter_profiles.default
+    start, end = sync_app.calldate_window(date_param, start_dt, end_dt)
+    if sync_app.use_live_source(db_config, start, end, source, profile):
+        return sync_app.query_database(db_config, date_param, start_dt, end_dt, source, profile=profile)
+    if served_from_sqlite(source) or approx:
+        return await run_in_threadpool(sync_app.query_database, db_config, date_param, start_dt, end_dt, source,
+                                       approx, profile)
+
+    connection = await get_connection(db_config)
+    if connection is None:
+        return {
+            'error': f"Failed to connect to {db_config['name']} at {db_config['host']}:{db_config['port']}"
+        }
+
+    # Also discards the connection when the query is cancelled by the fan-out timeout
+    failed = True
+    try:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            with span('execute', db_config['name']):
+                await cursor.execute(*sync_app.build_callstat_query(start, end, profile))
+            with span('fetchall', db_config['name']):
+                results = await cursor.fetchall()
+            with span('extensions', db_config['name']):
+                extensions = await get_extensions(db_config['name'], cursor, profile)
+        failed = False
+
+        return {
+            'status': 'success',
+            'data': sync_app.merge_extension_rows(results, extensions, db_config['name'])
+        }
+
+    except Exception as e:
+        logger.error(f"Error querying {db_config['name']}: {str(e)}")
+        return {
+            'error': f"Error querying {db_config['name']}: {str(e)}"
+        }
+
+    finally:
+        release_connection(db_config, connection, discard=failed)
+        sync_app.db_registry.record(db_config, not failed)
+
+async def query_asr_database(db_config, date_param=None, start_dt=None, end_dt=None, source=None, approx=False,
+                             profile=None):
+    """app.query_asr_database on the event loop; arguments and result are the same (approx: see query_database)"""
+    profile = profile or sync_app.filter_profiles.default
+    start, end = sync_app.calldate_window(date_param, start_dt, end_dt)
+    if sync_app.use_live_source(db_config, start, end, source, profile):
+        return sync_app.query_asr_database(db_config, date_param, start_dt, end_dt, source, profile=profile)
+    if served_from_sqlite(source) or approx:
+        return await run_in_threadpool(sync_app.query_asr_database, db_config, date_param, start_dt, end_dt, source,
+                                       approx, profile)
+
+    connection = await get_connection(db_config)
+    if connection is None:
+        return {
+            'error': f"Failed to connect to {db_config['name']} at {db_config['host']}:{db_config['port']}"
+        }
+
+    failed = True
+    try:
+        async with connection.cursor(aiomysql.DictCursor) as cursor:
+            with span('country_codes', db_config['name']):
+                trie = await get_country_trie(db_config['name'], cursor)
+            with span('execute', db_config['name']):
+                await cursor.execute(*sync_app.build_asr_query(start, end, profile))
+            with span('fetchall', db_config['name']):
+                dst_rows = await cursor.fetchall()
+        failed = False
+
+        with span('group', db_config['name']):
+            results = aggregate_by_country(dst_rows, trie)
+
+        return {
+            'status': 'success',
+            'data': results
+        }
+
+    except Exception as e:
+        logger.error(f"Error querying {db_config['name']} for ASR stats: {str(e)}")
+        return {
+            'error': f"Error querying {db_config['name']}: {str(e)}"
+        }
+
+    finally:
+        release_connection(db_config, connection, discard=failed)
+        sync_app.db_registry.record(db_config, not failed)
+
+async def query_period_cached(db_config, endpoint, query_func, date_param, **kwargs):
+    """app.query_period_cached for async query functions (same cache entries)"""
+    period = date_param.lower() if date_param else None
+    if period not in ('week', 'month'):
+        return await query_func(db_config, date_param, **kwargs)
+
+    key, expires_at = sync_app.period_cache_key(endpoint, period, db_config['name'])
+    result = sync_app.result_cache.get(key)
+    if result is not None:
+        return result
+
+    result = await query_func(db_config, date_param, **kwargs)
+    if 'error' not in result and expires_at is not None:
+        sync_app.result_cache.set(key, result, expires_at)
+    return result
+
+# Identical concurrent queries of this process share one task (see app.query_coalesced):
+# key -> [task, number of callers waiting for it]
+in_flight = {}
+
+async def query_bounded(db_config, query_func, *args, **kwargs):
+    """Await query_func(db_config, *args, **kwargs) for at most the database's timeout.
+
+    aiomysql has no read_timeout like the PyMySQL connections of app.py; the cancellation
+    discards the connection, so a hung query does not keep a pooled connection.
+    """
+    try:
+        return await asyncio.wait_for(query_func(db_config, *args, **kwargs), db_config['timeout'])
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"No answer from {db_config['name']} within {db_config['timeout']:g}s") from None
+
+async def query_coalesced(db_config, query_func, *args, **kwargs):
+    """Await query_func(db_config, *args, **kwargs), sharing one execution with identical concurrent calls.
+
+    The shared execution is cancelled when the last caller waiting for it gives up (fan-out timeout).
+    """
+    if not sync_app.SINGLE_FLIGHT:
+        return await query_bounded(db_config, query_func, *args, **kwargs)
+    key = sync_app.single_flight_key(db_config, query_func, args, kwargs)
+    entry = in_flight.get(key)
+    if entry is None:
+        entry = in_flight[key] = [asyncio.ensure_future(query_bounded(db_config, query_func, *args, **kwargs)), 0]
+        entry[0].add_done_callback(lambda _: in_flight.pop(key, None) if in_flight.get(key) is entry else None)
+    task = entry[0]
+    entry[1] += 1
+    try:
+        # A caller that times out must not cancel the query the other callers are still waiting for
+        return await asyncio.shield(task)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and not task.done():
+            if in_flight.get(key) is entry:
+                del in_flight[key]
+            task.cancel()
+
+async def fan_out(query_func, *args, **kwargs):
+    """app.fan_out for async query functions: all databases concurrently, each within its own timeout"""
+    started = time.monotonic()
+    tasks = []
+    all_results = {}
+    for db_config in sync_app.db_configs:
+        unavailable = sync_app.db_registry.unavailable(db_config)
+        if unavailable:
+            metrics.db_errors.inc(db=db_config['name'], kind='circuit_open')
+            all_results[db_config['name']] = unavailable
+            continue
+        tasks.append((db_config, asyncio.ensure_future(query_func(db_config, *args, **kwargs))))
+
+    for db_config, task in tasks:
+        db_name = db_config['name']
+        await asyncio.wait([task], timeout=max(0, started + db_config['timeout'] - time.monotonic()))
+        if not task.done():
+            task.cancel()
+            metrics.db_errors.inc(db=db_name, kind='timeout')
+            logger.error(f"Timed out querying {db_name} after {db_config['timeout']:g}s")
+            result = {
+                'error': f"Timed out querying {db_name} after {db_config['timeout']:g}s"
+            }
+        else:
+            try:
+                result = task.result()
+                if 'error' in result:
+                    metrics.db_errors.inc(db=db_name, kind='error')
+            except Exception as e:
+                metrics.db_errors.inc(db=db_name, kind='error')
+                logger.error(f"Error querying {db_name}: {str(e)}")
+                result = {
+                    'error': f"Error querying {db_name}: {str(e)}"
+                }
+        all_results[db_name] = result
+
+    return {db_config['name']: all_results[db_config['name']] for db_config in sync_app.db_configs}
+
+def jsonify(obj, status_code=200):
+    """Same body and content type as Flask's jsonify()"""
+    return Response(sync_app.compact_json_dumps(obj) + '\n', status_code=status_code, media_type='application/json')
+
+def cached_json_response(request, entry, expires_at=None):
+    """app.cached_json_response for Starlette requests"""
+    headers = cache_headers(entry, expires_at)
+    if is_not_modified(entry, request.headers):
+        return Response(status_code=304, headers=headers)
+    return Response(entry['body'], media_type='application/json', headers=headers)
+
+def timed(handler):
+    """Record callstat_request_duration_seconds like the Flask request hooks"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        started = time.perf_counter()
+        response = await handler(request)
+        metrics.request_seconds.observe(
+            time.perf_counter() - started, endpoint=handler.__name__, status=response.status_code
+        )
+        return response
+    return wrapper
+
+@timed
+async def get_call_stats(request):
+    """/callstat, see app.get_call_stats"""
+    # Validate token and filter profile
+    try:
+        profile = sync_app.request_profile(request.path_params['token'], request.query_params.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    if profile is None:
+        return jsonify({'error': 'Invalid token'}, 401)
+
+    # Get parameters
+    date_param = request.query_params.get('date')
+    start_param = request.query_params.get('start')
+    end_param = request.query_params.get('end')
+
+    output_format = (request.query_params.get('format') or 'json').lower()
+    if output_format not in sync_app.STATS_OUTPUT_FORMATS:
+        return jsonify({'error': 'Invalid format. Use json, stream or ndjson'}, 400)
+
+    source = (request.query_params.get('source') or sync_app.STATS_SOURCE).lower()
+    if source not in sync_app.STATS_SOURCES:
+        return jsonify({'error': 'Invalid source. Use remote, local or live'}, 400)
+
+    try:
+        top = sync_app.parse_top_param(request.query_params.get('top'))
+        approx = sync_app.parse_approx_param(request.query_params.get('approx'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+
+    use_week_or_month = bool(date_param and date_param.lower() in ['week', 'month'])
+
+    try:
+        start_dt, end_dt, range_label = sync_app.parse_range_params(date_param, start_param, end_param,
+                                                                    request.query_params.get('hours'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+
+    expires_at = None
+    if output_format == 'json':
+        expires_at = sync_app.closed_window_expiry(date_param if use_week_or_month else None, start_dt, end_dt)
+        cache_key = sync_app.response_cache_key(sync_app.profile_endpoint('callstat', profile),
+                                                request.query_params.multi_items())
+        entry = sync_app.response_cache.get(cache_key) if expires_at else None
+        if entry is not None:
+            return cached_json_response(request, entry, expires_at)
+
+    if use_week_or_month:
+        all_results = await fan_out(query_coalesced, query_period_cached,
+                                    sync_app.period_cache_endpoint('callstat', approx, profile, source), query_database,
+                                    date_param, source=source, approx=approx, profile=profile)
+    else:
+        all_results = await fan_out(query_coalesced, query_database, date_param=None, start_dt=start_dt,
+                                    end_dt=end_dt, source=source, approx=approx, profile=profile)
+
+    with span('combine'):
+        combined_data, errors = sync_app.combine_results(all_results, top=top)
+    del all_results
+
+    if use_week_or_month:
+        meta = OrderedDict([
+            ('date', date_param)
+        ])
+    else:
+        meta = OrderedDict([
+            ('start', start_dt),
+            ('end', end_dt),
+            ('date', range_label)
+        ])
+
+    if profile != sync_app.filter_profiles.default:
+        meta['profile'] = profile.name
+    if approx:
+        meta['approx'] = sync_app.approx_meta()
+    if errors:
+        meta['errors'] = errors
+
+    if output_format == 'ndjson':
+        return StreamingResponse(sync_app.iter_ndjson(combined_data, meta), media_type='application/x-ndjson',
+                                 headers={'X-Accel-Buffering': 'no'})
+    if output_format == 'stream':
+        return StreamingResponse(sync_app.iter_json_document(combined_data, meta), media_type='application/json',
+                                 headers={'X-Accel-Buffering': 'no'})
+
+    response = OrderedDict([('data', combined_data)])
+    response.update(meta)
+
+    with span('serialize'):
+        entry = json_entry(sync_app.compact_json_dumps(response) + '\n')
+    if errors:
+        expires_at = None
+    elif expires_at:
+        sync_app.response_cache.set(cache_key, entry, expires_at)
+    return cached_json_response(request, entry, expires_at)
+
+@timed
+async def get_asr_stats(request):
+    """/asrstat, see app.get_asr_stats"""
+    # Validate token and filter profile
+    try:
+        profile = sync_app.request_profile(request.path_params['token'], request.query_params.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    if profile is None:
+        return jsonify({'error': 'Invalid token'}, 401)
+
+    date_param = request.query_params.get('date')
+    start_param = request.query_params.get('start')
+    end_param = request.query_params.get('end')
+    hours_param = request.query_params.get('hours')
+
+    source = (request.query_params.get('source') or sync_app.STATS_SOURCE).lower()
+    if source not in sync_app.STATS_SOURCES:
+        return jsonify({'error': 'Invalid source. Use remote, local or live'}, 400)
+
+    try:
+        approx = sync_app.parse_approx_param(request.query_params.get('approx'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+
+    use_range = bool((start_param or end_param or hours_param)
+                     and not (date_param and date_param.lower() in ['week', 'month']))
+    cache_key = sync_app.response_cache_key(sync_app.profile_endpoint('asrstat', profile),
+                                            request.query_params.multi_items())
+
+    if use_range:
+        try:
+            start_dt, end_dt, range_label = sync_app.parse_range_params(None, start_param, end_param, hours_param)
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        expires_at = sync_app.closed_window_expiry(None, start_dt, end_dt)
+        entry = sync_app.response_cache.get(cache_key) if expires_at else None
+        if entry is not None:
+            return cached_json_response(request, entry, expires_at)
+
+        all_results = await fan_out(query_coalesced, query_asr_database, None, start_dt=start_dt, end_dt=end_dt,
+                                    source=source, approx=approx, profile=profile)
+
+        response = OrderedDict([
+            ('date', range_label),
+            ('start', start_dt),
+            ('end', end_dt),
+            ('databases', all_results)
+        ])
+        if profile != sync_app.filter_profiles.default:
+            response['profile'] = profile.name
+        if approx:
+            response['approx'] = sync_app.approx_meta()
+        return asr_json_response(request, response, cache_key, expires_at)
+
+    if not date_param:
+        date_param = datetime.now().strftime('%Y-%m-%d')
+    elif date_param.lower() not in ['week', 'month']:
+        try:
+            datetime.strptime(date_param, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD, "week", or "month"'}, 400)
+
+    expires_at = sync_app.closed_window_expiry(date_param)
+    entry = sync_app.response_cache.get(cache_key) if expires_at else None
+    if entry is not None:
+        return cached_json_response(request, entry, expires_at)
+
+    all_results = await fan_out(query_coalesced, query_period_cached,
+                                sync_app.period_cache_endpoint('asrstat', approx, profile, source),
+                                query_asr_database, date_param, source=source, approx=approx, profile=profile)
+
+    response = OrderedDict([
+        ('date', date_param),
+        ('databases', all_results)
+    ])
+    if profile != sync_app.filter_profiles.default:
+        response['profile'] = profile.name
+    if approx:
+        response['approx'] = sync_app.approx_meta()
+    return asr_json_response(request, response, cache_key, expires_at)
+
+def asr_json_response(request, response, cache_key, expires_at):
+    """app.asr_json_response for Starlette requests"""
+    entry = json_entry(sync_app.compact_json_dumps(response) + '\n')
+    if any('error' in result for result in response['databases'].values()):
+        expires_at = None
+    elif expires_at:
+        sync_app.response_cache.set(cache_key, entry, expires_at)
+    return cached_json_response(request, entry, expires_at)
+
+@metrics.registry.collector
+def collect_async_pool_stats():
+    """aiomysql pool sizes per database (the Flask routes keep their own pools, see /pool)"""
+    samples = {'max_size': [], 'open': [], 'idle': [], 'in_use': []}
+    for db_name, pool in db_pools.items():
+        labels = {'db': db_name}
+        samples['max_size'].append((labels, pool.maxsize))
+        samples['open'].append((labels, pool.size))
+        samples['idle'].append((labels, pool.freesize))
+        samples['in_use'].append((labels, pool.size - pool.freesize))
+    return [
+        (f"callstat_async_pool_{key}", 'gauge', f"Async connection pool {key.replace('_', ' ')}", values)
+        for key, values in samples.items() if values
+    ]
+
+async def warm_up_pool(db_config):
+    """Open one async pooled connection, so the first async request does not pay for it"""
+    connection = await get_connection(db_config)
+    if connection is not None:
+        release_connection(db_config, connection)
+
+@asynccontextmanager
+async def lifespan(_app):
+    # Config check, sync pools and caches (app.warm_up), then the async pools, before serving
+    await run_in_threadpool(sync_app.warm_up)
+    if sync_app.WARMUP and sync_app.db_configs:
+        await asyncio.wait(
+            [asyncio.ensure_future(warm_up_pool(db_config)) for db_config in sync_app.db_configs],
+            timeout=sync_app.WARMUP_TIMEOUT
+        )
+    yield
+    for pool in db_pools.values():
+        pool.close()
+        await pool.wait_closed()
+
+app = Starlette(
+    routes=[
+        Route('/api/v1/{token}/callstat', get_call_stats, methods=['GET']),
+        Route('/api/v1/{token}/asrstat', get_asr_stats, methods=['GET']),
+        # Everything else is served by the Flask app in a thread pool
+        Mount('/', app=WSGIMiddleware(sync_app.app)),
+    ],
+    lifespan=lifespan
+)
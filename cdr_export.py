@@ -0,0 +1,75 @@
+"""Streaming export of raw CDR rows from several databases.
+
+Each database is read through an unbuffered server-side cursor in calldate order; the streams
+are merged by calldate (k-way, heapq.merge) and encoded chunk by chunk as CSV or NDJSON,
+optionally gzip-compressed. Only one fetch batch per database and one output chunk are held
+in memory, whatever the number of rows.
+"""
+import csv
+import heapq
+import io
+import json
+import zlib
+from operator import itemgetter
+
+
+# Columns of an exported row: the source database followed by the columns of the export query
+EXPORT_COLUMNS = ('db', 'calldate', 'uniqueid', 'cnum', 'cnam', 'dst', 'lastapp', 'disposition', 'duration', 'billsec')
+
+
+def iter_cursor_rows(cursor, db_name, fetch_size, on_batch=None):
+    """Yield (db_name, *row) tuples from an unbuffered cursor, fetching fetch_size rows at a time"""
+    while True:
+        batch = cursor.fetchmany(fetch_size)
+        if not batch:
+            return
+        if on_batch is not None:
+            on_batch(len(batch))
+        prefix = (db_name,)
+        for row in batch:
+            yield prefix + tuple(row)
+
+
+def merge_by_calldate(streams):
+    """Merge per-database row streams that are each ordered by calldate into one ordered stream"""
+    return heapq.merge(*streams, key=itemgetter(1))
+
+
+def csv_chunks(rows, chunk_rows=1000):
+    """CSV text with a header line, yielded every chunk_rows rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count == chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, meta, chunk_rows=1000):
+    """A {"meta": {...}} line followed by one JSON object per row, yielded every chunk_rows rows"""
+    dumps = json.JSONEncoder(separators=(',', ':'), default=str).encode
+    lines = [dumps({'meta': meta})]
+    for row in rows:
+        lines.append(dumps(dict(zip(EXPORT_COLUMNS, row))))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress text chunks into one gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
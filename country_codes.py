@@ -0,0 +1,185 @@
+"""Destination-to-country mapping done in the service instead of the get_country_code() SQL function"""
+import threading
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from sketches import HyperLogLog
+
+
+class CountryPrefixTrie:
+    """Longest-prefix match of dialled numbers against country codes.
+
+    Mirrors get_country_code(): a leading '+' is ignored and the longest code that prefixes
+    the number wins. A code listed for several countries ('1', '7', ...) keeps all of them,
+    like the country_codes JOIN of the SQL query did.
+    """
+
+    def __init__(self, codes):
+        """codes: iterable of (code, country) pairs"""
+        self._root = {}
+        self.max_code_length = 0
+        self.size = 0
+        for code, country in codes:
+            code = str(code)
+            node = self._root
+            for char in code:
+                node = node.setdefault(char, {})
+            _, countries = node.get(None, (code, ()))
+            if country not in countries:
+                node[None] = (code, tuple(sorted(countries + (country,), key=lambda name: name or '')))
+            self.max_code_length = max(self.max_code_length, len(code))
+            self.size += 1
+
+    def lookup(self, number):
+        """Return (code, countries) for a dialled number, the countries ordered by name.
+
+        (None, (None,)) when no code matches: such destinations are one row without a country.
+        """
+        if not number:
+            return None, (None,)
+        if number[0] == '+':
+            number = number[1:]
+        match = (None, (None,))
+        node = self._root
+        for char in number:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match = node[None]
+        return match
+
+
+class CountryCodeDirectory:
+    """Per-database country code tries loaded from asteriskcdrdb.country_codes and refreshed periodically"""
+
+    QUERY = "SELECT code, country FROM asteriskcdrdb.country_codes"
+
+    def __init__(self, refresh_interval=3600):
+        self.refresh_interval = refresh_interval
+        self._tries = {}  # db name -> (trie, loaded_at)
+        self._lock = threading.Lock()
+
+    def get(self, db_name, cursor):
+        """Return the trie for a database, (re)loading it with `cursor` when missing or stale.
+
+        If a refresh fails the previous trie keeps being served.
+        """
+        trie, fresh = self.cached(db_name)
+        if fresh:
+            return trie
+
+        try:
+            cursor.execute(self.QUERY)
+            return self.store(db_name, cursor.fetchall())
+        except Exception:
+            if trie is None:
+                raise
+            return trie
+
+    def cached(self, db_name):
+        """Return (trie, fresh): the cached trie (None before the first load) and whether it is current"""
+        with self._lock:
+            entry = self._tries.get(db_name)
+        if entry is None:
+            return None, False
+        return entry[0], time.monotonic() - entry[1] < self.refresh_interval
+
+    def store(self, db_name, rows):
+        """Build the trie from rows of QUERY, cache it and return it"""
+        trie = CountryPrefixTrie((row['code'], row['country']) for row in rows)
+        with self._lock:
+            self._tries[db_name] = (trie, time.monotonic())
+        return trie
+
+
+def asr_percentage(answered_calls, total_calls):
+    """ASR rounded like MySQL's ROUND((answered / total) * 100, 2) (division kept to 4 decimals)"""
+    ratio = (Decimal(answered_calls) / Decimal(total_calls)).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+    return float((ratio * 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def aggregate_by_country(dst_rows, trie):
+    """Group per-destination ASR aggregates into per-country rows, ordered by total_calls.
+
+    dst_rows need dst, answered_calls, total_calls and talk_billsec. Calls are counted per
+    destination, so a single uniqueid that dialled two numbers of the same country counts twice
+    in total_calls and answered_calls (the get_country_code() query counted it once).
+    """
+    codes = {}
+    for row in dst_rows:
+        code, countries = trie.lookup(row['dst'])
+        entry = codes.get(code)
+        if entry is None:
+            entry = codes[code] = {
+                'countries': countries,
+                'answered_calls': 0,
+                'total_calls': 0,
+                'unique_destinations': 0,
+                'talk_billsec': 0,
+            }
+        entry['answered_calls'] += int(row['answered_calls'])
+        entry['total_calls'] += int(row['total_calls'])
+        entry['unique_destinations'] += 1
+        entry['talk_billsec'] += int(row['talk_billsec'] or 0)
+
+    # A code shared by several countries gives each of them a row with the code's counts
+    results = [
+        {
+            'country_code': str(code),
+            'country': country,
+            'answered_calls': entry['answered_calls'],
+            'total_calls': entry['total_calls'],
+            'asr_percentage': asr_percentage(entry['answered_calls'], entry['total_calls']),
+            'unique_destinations': entry['unique_destinations'],
+            'total_talk_minutes': round(entry['talk_billsec'] / 60, 2),
+        }
+        for code, entry in codes.items()
+        for country in entry['countries']
+    ]
+    results.sort(key=lambda row: row['total_calls'], reverse=True)
+    return results
+
+
+# Distinct counts of the approx=1 ASR query, sent as HyperLogLog registers per destination prefix
+ASR_SKETCHES = ('answered_calls', 'total_calls', 'unique_destinations')
+
+
+def aggregate_sketches_by_country(prefix_rows, trie, precision):
+    """aggregate_by_country for approx=1: per-prefix estimates summed per country.
+
+    prefix_rows need dst_prefix (long enough for trie.lookup), talk_billsec and the
+    ASR_SKETCHES registers. Each prefix is estimated on its own and the estimates are added
+    up, like aggregate_by_country adds up the per-destination counts. A call that dialled
+    two numbers of one prefix is counted once per prefix here.
+    """
+    codes = {}
+    for row in prefix_rows:
+        code, countries = trie.lookup(row['dst_prefix'])
+        entry = codes.get(code)
+        if entry is None:
+            entry = codes[code] = {'countries': countries, 'talk_billsec': 0}
+            for name in ASR_SKETCHES:
+                entry[name] = 0
+        estimates = {name: HyperLogLog.from_registers(row[name], precision).estimate() for name in ASR_SKETCHES}
+        entry['total_calls'] += estimates['total_calls']
+        entry['answered_calls'] += min(estimates['answered_calls'], estimates['total_calls'])
+        entry['unique_destinations'] += estimates['unique_destinations']
+        entry['talk_billsec'] += int(row['talk_billsec'] or 0)
+
+    results = []
+    for code, entry in codes.items():
+        total_calls = entry['total_calls']
+        answered_calls = entry['answered_calls']
+        for country in entry['countries']:
+            results.append({
+                'country_code': str(code),
+                'country': country,
+                'answered_calls': answered_calls,
+                'total_calls': total_calls,
+                'asr_percentage': asr_percentage(answered_calls, total_calls) if total_calls else 0.0,
+                'unique_destinations': entry['unique_destinations'],
+                'total_talk_minutes': round(entry['talk_billsec'] / 60, 2),
+            })
+    results.sort(key=lambda row: row['total_calls'], reverse=True)
+    return results
@@ -0,0 +1,175 @@
+"""Thread-safe connection pool used to keep database connections open between requests"""
+import threading
+import time
+import logging
+from collections import deque
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class ConnectionPool:
+    """A bounded pool of connections to a single database.
+
+    Connections are created lazily by `connect` (a zero-argument callable) up to `max_size`.
+    Idle connections are reused most-recently-used first, closed after `idle_timeout`
+    seconds without use and pinged before reuse when they have been idle longer than
+    `ping_after` seconds. A connection that fails its ping is replaced by a new one.
+    """
+
+    def __init__(self, name, connect, max_size=5, idle_timeout=300, acquire_timeout=10, ping_after=5):
+        self.name = name
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, last_used) pairs, most recently used on the right
+        self._size = 0        # open connections, idle + checked out
+
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'closed': 0,
+            'evicted_idle': 0,
+            'failed_pings': 0,
+            'connect_errors': 0,
+            'waits': 0,
+            'timeouts': 0,
+        }
+
+    def acquire(self):
+        """Check out a healthy connection, opening a new one if the pool is not full"""
+        deadline = time.monotonic() + self.acquire_timeout
+
+        while True:
+            expired = []
+            connection = None
+            reserved = False
+            with self._cond:
+                while True:
+                    expired.extend(self._pop_expired_locked())
+                    if self._idle:
+                        connection, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        reserved = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        break
+                    self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+
+            for stale in expired:
+                self._close(stale)
+
+            if reserved:
+                return self._open()
+
+            if connection is None:
+                raise PoolTimeout(
+                    f"No connection to {self.name} available within {self.acquire_timeout:g}s "
+                    f"(pool size {self.max_size})"
+                )
+
+            if time.monotonic() - last_used < self.ping_after or self._ping(connection):
+                with self._cond:
+                    self._stats['reused'] += 1
+                return connection
+
+            # Dead connection: drop it and try again (usually opens a fresh one)
+            self._discard(connection)
+
+    def release(self, connection, discard=False):
+        """Return a checked-out connection; broken or discarded connections are closed"""
+        if connection is None:
+            return
+        if discard or not connection.open:
+            self._discard(connection)
+            return
+        with self._cond:
+            self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        """Close every idle connection (checked-out connections are closed on release)"""
+        with self._cond:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for connection in idle:
+            self._close(connection)
+
+    def stats(self):
+        """Snapshot of pool counters for sizing and monitoring"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'max_size': self.max_size,
+                'open': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+            })
+        return stats
+
+    def _pop_expired_locked(self):
+        """Remove connections idle for longer than idle_timeout (caller holds the lock)"""
+        expired = []
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            connection, _ = self._idle.popleft()
+            expired.append(connection)
+        if expired:
+            self._size -= len(expired)
+            self._stats['evicted_idle'] += len(expired)
+            self._cond.notify(len(expired))
+        return expired
+
+    def _open(self):
+        """Open a new connection for a slot already reserved in _size"""
+        try:
+            connection = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._stats['connect_errors'] += 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return connection
+
+    def _ping(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding dead pooled connection to {self.name}: {str(e)}")
+            with self._cond:
+                self._stats['failed_pings'] += 1
+            return False
+
+    def _discard(self, connection):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+        self._close(connection)
+
+    def _close(self, connection):
+        with self._cond:
+            self._stats['closed'] += 1
+        try:
+            if connection.open:
+                connection.close()
+        except Exception:
+            pass
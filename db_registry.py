@@ -0,0 +1,184 @@
+"""Database registry: any number of PBX databases loaded from config, with per-database circuit breakers.
+
+Entries come from a JSON file (DATABASES_FILE) or from DB<n>_* environment variables for any
+n. A database that fails DB_CIRCUIT_FAILURES requests in a row is skipped (its circuit is
+open) until a background probe can connect to it again.
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+ENV_HOST_PATTERN = re.compile(r'DB(\d+)_HOST')
+
+
+def parse_bool(value, default=True):
+    if value is None or str(value).strip() == '':
+        return default
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def database_entry(values, default_timeout):
+    """Normalize one configured database into the db_config dict used by the query functions"""
+    host = values.get('host')
+    if not host:
+        raise ValueError(f"Database entry without host: {values.get('name') or values}")
+    return {
+        'name': values.get('name') or host,
+        'host': host,
+        'port': int(values.get('port') or 3306),
+        'user': values.get('user'),
+        'password': values.get('password'),
+        'charset': values.get('charset') or 'utf8mb4',
+        'weight': float(values.get('weight') or 1),
+        'timeout': float(values.get('timeout') or default_timeout),
+        'enabled': parse_bool(values.get('enabled')),
+    }
+
+
+def load_database_entries(environ, default_timeout):
+    """Read the configured databases, in config order.
+
+    DATABASES_FILE names a JSON list of objects with host, port, user, password and optionally
+    name (defaults to host), weight, timeout and enabled. Without it every DB<n>_HOST that is
+    set defines a database, configured by DB<n>_PORT, _USER, _PASSWORD, _WEIGHT, _TIMEOUT and
+    _ENABLED. Databases without a host are ignored.
+    """
+    path = environ.get('DATABASES_FILE')
+    if path:
+        with open(path) as f:
+            entries = [database_entry(values, default_timeout) for values in json.load(f)]
+    else:
+        numbers = sorted(int(match.group(1)) for match in map(ENV_HOST_PATTERN.fullmatch, environ) if match)
+        entries = [
+            database_entry({
+                'host': environ.get(f"DB{n}_HOST"),
+                'port': environ.get(f"DB{n}_PORT"),
+                'user': environ.get(f"DB{n}_USER"),
+                'password': environ.get(f"DB{n}_PASSWORD"),
+                'weight': environ.get(f"DB{n}_WEIGHT"),
+                'timeout': environ.get(f"DB{n}_TIMEOUT"),
+                'enabled': environ.get(f"DB{n}_ENABLED"),
+            }, default_timeout)
+            for n in numbers if environ.get(f"DB{n}_HOST")
+        ]
+
+    names = [entry['name'] for entry in entries]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate database names: {', '.join(duplicates)} (set distinct names)")
+    return entries
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker of one database; reopened only by a successful probe"""
+
+    def __init__(self, failure_threshold=3):
+        self.failure_threshold = failure_threshold
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def record(self, ok):
+        """Record the outcome of a request; returns True when this failure opened the circuit"""
+        with self._lock:
+            if ok:
+                self.failures = 0
+                return False
+            self.failures += 1
+            if self.opened_at is None and self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                return True
+            return False
+
+    def close(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+
+class DatabaseRegistry:
+    """Enabled databases ordered by weight (heaviest first), plus a circuit breaker per database.
+
+    Args:
+        entries: database entries from load_database_entries.
+        failure_threshold: consecutive failed requests that open a circuit.
+        probe_interval: seconds between connection probes of open circuits.
+        probe: probe(db_config) that raises when the database is still unreachable.
+    """
+
+    def __init__(self, entries, failure_threshold=3, probe_interval=30, probe=None):
+        self.entries = list(entries)
+        # sorted() is stable, so databases of equal weight keep their config order
+        self.databases = sorted((entry for entry in self.entries if entry['enabled']),
+                                key=lambda entry: entry['weight'], reverse=True)
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self.breakers = {entry['name']: CircuitBreaker(failure_threshold) for entry in self.databases}
+        self._prober = None
+        self._prober_lock = threading.Lock()
+
+    def unavailable(self, db_config):
+        """Error result of a database whose circuit is open, or None when it may be queried"""
+        breaker = self.breakers[db_config['name']]
+        if not breaker.is_open:
+            return None
+        return {
+            'error': f"{db_config['name']} is unavailable after {breaker.failures} failed requests; "
+                     f"retried when a health probe succeeds"
+        }
+
+    def record(self, db_config, ok):
+        """Record a request outcome; a circuit that opens starts the background health probe"""
+        if self.breakers[db_config['name']].record(ok):
+            logger.warning(f"Circuit opened for {db_config['name']}; skipping it until a probe succeeds")
+            self._start_prober()
+
+    def probe_open_circuits(self):
+        """Probe every database with an open circuit once; closes the ones that answer"""
+        for db_config in self.databases:
+            breaker = self.breakers[db_config['name']]
+            if not breaker.is_open:
+                continue
+            try:
+                self.probe(db_config)
+            except Exception as e:
+                logger.info(f"Health probe of {db_config['name']} failed: {str(e)}")
+                continue
+            breaker.close()
+            logger.info(f"Circuit closed for {db_config['name']} after a successful probe")
+
+    def _start_prober(self):
+        if self.probe is None:
+            return
+        with self._prober_lock:
+            if self._prober is None or not self._prober.is_alive():
+                self._prober = threading.Thread(target=self._probe_loop, name='db-health-probe', daemon=True)
+                self._prober.start()
+
+    def _probe_loop(self):
+        while any(breaker.is_open for breaker in self.breakers.values()):
+            time.sleep(self.probe_interval)
+            self.probe_open_circuits()
+
+    def stats(self):
+        return {
+            db_config['name']: {
+                'weight': db_config['weight'],
+                'timeout': db_config['timeout'],
+                'circuit_open': self.breakers[db_config['name']].is_open,
+                'consecutive_failures': self.breakers[db_config['name']].failures,
+                'trips': self.breakers[db_config['name']].trips,
+            }
+            for db_config in self.databases
+        }
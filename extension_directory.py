@@ -0,0 +1,149 @@
+"""Per-database, per-filter-profile cache of the asterisk.sip extension list used to add zero-stat rows"""
+import functools
+import threading
+import time
+
+from filter_profiles import DEFAULT_PROFILE
+
+
+EXTENSIONS_TEMPLATE = """
+SELECT
+    id AS cnum,
+    SUBSTRING_INDEX(SUBSTRING_INDEX(data, ',', -1), '<', 1) AS cnam
+FROM asterisk.sip
+WHERE keyword = 'callerid'
+  AND {extension_ranges}
+"""
+
+# Cheap fingerprint of the same rows, used to notice edits before the TTL runs out
+CHECKSUM_TEMPLATE = """
+SELECT
+    COUNT(*) AS entries,
+    COALESCE(SUM(CRC32(CONCAT(id, '=', data))), 0) AS checksum
+FROM asterisk.sip
+WHERE keyword = 'callerid'
+  AND {extension_ranges}
+"""
+
+
+@functools.lru_cache(maxsize=32)
+def extensions_query(profile=DEFAULT_PROFILE):
+    """Extension list of a filter profile's ranges"""
+    return EXTENSIONS_TEMPLATE.format(extension_ranges=profile.extension_sql('id'))
+
+
+@functools.lru_cache(maxsize=32)
+def checksum_query(profile=DEFAULT_PROFILE):
+    """Fingerprint of extensions_query(profile)"""
+    return CHECKSUM_TEMPLATE.format(extension_ranges=profile.extension_sql('id'))
+
+
+# The statements of the built-in default profile (the same objects extensions_query(profile) returns)
+EXTENSIONS_QUERY = extensions_query(DEFAULT_PROFILE)
+CHECKSUM_QUERY = checksum_query(DEFAULT_PROFILE)
+
+
+class ExtensionDirectory:
+    """Extension lists per database and filter profile, reloaded after `ttl` seconds or when the
+    checksum changes.
+
+    The checksum is probed at most every `check_interval` seconds, so most requests use the
+    cached list without any query.
+    """
+
+    def __init__(self, ttl=3600, check_interval=300):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = {}  # (db name, profile) -> {'extensions', 'fingerprint', 'loaded_at', 'checked_at'}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'probes': 0, 'reloads': 0, 'changes': 0}
+
+    def get(self, db_name, cursor, profile=DEFAULT_PROFILE):
+        """Return the extension list (cnum, cnam rows) of a database within a profile's ranges,
+        using `cursor` when a probe or reload is due. If a refresh fails the previous list keeps
+        being served.
+        """
+        extensions, fresh = self.cached(db_name, profile)
+        if fresh:
+            return extensions
+
+        try:
+            cursor.execute(checksum_query(profile))
+            fingerprint = self.fingerprint(cursor.fetchone())
+            if self.confirm(db_name, fingerprint, profile):
+                return extensions
+            cursor.execute(extensions_query(profile))
+            return self.store(db_name, cursor.fetchall(), fingerprint, profile)
+        except Exception:
+            if extensions is None:
+                raise
+            return extensions
+
+    # The steps of get(), for drivers that cannot pass a blocking cursor (see asgi.py)
+
+    def cached(self, db_name, profile=DEFAULT_PROFILE):
+        """Return (extensions, fresh): the cached list (None before the first load) and whether
+        it can be served without a probe
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((db_name, profile))
+        if entry is None:
+            return None, False
+        if now - entry['loaded_at'] < self.ttl and now - entry['checked_at'] < self.check_interval:
+            self._count('hits')
+            return entry['extensions'], True
+        return entry['extensions'], False
+
+    @staticmethod
+    def fingerprint(row):
+        """Fingerprint of a CHECKSUM_QUERY row"""
+        return int(row['entries']), int(row['checksum'])
+
+    def confirm(self, db_name, fingerprint, profile=DEFAULT_PROFILE):
+        """Record a checksum probe; True when the cached list is still valid, False when it must be reloaded"""
+        now = time.monotonic()
+        self._count('probes')
+        with self._lock:
+            entry = self._entries.get((db_name, profile))
+            if entry is None:
+                return False
+            if now - entry['loaded_at'] < self.ttl and fingerprint == entry['fingerprint']:
+                entry['checked_at'] = now
+                return True
+        if fingerprint != entry['fingerprint']:
+            self._count('changes')
+        return False
+
+    def store(self, db_name, extensions, fingerprint, profile=DEFAULT_PROFILE):
+        """Cache a freshly loaded list and return it"""
+        now = time.monotonic()
+        with self._lock:
+            self._entries[(db_name, profile)] = {
+                'extensions': extensions,
+                'fingerprint': fingerprint,
+                'loaded_at': now,
+                'checked_at': now,
+            }
+        self._count('reloads')
+        return extensions
+
+    def invalidate(self, db_name=None):
+        """Drop the cached lists of one database, or of all databases"""
+        with self._lock:
+            if db_name is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == db_name]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['databases'] = len({db_name for db_name, _ in self._entries})
+            stats['profiles'] = len({profile.name for _, profile in self._entries})
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
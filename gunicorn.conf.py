@@ -0,0 +1,37 @@
+"""Gunicorn settings and boot hooks.
+
+Each worker imports app.py after the fork and then runs app.warm_up() before it accepts
+requests, so the first requests after a deploy or a scale-up find open connections and
+loaded caches. The app is not preloaded in the master: it opens SQLite files and starts
+threads at import, neither of which may be shared across fork().
+
+    gunicorn --config gunicorn.conf.py app:app
+"""
+import os
+import time
+
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+# gthread keeps the worker heartbeat running during long /export downloads
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+# Must stay above WARMUP_TIMEOUT: a worker that has not booted within it is killed
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+preload_app = False
+
+worker_started = {}
+
+
+def post_fork(server, worker):
+    worker_started[worker.pid] = time.perf_counter()
+
+
+def post_worker_init(worker):
+    import app
+
+    started = worker_started.pop(worker.pid, None)
+    if started is not None:
+        app.boot_seconds['import'] = time.perf_counter() - started
+        app.logger.info(f"Worker {worker.pid} imported the app in {app.boot_seconds['import']:.2f}s")
+    app.warm_up()
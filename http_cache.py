@@ -0,0 +1,39 @@
+"""ETag / Last-Modified validators and Cache-Control headers for JSON stat responses"""
+import hashlib
+import time
+
+from werkzeug.http import http_date, parse_date, parse_etags
+
+
+def json_entry(body):
+    """Cacheable form of a serialized JSON body: {'body', 'etag', 'last_modified'}"""
+    return {
+        'body': body,
+        'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        'last_modified': int(time.time()),
+    }
+
+
+def cache_headers(entry, expires_at=None):
+    """Validator headers of an entry; expires_at (closed windows) lets shared caches keep it until then"""
+    if expires_at:
+        cache_control = f"public, max-age={max(0, int(expires_at - time.time()))}"
+    else:
+        cache_control = 'no-cache'
+    return {
+        'ETag': f'"{entry["etag"]}"',
+        'Last-Modified': http_date(entry['last_modified']),
+        'Cache-Control': cache_control,
+    }
+
+
+def is_not_modified(entry, request_headers):
+    """True when a conditional GET already has this entry (If-None-Match, else If-Modified-Since).
+
+    ETags are compared weakly because nginx gzip turns them into W/"..." validators.
+    """
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(entry['etag'])
+    if_modified_since = parse_date(request_headers.get('If-Modified-Since'))
+    return if_modified_since is not None and entry['last_modified'] <= if_modified_since.timestamp()
@@ -0,0 +1,506 @@
+"""Incremental copy of the remote CDR tables into a local SQLite analytics store.
+
+A background ingester tails each configured database by (calldate, uniqueid, sequence) in
+bounded batches and writes the rows needed by the stat endpoints into a local file,
+deduplicated on (uniqueid, sequence). Watermarks are committed together with each batch,
+so a restarted ingester resumes where it stopped. Because Asterisk writes a CDR row when a
+call ends but stamps it with the call's start time, every poll re-reads the last
+`lookback` seconds before the watermark to pick up rows of long calls.
+
+All rows are copied; the stat queries apply the filters of one filter profile (the default
+one), whose extension list is copied along with the country codes.
+"""
+import fcntl
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from country_codes import CountryPrefixTrie
+from extension_directory import extensions_query
+from filter_profiles import DEFAULT_PROFILE
+
+
+logger = logging.getLogger(__name__)
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Keyset pagination over one bounded calldate window; the leading range keeps it on the calldate index
+TAIL_QUERY = """
+SELECT
+    cdr.calldate,
+    cdr.uniqueid,
+    cdr.sequence,
+    cdr.cnum,
+    cdr.cnam,
+    cdr.dst,
+    cdr.lastapp,
+    cdr.disposition,
+    cdr.billsec
+FROM asteriskcdrdb.cdr
+WHERE cdr.calldate >= %s AND cdr.calldate < %s
+  AND (cdr.calldate > %s OR (cdr.calldate = %s AND (cdr.uniqueid > %s OR (cdr.uniqueid = %s AND cdr.sequence > %s))))
+ORDER BY cdr.calldate, cdr.uniqueid, cdr.sequence
+LIMIT %s
+"""
+
+COUNTRY_CODES_QUERY = "SELECT code, country FROM asteriskcdrdb.country_codes"
+
+
+def local_filters(profile):
+    """SQLite versions of a filter profile's row filters (see query_compiler.profile_sql)"""
+    # Not an all-digit destination of an internal length
+    lengths = profile.internal_dst_lengths
+    if not lengths:
+        not_internal = "dst IS NOT NULL"
+    elif len(lengths) == 1:
+        not_internal = f"NOT (length(dst) = {lengths[0]} AND dst NOT GLOB '*[^0-9]*')"
+    else:
+        not_internal = f"NOT (length(dst) IN ({', '.join(map(str, lengths))}) AND dst NOT GLOB '*[^0-9]*')"
+    return {
+        'extension_ranges': profile.extension_sql('CAST(cnum AS INTEGER)'),
+        'callstat_dispositions': profile.callstat_disposition_sql('disposition'),
+        'asr_dispositions': profile.asr_disposition_sql('disposition'),
+        'not_internal': not_internal,
+    }
+
+
+LOCAL_CALLSTAT_QUERY = """
+SELECT
+    cnum,
+    IFNULL(cnam, '') AS cnam,
+    COUNT(DISTINCT dst) AS unique_calls,
+    COUNT(DISTINCT uniqueid) AS call_count,
+    SUM(CASE WHEN lastapp = 'Dial' AND disposition = 'ANSWERED' THEN billsec ELSE 0 END) AS billsec,
+    COUNT(DISTINCT CASE
+        WHEN lastapp = 'Dial' AND disposition = 'ANSWERED' AND billsec > 90 THEN uniqueid
+    END) AS long_calls_count,
+    SUM(CASE
+        WHEN lastapp = 'Dial' AND disposition = 'ANSWERED' AND billsec > 90 THEN billsec ELSE 0
+    END) AS long_billsec
+FROM cdr
+WHERE db_name = ? AND calldate >= ? AND calldate < ?
+  AND {extension_ranges}
+  AND lastapp IN ('Dial', 'Busy', 'Congestion')
+  AND {callstat_dispositions}
+  AND {not_internal}
+GROUP BY cnum, IFNULL(cnam, '')
+"""
+
+LOCAL_ASR_QUERY = """
+SELECT
+    dst,
+    COUNT(DISTINCT CASE WHEN disposition = 'ANSWERED' THEN uniqueid END) AS answered_calls,
+    COUNT(DISTINCT uniqueid) AS total_calls,
+    SUM(CASE WHEN disposition = 'ANSWERED' THEN billsec ELSE 0 END) AS talk_billsec
+FROM cdr
+WHERE db_name = ? AND calldate >= ? AND calldate < ?
+  AND lastapp = 'Dial'
+  AND {asr_dispositions}
+  AND {not_internal}
+GROUP BY dst
+"""
+
+# Bucket label of a calldate per time-series bucket, as the service labels them
+LOCAL_BUCKET_EXPRESSIONS = {
+    'hour': "substr(calldate, 1, 13) || ':00'",
+    'day': "substr(calldate, 1, 10)",
+    'week': "date(calldate, 'weekday 0', '-6 days')",
+}
+
+LOCAL_TIMESERIES_QUERY = """
+SELECT
+    {bucket} AS bucket,
+    cnum,
+    IFNULL(cnam, '') AS cnam,
+    COUNT(DISTINCT dst) AS unique_calls,
+    COUNT(DISTINCT uniqueid) AS call_count,
+    SUM(CASE WHEN lastapp = 'Dial' AND disposition = 'ANSWERED' THEN billsec ELSE 0 END) AS billsec,
+    COUNT(DISTINCT CASE
+        WHEN lastapp = 'Dial' AND disposition = 'ANSWERED' AND billsec > 90 THEN uniqueid
+    END) AS long_calls_count,
+    SUM(CASE
+        WHEN lastapp = 'Dial' AND disposition = 'ANSWERED' AND billsec > 90 THEN billsec ELSE 0
+    END) AS long_billsec
+FROM cdr
+WHERE db_name = ? AND calldate >= ? AND calldate < ?
+  AND {extension_ranges}
+  AND lastapp IN ('Dial', 'Busy', 'Congestion')
+  AND {callstat_dispositions}
+  AND {not_internal}
+GROUP BY bucket, cnum, IFNULL(cnam, '')
+"""
+
+
+class LocalCdrStore:
+    """SQLite copy of the CDR columns used by the stat endpoints, per source database.
+
+    The stat queries count rows with the filters of `profile`. Windows reaching past the last
+    completed poll are only answered while that poll is at most `max_lag` seconds old.
+    """
+
+    def __init__(self, path, profile=DEFAULT_PROFILE, max_lag=180):
+        self.path = path
+        self.profile = profile
+        self.max_lag = max_lag
+        self._filters = local_filters(profile)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._tries = {}  # db name -> (trie, directory version)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS cdr (
+                    db_name TEXT NOT NULL,
+                    uniqueid TEXT NOT NULL,
+                    sequence INTEGER NOT NULL,
+                    calldate TEXT NOT NULL,
+                    cnum TEXT,
+                    cnam TEXT,
+                    dst TEXT,
+                    lastapp TEXT,
+                    disposition TEXT,
+                    billsec INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (db_name, uniqueid, sequence)
+                ) WITHOUT ROWID
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS cdr_calldate ON cdr (db_name, calldate)")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    db_name TEXT PRIMARY KEY,
+                    covered_from TEXT NOT NULL,
+                    calldate TEXT NOT NULL,
+                    uniqueid TEXT NOT NULL,
+                    sequence INTEGER NOT NULL,
+                    -- last completed poll: every row up to this time has been read (epoch seconds)
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS extensions (
+                    db_name TEXT NOT NULL,
+                    cnum TEXT NOT NULL,
+                    cnam TEXT,
+                    PRIMARY KEY (db_name, cnum)
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS country_codes (
+                    db_name TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    country TEXT,
+                    PRIMARY KEY (db_name, code)
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS directory_versions (
+                    db_name TEXT PRIMARY KEY,
+                    refreshed_at REAL NOT NULL
+                )
+            """)
+
+    # --- Ingestion side ---
+
+    def watermark(self, db_name):
+        """Return the stored watermark row for a database, or None before the first batch"""
+        with self._lock:
+            return self._db.execute("SELECT * FROM watermarks WHERE db_name = ?", (db_name,)).fetchone()
+
+    def write_batch(self, db_name, rows, covered_from, high_water):
+        """Insert rows (deduplicated) and advance the watermark in the same transaction.
+
+        high_water is the (calldate, uniqueid, sequence) of the newest row ingested so far;
+        it never moves backwards.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                """INSERT OR IGNORE INTO cdr
+                   (db_name, uniqueid, sequence, calldate, cnum, cnam, dst, lastapp, disposition, billsec)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    (db_name, row['uniqueid'], row['sequence'], row['calldate'].strftime(DATETIME_FORMAT),
+                     row['cnum'], row['cnam'], row['dst'], row['lastapp'], row['disposition'], row['billsec'] or 0)
+                    for row in rows
+                ]
+            )
+            current = self._db.execute(
+                "SELECT calldate, uniqueid, sequence, updated_at FROM watermarks WHERE db_name = ?", (db_name,)
+            ).fetchone()
+            if current is None or tuple(current)[:3] < high_water:
+                self._db.execute(
+                    """INSERT OR REPLACE INTO watermarks
+                       (db_name, covered_from, calldate, uniqueid, sequence, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (db_name, covered_from, *high_water, current['updated_at'] if current else 0)
+                )
+
+    def mark_polled(self, db_name, polled_at):
+        """Record a completed poll: every row up to polled_at (datetime) has been read"""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE watermarks SET updated_at = MAX(updated_at, ?) WHERE db_name = ?",
+                (polled_at.timestamp(), db_name)
+            )
+
+    def replace_directory(self, db_name, extensions, country_codes):
+        """Replace the extension list and country codes snapshot of a database"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM extensions WHERE db_name = ?", (db_name,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO extensions (db_name, cnum, cnam) VALUES (?, ?, ?)",
+                [(db_name, row['cnum'], row['cnam']) for row in extensions]
+            )
+            self._db.execute("DELETE FROM country_codes WHERE db_name = ?", (db_name,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO country_codes (db_name, code, country) VALUES (?, ?, ?)",
+                [(db_name, row['code'], row['country']) for row in country_codes]
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO directory_versions (db_name, refreshed_at) VALUES (?, ?)",
+                (db_name, time.time())
+            )
+
+    def status(self):
+        """Ingestion progress per database"""
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT w.db_name, w.covered_from, w.calldate, w.updated_at, d.refreshed_at
+                   FROM watermarks w LEFT JOIN directory_versions d ON d.db_name = w.db_name"""
+            ).fetchall()
+        return {
+            row['db_name']: {
+                'covered_from': row['covered_from'],
+                'watermark': row['calldate'],
+                'updated_at': datetime.fromtimestamp(row['updated_at']).strftime(DATETIME_FORMAT),
+                'directory_refreshed_at': (
+                    datetime.fromtimestamp(row['refreshed_at']).strftime(DATETIME_FORMAT)
+                    if row['refreshed_at'] else None
+                ),
+            }
+            for row in rows
+        }
+
+    # --- Query side ---
+
+    def covers(self, db_name, start, end):
+        """True when [start, end) lies within the ingested range of a database.
+
+        The copy holds every row up to its last completed poll. A window ending later (up to
+        now or beyond) is accepted only while that poll is at most max_lag seconds old, so the
+        copy lags the PBX by about one poll interval; a stalled ingester sends it to the database.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT covered_from, updated_at FROM watermarks WHERE db_name = ?", (db_name,)
+            ).fetchone()
+            has_directory = self._db.execute(
+                "SELECT 1 FROM directory_versions WHERE db_name = ?", (db_name,)
+            ).fetchone()
+        if row is None or has_directory is None or row['covered_from'] > start.strftime(DATETIME_FORMAT):
+            return False
+        polled_at = datetime.fromtimestamp(row['updated_at'])
+        return min(end, datetime.now()) - timedelta(seconds=self.max_lag) <= polled_at
+
+    def callstat_rows(self, db_name, start, end):
+        """Per-extension callstat rows for calldate in [start, end), ordered like the SQL query"""
+        with self._lock:
+            rows = self._db.execute(
+                LOCAL_CALLSTAT_QUERY.format(**self._filters),
+                (db_name, start.strftime(DATETIME_FORMAT), end.strftime(DATETIME_FORMAT))
+            ).fetchall()
+        results = [
+            {
+                'cnum': row['cnum'],
+                'cnam': row['cnam'],
+                'unique_calls': row['unique_calls'],
+                'call_count': row['call_count'],
+                'total_call_time_minutes': round((row['billsec'] or 0) / 60, 2),
+                'long_calls_count': row['long_calls_count'],
+                'total_long_calls_minutes': round((row['long_billsec'] or 0) / 60, 2),
+            }
+            for row in rows
+        ]
+        results.sort(key=lambda row: row['total_call_time_minutes'], reverse=True)
+        return results
+
+    def timeseries_rows(self, db_name, start, end, bucket):
+        """Per-bucket, per-extension aggregates (raw billsec) for calldate in [start, end)"""
+        query = LOCAL_TIMESERIES_QUERY.format(bucket=LOCAL_BUCKET_EXPRESSIONS[bucket], **self._filters)
+        with self._lock:
+            rows = self._db.execute(
+                query,
+                (db_name, start.strftime(DATETIME_FORMAT), end.strftime(DATETIME_FORMAT))
+            ).fetchall()
+        return [
+            {
+                'bucket': row['bucket'],
+                'cnum': row['cnum'],
+                'cnam': row['cnam'],
+                'unique_calls': row['unique_calls'],
+                'call_count': row['call_count'],
+                'billsec': row['billsec'] or 0,
+                'long_calls_count': row['long_calls_count'],
+                'long_billsec': row['long_billsec'] or 0,
+            }
+            for row in rows
+        ]
+
+    def asr_dst_rows(self, db_name, start, end):
+        """Per-destination ASR aggregates for calldate in [start, end)"""
+        with self._lock:
+            rows = self._db.execute(
+                LOCAL_ASR_QUERY.format(**self._filters),
+                (db_name, start.strftime(DATETIME_FORMAT), end.strftime(DATETIME_FORMAT))
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def extensions(self, db_name):
+        """Snapshot of asterisk.sip extensions (cnum, cnam) of a database, within the profile's ranges"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT cnum, cnam FROM extensions WHERE db_name = ?", (db_name,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def country_trie(self, db_name):
+        """Country code trie built from the local snapshot, rebuilt after each directory refresh"""
+        with self._lock:
+            version = self._db.execute(
+                "SELECT refreshed_at FROM directory_versions WHERE db_name = ?", (db_name,)
+            ).fetchone()
+            version = version[0] if version else None
+            cached = self._tries.get(db_name)
+            if cached is not None and cached[1] == version:
+                return cached[0]
+            codes = self._db.execute(
+                "SELECT code, country FROM country_codes WHERE db_name = ?", (db_name,)
+            ).fetchall()
+            trie = CountryPrefixTrie((row['code'], row['country']) for row in codes)
+            self._tries[db_name] = (trie, version)
+            return trie
+
+
+class CdrIngester(threading.Thread):
+    """Background thread that keeps a LocalCdrStore in sync with every configured database.
+
+    Only one process per store file ingests (guarded by an exclusive lock file), so it is safe
+    to start the ingester in every Gunicorn worker; the others stand by.
+    """
+
+    def __init__(self, store, db_configs, connect, interval=60, batch_size=5000, lookback=7200,
+                 window=86400, backfill_days=35, directory_refresh=3600):
+        super().__init__(name='cdr-ingester', daemon=True)
+        self.store = store
+        self.db_configs = db_configs
+        self.connect = connect
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lookback = timedelta(seconds=lookback)
+        self.window = timedelta(seconds=window)
+        self.backfill = timedelta(days=backfill_days)
+        self.directory_refresh = directory_refresh
+        self._stop_event = threading.Event()
+        self._connections = {}
+        self._directory_loaded_at = {}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        lock_file = open(self.store.path + '.ingest.lock', 'w')
+        # Stand by while another process ingests; take over if it goes away
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if self._stop_event.wait(self.interval):
+                    lock_file.close()
+                    return
+
+        logger.info(f"CDR ingester started for {len(self.db_configs)} database(s)")
+        try:
+            while not self._stop_event.is_set():
+                for db_config in self.db_configs:
+                    if self._stop_event.is_set():
+                        break
+                    try:
+                        self.ingest_once(db_config)
+                    except Exception as e:
+                        logger.error(f"CDR ingestion from {db_config['name']} failed: {str(e)}")
+                        self._drop_connection(db_config)
+                self._stop_event.wait(self.interval)
+        finally:
+            for db_config in self.db_configs:
+                self._drop_connection(db_config)
+            lock_file.close()
+
+    def ingest_once(self, db_config):
+        """Pull every row newer than (watermark - lookback) from one database; returns rows read"""
+        db_name = db_config['name']
+        connection = self._connection(db_config)
+        now = datetime.now().replace(microsecond=0)
+
+        with connection.cursor() as cursor:
+            if time.monotonic() - self._directory_loaded_at.get(db_name, float('-inf')) >= self.directory_refresh:
+                cursor.execute(extensions_query(self.store.profile))
+                extensions = cursor.fetchall()
+                cursor.execute(COUNTRY_CODES_QUERY)
+                country_codes = cursor.fetchall()
+                self.store.replace_directory(db_name, extensions, country_codes)
+                self._directory_loaded_at[db_name] = time.monotonic()
+
+            mark = self.store.watermark(db_name)
+            if mark is None:
+                covered_from = (now - self.backfill).replace(hour=0, minute=0, second=0)
+                window_start = covered_from
+                high_water = (covered_from.strftime(DATETIME_FORMAT), '', -1)
+            else:
+                covered_from = datetime.strptime(mark['covered_from'], DATETIME_FORMAT)
+                high_water = (mark['calldate'], mark['uniqueid'], mark['sequence'])
+                window_start = max(covered_from, datetime.strptime(mark['calldate'], DATETIME_FORMAT) - self.lookback)
+
+            total = 0
+            key = (window_start, '', -1)
+            while window_start < now and not self._stop_event.is_set():
+                window_end = min(window_start + self.window, now)
+                cursor.execute(TAIL_QUERY, (
+                    window_start, window_end, key[0], key[0], key[1], key[1], key[2], self.batch_size
+                ))
+                rows = cursor.fetchall()
+                if rows:
+                    last = rows[-1]
+                    key = (last['calldate'], last['uniqueid'], last['sequence'])
+                    high_water = max(high_water, (last['calldate'].strftime(DATETIME_FORMAT), last['uniqueid'], last['sequence']))
+                    self.store.write_batch(db_name, rows, covered_from.strftime(DATETIME_FORMAT), high_water)
+                    total += len(rows)
+                if len(rows) < self.batch_size:
+                    # Window exhausted, move on to the next one
+                    window_start = window_end
+                    key = (window_start, '', -1)
+
+            if mark is None and total == 0:
+                # Record coverage even when the backfill period had no calls
+                self.store.write_batch(db_name, [], covered_from.strftime(DATETIME_FORMAT), high_water)
+            if window_start >= now:
+                self.store.mark_polled(db_name, now)
+
+        if total:
+            logger.info(f"Ingested {total} CDR row(s) from {db_name}")
+        return total
+
+    def _connection(self, db_config):
+        connection = self._connections.get(db_config['name'])
+        if connection is None or not connection.open:
+            connection = self._connections[db_config['name']] = self.connect(db_config)
+        return connection
+
+    def _drop_connection(self, db_config):
+        connection = self._connections.pop(db_config['name'], None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
@@ -209,6 +209,11 @@ http {
                application/x-javascript application/xml+rss 
                application/json;
 
+    # Response cache for closed stat periods (the API sends Cache-Control: public, max-age=...;
+    # open windows are sent with no-cache and are never stored)
+    proxy_cache_path /var/cache/nginx/callstat levels=1:2 keys_zone=callstat_cache:10m
+                     max_size=200m inactive=1d use_temp_path=off;
+
     # Include server configurations
     include /etc/nginx/conf.d/*.conf;
 }
@@ -241,8 +246,15 @@ server {
         proxy_set_header X-Forwarded-Host $host;
         proxy_set_header X-Forwarded-Port $server_port;
         proxy_redirect off;
-        proxy_buffering off;
+        # Buffering is needed for caching; streamed formats opt out with X-Accel-Buffering: no
+        proxy_buffering on;
         proxy_request_buffering off;
+
+        proxy_cache callstat_cache;
+        proxy_cache_revalidate on;
+        proxy_cache_lock on;
+        proxy_cache_use_stale error timeout updating;
+        add_header X-Cache-Status $upstream_cache_status;
     }
 
     # Health check endpoint
@@ -300,6 +312,8 @@ server {
     add_header X-Content-Type-Options "nosniff" always;
     add_header X-XSS-Protection "1; mode=block" always;
     add_header Referrer-Policy "no-referrer-when-downgrade" always;
+    # HIT/MISS/REVALIDATED of the response cache (kept here: add_header in a location drops these)
+    add_header X-Cache-Status \$upstream_cache_status always;
 
     location / {
         proxy_pass http://callstat_backend;
@@ -312,8 +326,14 @@ server {
         proxy_set_header X-Forwarded-Proto \$scheme;
         proxy_set_header X-Forwarded-Host \$host;
         proxy_redirect off;
-        proxy_buffering off;
+        # Buffering is needed for caching; streamed formats opt out with X-Accel-Buffering: no
+        proxy_buffering on;
         proxy_request_buffering off;
+
+        proxy_cache callstat_cache;
+        proxy_cache_revalidate on;
+        proxy_cache_lock on;
+        proxy_cache_use_stale error timeout updating;
     }
 
     # Health check endpoint
@@ -367,11 +387,11 @@ services:
       - ${DOCKER_NETWORK}
     restart: unless-stopped
     healthcheck:
-      test: ["CMD", "curl", "-f", "http://localhost:8000/health || exit 1"]
+      test: ["CMD", "python", "-c", "import urllib.request; urllib.request.urlopen('http://localhost:8000/ready', timeout=5)"]
       interval: 30s
       timeout: 10s
       retries: 3
-      start_period: 10s
+      start_period: 20s
     expose:
       - "8000"
 
@@ -411,11 +431,11 @@ services:
       - ${DOCKER_NETWORK}
     restart: unless-stopped
     healthcheck:
-      test: ["CMD", "curl", "-f", "http://localhost:8000/health || exit 1"]
+      test: ["CMD", "python", "-c", "import urllib.request; urllib.request.urlopen('http://localhost:8000/ready', timeout=5)"]
       interval: 30s
       timeout: 10s
       retries: 3
-      start_period: 10s
+      start_period: 20s
     expose:
       - "8000"
 
@@ -0,0 +1,417 @@
+"""In-memory rolling aggregates of the latest calls, kept current from incremental CDR reads.
+
+A background thread polls each database for the rows added since its watermark
+(calldate, uniqueid, sequence) and folds them into per-hour and per-day aggregates: per
+(cnum, cnam) the distinct destinations and uniqueids and the billsec sums of /callstat, per
+destination the answered and total uniqueids and the talk billsec of /asrstat. A poll reads
+only the calls made since the previous one. Because Asterisk writes a CDR row when a call
+ends but stamps it with the call's start time, the last `lookback` seconds are read again
+every `sweep_interval` seconds; rows already counted are skipped by (uniqueid, sequence).
+
+Windows starting at an hour boundary (today so far, the last N hours) are answered from
+memory. The result of a window is built once per change of the aggregates and then reused.
+Rows are counted with the filters of one filter profile (the default one).
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from filter_profiles import DEFAULT_PROFILE
+
+
+logger = logging.getLogger(__name__)
+
+# Keyset pagination over [start, end) in index order; the lastapp filter keeps rows no endpoint counts out
+LIVE_TAIL_QUERY = """
+SELECT
+    cdr.calldate,
+    cdr.uniqueid,
+    cdr.sequence,
+    cdr.cnum,
+    cdr.cnam,
+    cdr.dst,
+    cdr.lastapp,
+    cdr.disposition,
+    cdr.billsec
+FROM asteriskcdrdb.cdr
+WHERE cdr.calldate >= %s AND cdr.calldate < %s
+  AND (cdr.calldate > %s OR (cdr.calldate = %s AND (cdr.uniqueid > %s OR (cdr.uniqueid = %s AND cdr.sequence > %s))))
+  AND cdr.lastapp IN ('Dial', 'Busy', 'Congestion')
+ORDER BY cdr.calldate, cdr.uniqueid, cdr.sequence
+LIMIT %s
+"""
+
+# Row filters of the compiled 'callstat' and 'asr' queries (query_compiler.FILTERS), applied to each
+# row together with the filter profile's extension ranges, internal destinations and dispositions
+CALLSTAT_LASTAPPS = ('Dial', 'Busy', 'Congestion')
+LONG_CALL_BILLSEC = 90
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class Aggregates:
+    """Callstat and ASR aggregates of the rows of one hour or one day"""
+
+    __slots__ = ('callstat', 'asr')
+
+    def __init__(self):
+        self.callstat = {}  # (cnum, cnam) -> [dsts, uniqueids, billsec, long call uniqueids, long billsec]
+        self.asr = {}  # dst -> [answered uniqueids, uniqueids, talk billsec]
+
+    def add(self, row, profile=DEFAULT_PROFILE):
+        dst = row['dst']
+        if dst is None or profile.is_internal_dst(dst):
+            return
+        lastapp = row['lastapp']
+        disposition = row['disposition']
+        uniqueid = row['uniqueid']
+        billsec = row['billsec'] or 0
+
+        if lastapp in CALLSTAT_LASTAPPS and profile.counts_for_callstat(disposition) \
+                and profile.is_extension(row['cnum']):
+            # Grouped like GROUP BY cnum, IFNULL(cnam, '')
+            key = (row['cnum'], row['cnam'] or '')
+            sums = self.callstat.get(key)
+            if sums is None:
+                sums = self.callstat[key] = [set(), set(), 0, set(), 0]
+            sums[0].add(dst)
+            sums[1].add(uniqueid)
+            if lastapp == 'Dial' and disposition == 'ANSWERED':
+                sums[2] += billsec
+                if billsec > LONG_CALL_BILLSEC:
+                    sums[3].add(uniqueid)
+                    sums[4] += billsec
+
+        if lastapp == 'Dial' and profile.counts_for_asr(disposition):
+            sums = self.asr.get(dst)
+            if sums is None:
+                sums = self.asr[dst] = [set(), set(), 0]
+            sums[1].add(uniqueid)
+            if disposition == 'ANSWERED':
+                sums[0].add(uniqueid)
+                sums[2] += billsec
+
+    @classmethod
+    def merged(cls, parts):
+        """Aggregates of several hours; distinct sets are united, sums added"""
+        total = cls()
+        for part in parts:
+            for key, sums in part.callstat.items():
+                into = total.callstat.get(key)
+                if into is None:
+                    total.callstat[key] = [set(sums[0]), set(sums[1]), sums[2], set(sums[3]), sums[4]]
+                    continue
+                into[0] |= sums[0]
+                into[1] |= sums[1]
+                into[2] += sums[2]
+                into[3] |= sums[3]
+                into[4] += sums[4]
+            for dst, sums in part.asr.items():
+                into = total.asr.get(dst)
+                if into is None:
+                    total.asr[dst] = [set(sums[0]), set(sums[1]), sums[2]]
+                    continue
+                into[0] |= sums[0]
+                into[1] |= sums[1]
+                into[2] += sums[2]
+        return total
+
+    def callstat_rows(self):
+        """Rows shaped like the compiled 'callstat' query result, ordered by call time"""
+        rows = [
+            {
+                'cnum': cnum,
+                'cnam': cnam,
+                'unique_calls': len(sums[0]),
+                'call_count': len(sums[1]),
+                'total_call_time_minutes': round(sums[2] / 60, 2),
+                'long_calls_count': len(sums[3]),
+                'total_long_calls_minutes': round(sums[4] / 60, 2),
+            }
+            for (cnum, cnam), sums in self.callstat.items()
+        ]
+        rows.sort(key=lambda row: row['total_call_time_minutes'], reverse=True)
+        return rows
+
+    def asr_dst_rows(self):
+        """Rows shaped like the compiled 'asr' query result"""
+        return [
+            {
+                'dst': dst,
+                'answered_calls': len(sums[0]),
+                'total_calls': len(sums[1]),
+                'talk_billsec': sums[2],
+            }
+            for dst, sums in self.asr.items()
+        ]
+
+
+class LiveDatabase:
+    """Aggregates, watermark and directories of one database"""
+
+    def __init__(self, profile=DEFAULT_PROFILE):
+        self.profile = profile
+        self.lock = threading.Lock()
+        self.covered_from = None  # start of the first read; nothing is served before it completes
+        self.high_water = None  # (calldate, uniqueid, sequence) of the newest row read
+        self.hours = {}  # hour start -> Aggregates
+        self.days = {}  # date -> Aggregates
+        self.seen = {}  # hour start -> {(uniqueid, sequence)}, kept for the lookback re-reads
+        self.extensions = None
+        self.trie = None
+        self.version = 0
+        self.views = {}  # (kind, start, end or None) -> built result of the current version
+        self.rows = 0
+        self.polled_at = None
+        self.swept_at = float('-inf')
+
+    def fold(self, rows, today, first_hour):
+        """Count the rows not seen before; returns how many were new"""
+        added = 0
+        for row in rows:
+            calldate = row['calldate']
+            hour = hour_start(calldate)
+            in_hours = hour >= first_hour
+            in_today = calldate.date() == today
+            if not in_hours and not in_today:
+                continue
+            key = (row['uniqueid'], row['sequence'])
+            seen = self.seen.setdefault(hour, set())
+            if key in seen:
+                continue
+            seen.add(key)
+            if in_hours:
+                aggregates = self.hours.get(hour)
+                if aggregates is None:
+                    aggregates = self.hours[hour] = Aggregates()
+                aggregates.add(row, self.profile)
+            if in_today:
+                aggregates = self.days.get(today)
+                if aggregates is None:
+                    aggregates = self.days[today] = Aggregates()
+                aggregates.add(row, self.profile)
+            added += 1
+        if added:
+            self.rows += added
+            self.changed()
+        return added
+
+    def prune(self, today, first_hour, lookback):
+        """Drop the hours and days that left the kept range, and dedup keys no sweep reads again"""
+        expired_hours = [hour for hour in self.hours if hour < first_hour]
+        expired_days = [day for day in self.days if day < today]
+        for hour in expired_hours:
+            del self.hours[hour]
+        for day in expired_days:
+            del self.days[day]
+        if expired_hours or expired_days:
+            self.views.clear()
+        if self.high_water is not None:
+            oldest = hour_start(self.high_water[0] - lookback)
+            for hour in [hour for hour in self.seen if hour < oldest]:
+                del self.seen[hour]
+
+    def changed(self):
+        self.version += 1
+        self.views.clear()
+
+
+class LiveStats(threading.Thread):
+    """Background thread keeping rolling aggregates of every configured database in memory.
+
+    Args:
+        db_configs: databases to follow.
+        connect: connect(db_config) returning a DictCursor connection.
+        load_directories: load_directories(db_name, cursor) returning (extensions, country trie).
+        interval: seconds between polls.
+        hours: hours of per-hour aggregates kept (the longest "last N hours" window served).
+        lookback: seconds before the watermark read again by each sweep.
+        sweep_interval: seconds between lookback sweeps.
+        batch_size: rows per query.
+        profile: filter profile the rows are counted with; load_directories must return its extensions.
+    """
+
+    def __init__(self, db_configs, connect, load_directories, interval=5, hours=24, lookback=7200,
+                 sweep_interval=60, batch_size=5000, profile=DEFAULT_PROFILE):
+        super().__init__(name='live-stats', daemon=True)
+        self.db_configs = db_configs
+        self.connect = connect
+        self.load_directories = load_directories
+        self.interval = interval
+        self.hours = hours
+        self.lookback = timedelta(seconds=lookback)
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self.profile = profile
+        # Aggregates older than this are no longer current; such windows go to the database
+        self.max_lag = max(3 * interval, 30)
+        self.states = {db_config['name']: LiveDatabase(profile) for db_config in db_configs}
+        self._stop_event = threading.Event()
+        self._connections = {}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        logger.info(f"Live stats started for {len(self.db_configs)} database(s)")
+        try:
+            while not self._stop_event.is_set():
+                for db_config in self.db_configs:
+                    if self._stop_event.is_set():
+                        break
+                    try:
+                        self.poll(db_config)
+                    except Exception as e:
+                        logger.error(f"Live stats poll of {db_config['name']} failed: {str(e)}")
+                        self._drop_connection(db_config)
+                self._stop_event.wait(self.interval)
+        finally:
+            for db_config in self.db_configs:
+                self._drop_connection(db_config)
+
+    def first_hour(self, now):
+        """Start of the oldest hour kept"""
+        return hour_start(now) - timedelta(hours=self.hours - 1)
+
+    def poll(self, db_config):
+        """Fold the rows added since the last poll (or the lookback sweep) into the aggregates; returns new rows"""
+        db_name = db_config['name']
+        state = self.states[db_name]
+        connection = self._connection(db_config)
+        now = datetime.now().replace(microsecond=0)
+        today = now.date()
+        first_hour = self.first_hour(now)
+
+        sweep = True
+        if state.covered_from is None:
+            # First poll: everything since midnight or since the oldest hour kept, whichever is earlier
+            start = min(datetime.combine(today, datetime.min.time()), first_hour)
+            key = (start, '', -1)
+        elif time.monotonic() - state.swept_at >= self.sweep_interval:
+            start = max(state.covered_from, state.high_water[0] - self.lookback)
+            key = (start, '', -1)
+        else:
+            start = state.high_water[0]
+            key = state.high_water
+            sweep = False
+
+        added = 0
+        with connection.cursor() as cursor:
+            extensions, trie = self.load_directories(db_name, cursor)
+            while not self._stop_event.is_set():
+                cursor.execute(LIVE_TAIL_QUERY, (
+                    start, now, key[0], key[0], key[1], key[1], key[2], self.batch_size
+                ))
+                rows = cursor.fetchall()
+                if rows:
+                    last = rows[-1]
+                    key = (last['calldate'], last['uniqueid'], last['sequence'])
+                    with state.lock:
+                        added += state.fold(rows, today, first_hour)
+                        if state.high_water is None or key > state.high_water:
+                            state.high_water = key
+                if len(rows) < self.batch_size:
+                    break
+
+        with state.lock:
+            if extensions is not state.extensions or trie is not state.trie:
+                state.extensions = extensions
+                state.trie = trie
+                state.changed()
+            if state.covered_from is None:
+                state.covered_from = start
+                if state.high_water is None:
+                    state.high_water = (start, '', -1)
+                logger.info(f"Live stats of {db_name} loaded {state.rows} CDR row(s) since {start}")
+            if sweep:
+                state.swept_at = time.monotonic()
+            state.prune(today, first_hour, self.lookback)
+            state.polled_at = time.monotonic()
+        return added
+
+    def covers(self, db_name, start, end):
+        """True when [start, end) can be answered from memory: it starts at an hour boundary within
+        the kept hours (or at midnight today) and ends now or later, or at a later hour boundary
+        """
+        state = self.states.get(db_name)
+        if state is None or state.covered_from is None or state.polled_at is None:
+            return False
+        if time.monotonic() - state.polled_at > self.max_lag:
+            return False
+        if start != hour_start(start) or start < state.covered_from:
+            return False
+        now = datetime.now()
+        if end < now and (end != hour_start(end) or end <= start):
+            return False
+        if start == datetime.combine(now.date(), datetime.min.time()) and end >= now:
+            return True
+        return start >= self.first_hour(now)
+
+    def view(self, db_name, kind, start, end, build):
+        """Result of a covered window, built once per change of the aggregates.
+
+        kind is 'callstat' (build(rows, extensions)) or 'asr' (build(dst_rows, trie)); rows are
+        shaped like the compiled 'callstat' or 'asr' query results. The result is shared between
+        requests, so callers must not modify it.
+        """
+        state = self.states[db_name]
+        now = datetime.now()
+        open_ended = end >= now
+        view_key = (kind, start, None if open_ended else end)
+        with state.lock:
+            result = state.views.get(view_key)
+            if result is not None:
+                return result
+            if open_ended and start == datetime.combine(now.date(), datetime.min.time()):
+                aggregates = state.days.get(now.date()) or Aggregates()
+            else:
+                aggregates = Aggregates.merged(
+                    part for hour, part in state.hours.items() if hour >= start and (open_ended or hour < end)
+                )
+            if kind == 'callstat':
+                result = build(aggregates.callstat_rows(), state.extensions)
+            else:
+                result = build(aggregates.asr_dst_rows(), state.trie)
+            state.views[view_key] = result
+            return result
+
+    def lag_seconds(self):
+        """Seconds since the last successful poll per database (None before the first one)"""
+        now = time.monotonic()
+        return {
+            db_name: None if state.polled_at is None else now - state.polled_at
+            for db_name, state in self.states.items()
+        }
+
+    def status(self):
+        """Coverage and progress per database"""
+        lags = self.lag_seconds()
+        status = {}
+        for db_name, state in self.states.items():
+            with state.lock:
+                status[db_name] = {
+                    'covered_from': state.covered_from.strftime('%Y-%m-%d %H:%M:%S') if state.covered_from else None,
+                    'watermark': state.high_water[0].strftime('%Y-%m-%d %H:%M:%S') if state.high_water else None,
+                    'rows': state.rows,
+                    'hours': len(state.hours),
+                    'version': state.version,
+                    'lag_seconds': None if lags[db_name] is None else round(lags[db_name], 1),
+                }
+        return status
+
+    def _connection(self, db_config):
+        connection = self._connections.get(db_config['name'])
+        if connection is None or not connection.open:
+            connection = self._connections[db_config['name']] = self.connect(db_config)
+        return connection
+
+    def _drop_connection(self, db_config):
+        connection = self._connections.pop(db_config['name'], None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
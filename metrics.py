@@ -0,0 +1,157 @@
+"""In-process timing spans and counters rendered in the Prometheus text exposition format.
+
+Values are kept per process: with several Gunicorn workers every scrape sees the worker
+that served it.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Latency buckets (seconds) from sub-millisecond Python phases up to slow CDR scans
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in items) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{format_labels(dict(zip(self.labelnames, key)))} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with labels"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_list = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_list:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labels, {'le': format_value(float(bound))})} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(labels, {'le': '+Inf'})} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(float(series[-2]))}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Metrics of one process plus collectors that report current values at scrape time"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Register func() -> [(name, type, help, [(labels, value), ...]), ...]; usable as a decorator"""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, metric_type, help_text, samples in collect():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+phase_seconds = registry.histogram(
+    'callstat_phase_duration_seconds', 'Time spent per request phase and database', ('phase', 'db')
+)
+request_seconds = registry.histogram(
+    'callstat_request_duration_seconds', 'HTTP request duration per endpoint', ('endpoint', 'status')
+)
+db_errors = registry.counter(
+    'callstat_db_errors_total', 'Failed per-database queries by kind (timeout or error)', ('db', 'kind')
+)
+export_rows = registry.counter(
+    'callstat_export_rows_total', 'CDR rows streamed by /export per database', ('db',)
+)
+prepared_statements = registry.counter(
+    'callstat_prepared_statements_total', 'Server-side prepared statement events (prepare, execute, fallback)', ('event',)
+)
+
+
+@contextmanager
+def span(phase, db=''):
+    """Time the enclosed block into callstat_phase_duration_seconds{phase, db}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_seconds.observe(time.perf_counter() - started, phase=phase, db=db or '')
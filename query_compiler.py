@@ -0,0 +1,358 @@
+"""CDR queries composed from named metrics, row filters, grouping keys and a calldate window strategy.
+
+Every statement sent to a CDR database is compiled here, so a filter or a metric is written
+once and each query only lists the parts it needs (QUERIES). Two window strategies exist: one
+half-open `calldate >= %s AND calldate < %s` range, or several ranges as CASE buckets over
+one scan (compile_batch). The row filters are rendered for a filter profile (extension ranges,
+internal destinations, dispositions; see filter_profiles.py), so compiled statements are
+cached by their specification and profile.
+
+compile_sketch_query builds the approx=1 variants: instead of COUNT(DISTINCT ...) each group
+returns HyperLogLog registers of the counted values (see sketches.py).
+
+PreparedStatements optionally runs them as server-side prepared statements (SQL PREPARE and
+EXECUTE, prepared once per connection): PyMySQL has no binary-protocol prepare.
+"""
+import functools
+import logging
+import threading
+import weakref
+from collections import namedtuple
+
+import metrics
+import sketches
+from filter_profiles import DEFAULT_PROFILE
+
+
+logger = logging.getLogger(__name__)
+
+WINDOW = "cdr.calldate >= %s AND cdr.calldate < %s"
+
+# Row filters by name; {placeholders} are the filter profile's parts (profile_sql)
+FILTERS = {
+    'extension': "{extension_ranges}",
+    'callstat_calls': "cdr.lastapp IN ('Dial', 'Busy', 'Congestion') AND {callstat_dispositions}",
+    'asr_calls': "cdr.lastapp = 'Dial' AND {asr_dispositions}",
+    # Excludes internal calls (4-digit destinations by default)
+    'external_dst': "{external_dst}",
+}
+CALLSTAT_FILTERS = ('extension', 'callstat_calls', 'external_dst')
+ASR_FILTERS = ('asr_calls', 'external_dst')
+
+ANSWERED = "cdr.lastapp = 'Dial' AND cdr.disposition = 'ANSWERED'"
+LONG_CALL = ANSWERED + " AND cdr.billsec > 90"
+
+# Aggregate functions: (unconditional form, form counting only rows matching {condition})
+AGGREGATES = {
+    'count_distinct': ("COUNT(DISTINCT {value})", "COUNT(DISTINCT CASE WHEN {condition} THEN {value} ELSE NULL END)"),
+    'sum': ("SUM({value})", "SUM(CASE WHEN {condition} THEN {value} ELSE 0 END)"),
+    'concat_distinct': ("GROUP_CONCAT(DISTINCT {value} SEPARATOR '\n')",
+                        "GROUP_CONCAT(DISTINCT CASE WHEN {condition} THEN {value} ELSE NULL END SEPARATOR '\n')"),
+}
+
+# Metrics by name: (aggregate, value, condition or None)
+METRICS = {
+    'unique_calls': ('count_distinct', 'cdr.dst', None),
+    'call_count': ('count_distinct', 'cdr.uniqueid', None),
+    'billsec': ('sum', 'cdr.billsec', ANSWERED),
+    'long_calls_count': ('count_distinct', 'cdr.uniqueid', LONG_CALL),
+    'long_billsec': ('sum', 'cdr.billsec', LONG_CALL),
+    'dsts': ('concat_distinct', 'cdr.dst', None),
+    'answered_calls': ('count_distinct', 'cdr.uniqueid', "cdr.disposition = 'ANSWERED'"),
+    'total_calls': ('count_distinct', 'cdr.uniqueid', None),
+    'talk_billsec': ('sum', 'cdr.billsec', "cdr.disposition = 'ANSWERED'"),
+}
+# Billsec metrics reported as minutes rounded to 2 decimals by the database
+MINUTES = {
+    'total_call_time_minutes': 'billsec',
+    'total_long_calls_minutes': 'long_billsec',
+}
+
+# Grouping keys by name: (select expression, group expression)
+KEYS = {
+    'day': ("DATE(cdr.calldate) AS day", "DATE(cdr.calldate)"),
+    'hour': ("HOUR(cdr.calldate) AS hour", "HOUR(cdr.calldate)"),
+    'cnum': ("cdr.cnum", "cdr.cnum"),
+    'cnam': ("IFNULL(cdr.cnam, '') AS cnam", "IFNULL(cdr.cnam, '')"),
+    'dst': ("cdr.dst", "cdr.dst"),
+    # Enough leading characters of dst to find its country code (sketch queries only)
+    'dst_prefix': ("LEFT(cdr.dst, {prefix_length}) AS dst_prefix", "LEFT(cdr.dst, {prefix_length})"),
+}
+
+QuerySpec = namedtuple('QuerySpec', 'keys metrics columns filters order_by', defaults=((), (), (), (), None))
+
+QUERIES = {
+    # Per-extension call statistics
+    'callstat': QuerySpec(
+        keys=('cnum', 'cnam'),
+        metrics=('unique_calls', 'call_count', 'total_call_time_minutes', 'long_calls_count', 'total_long_calls_minutes'),
+        filters=CALLSTAT_FILTERS,
+        order_by='total_call_time_minutes DESC',
+    ),
+    # Mergeable per-day and per-hour aggregates (raw billsec and the distinct destinations)
+    'daily_aggregates': QuerySpec(
+        keys=('day', 'cnum', 'cnam'),
+        metrics=('call_count', 'billsec', 'long_calls_count', 'long_billsec', 'dsts'),
+        filters=CALLSTAT_FILTERS,
+    ),
+    'hourly_aggregates': QuerySpec(
+        keys=('day', 'hour', 'cnum', 'cnam'),
+        metrics=('call_count', 'billsec', 'long_calls_count', 'long_billsec', 'dsts'),
+        filters=CALLSTAT_FILTERS,
+    ),
+    # Per-destination aggregates; country mapping and grouping happen in the service (country_codes.py)
+    'asr': QuerySpec(
+        keys=('dst',),
+        metrics=('answered_calls', 'total_calls', 'talk_billsec'),
+        filters=ASR_FILTERS,
+    ),
+    # Raw CDR rows behind /callstat, in calldate order (a range scan of the calldate index, no filesort)
+    'export': QuerySpec(
+        columns=('calldate', 'uniqueid', 'cnum', 'cnam', 'dst', 'lastapp', 'disposition', 'duration', 'billsec'),
+        filters=CALLSTAT_FILTERS,
+        order_by='cdr.calldate',
+    ),
+}
+
+# Metric families of the batch query: (row filters besides external_dst, metrics)
+BATCH_FAMILIES = {
+    'callstat': (('extension', 'callstat_calls'), ('unique_calls', 'call_count', 'billsec', 'long_calls_count', 'long_billsec')),
+    'asrstat': (('asr_calls',), ('answered_calls', 'total_calls', 'talk_billsec')),
+}
+
+SketchSpec = namedtuple('SketchSpec', 'keys sketches sums filters')
+
+# approx=1 queries: HyperLogLog sketches as (name, hashed value, condition or None), exact sums (METRICS).
+# ASR sketches are per destination prefix and estimated one by one (see country_codes.aggregate_sketches_by_country).
+SKETCH_QUERIES = {
+    'callstat': SketchSpec(
+        keys=('cnum', 'cnam'),
+        sketches=(('unique_calls', 'cdr.dst', None), ('call_count', 'cdr.uniqueid', None),
+                  ('long_calls_count', 'cdr.uniqueid', LONG_CALL)),
+        sums=('billsec', 'long_billsec'),
+        filters=CALLSTAT_FILTERS,
+    ),
+    'asr': SketchSpec(
+        keys=('dst_prefix',),
+        sketches=(('answered_calls', 'cdr.uniqueid', "cdr.disposition = 'ANSWERED'"),
+                  ('total_calls', 'cdr.uniqueid', None), ('unique_destinations', 'cdr.dst', None)),
+        sums=('talk_billsec',),
+        filters=ASR_FILTERS,
+    ),
+}
+
+
+def metric_sql(name, extra_condition=None):
+    """SQL of a metric; extra_condition restricts the rows it counts (batch windows)"""
+    if name in MINUTES:
+        return f"ROUND({metric_sql(MINUTES[name], extra_condition)} / 60, 2)"
+    aggregate, value, condition = METRICS[name]
+    conditions = [part for part in (extra_condition, condition) if part]
+    if not conditions:
+        return AGGREGATES[aggregate][0].format(value=value)
+    return AGGREGATES[aggregate][1].format(value=value, condition=' AND '.join(conditions))
+
+
+@functools.lru_cache(maxsize=32)
+def profile_sql(profile):
+    """SQL of the profile-dependent parts of FILTERS"""
+    return {
+        'extension_ranges': profile.extension_sql('cdr.cnum'),
+        'callstat_dispositions': profile.callstat_disposition_sql('cdr.disposition'),
+        'asr_dispositions': profile.asr_disposition_sql('cdr.disposition'),
+        'external_dst': profile.external_dst_sql('cdr.dst'),
+    }
+
+
+def filter_sql(name, profile):
+    return FILTERS[name].format(**profile_sql(profile))
+
+
+def where_sql(filters, profile):
+    return ''.join(f"\n  AND {filter_sql(name, profile)}" for name in filters)
+
+
+@functools.lru_cache(maxsize=128)
+def compile_query(name, cnum_count=0, profile=DEFAULT_PROFILE):
+    """SQL of a QUERIES entry over one calldate window, parameters (start, end[, *cnums]).
+
+    cnum_count > 0 restricts it to that many extensions (an IN list of placeholders).
+    """
+    spec = QUERIES[name]
+    select = [KEYS[key][0] for key in spec.keys]
+    select += [f"{metric_sql(metric)} AS {metric}" for metric in spec.metrics]
+    select += [f"cdr.{column}" for column in spec.columns]
+
+    sql = "SELECT\n    " + ',\n    '.join(select) + "\nFROM asteriskcdrdb.cdr\nWHERE " + WINDOW + where_sql(spec.filters, profile)
+    if cnum_count:
+        sql += f"\n  AND cdr.cnum IN ({', '.join(['%s'] * cnum_count)})"
+    if spec.keys:
+        sql += "\nGROUP BY " + ', '.join(KEYS[key][1] for key in spec.keys)
+    if spec.order_by:
+        sql += "\nORDER BY " + spec.order_by
+    return sql + "\n"
+
+
+@functools.lru_cache(maxsize=128)
+def compile_batch(window_count, families, profile=DEFAULT_PROFILE):
+    """One grouped scan answering metric families (BATCH_FAMILIES names) for window_count windows.
+
+    Every window is a CASE bucket over the same rows; columns are named
+    {family}_{metric}_{window index}. WITH ROLLUP adds a row per (cnum, cnam) with dst NULL
+    whose distinct counts are exact for callstat; the (cnum, cnam, dst) rows carry the
+    per-destination ASR aggregates. Parameters: see batch_params.
+    """
+    columns = []
+    for i in range(window_count):
+        for family in families:
+            row_filters, family_metrics = BATCH_FAMILIES[family]
+            condition = ' AND '.join([WINDOW] + [filter_sql(name, profile) for name in row_filters])
+            columns += [f"{metric_sql(metric, condition)} AS {family}_{metric}_{i}" for metric in family_metrics]
+
+    in_any_window = ' OR '.join(f"({WINDOW})" for _ in range(window_count))
+    family_filter = ' OR '.join(
+        '(' + ' AND '.join(filter_sql(name, profile) for name in BATCH_FAMILIES[family][0]) + ')' for family in families
+    )
+    return (
+        "SELECT\n"
+        "    IFNULL(cdr.cnum, '') AS ext_cnum,\n"
+        "    IFNULL(cdr.cnam, '') AS ext_cnam,\n"
+        "    cdr.dst,\n    "
+        + ',\n    '.join(columns) + "\n"
+        "FROM asteriskcdrdb.cdr\n"
+        f"WHERE ({in_any_window})"
+        + where_sql(('external_dst',), profile) + "\n"
+        f"  AND ({family_filter})\n"
+        "GROUP BY ext_cnum, ext_cnam, cdr.dst WITH ROLLUP\n"
+    )
+
+
+def sketch_values(spec):
+    """Hashed values of a SketchSpec, in order; each is bucketed by one UNION ALL branch"""
+    return tuple(dict.fromkeys(value for _, value, _ in spec.sketches))
+
+
+@functools.lru_cache(maxsize=128)
+def compile_sketch_query(name, precision, prefix_length=0, profile=DEFAULT_PROFILE):
+    """SQL of a SKETCH_QUERIES entry over one calldate window, parameters: see sketch_params.
+
+    Each branch groups the rows by the keys and the register of one hashed value (the top
+    `precision` bits of its hash, see sketches.py) and keeps the highest rank per register,
+    which needs no DISTINCT temporary table. The outer query returns one row per key with every sketch as a sparse
+    "register:rank,..." list and the exact sums. Needs a large group_concat_max_len.
+    """
+    spec = SKETCH_QUERIES[name]
+    values = sketch_values(spec)
+    width = 32 - precision
+    key_select = [KEYS[key][0].format(prefix_length=prefix_length) for key in spec.keys]
+    key_group = [KEYS[key][1].format(prefix_length=prefix_length) for key in spec.keys]
+
+    branches = []
+    for i, value in enumerate(values):
+        hashed = f"(CRC32({value}) * {sketches.HASH_MULTIPLIER} & 4294967295)"
+        rest = f"{hashed} & {(1 << width) - 1}"
+        rank = f"{width + 1} - IF({rest} = 0, 0, LENGTH(BIN({rest})))"
+        select = key_select + [f"{hashed} >> {width} AS register"]
+        for sketch, sketch_value, condition in spec.sketches:
+            if sketch_value != value:
+                select.append(f"0 AS {sketch}")
+            elif condition:
+                select.append(f"MAX(CASE WHEN {condition} THEN {rank} ELSE 0 END) AS {sketch}")
+            else:
+                select.append(f"MAX({rank}) AS {sketch}")
+        # Sums are exact; the first branch carries them
+        select += [f"{metric_sql(metric) if i == 0 else 0} AS {metric}" for metric in spec.sums]
+        branches.append(
+            "    SELECT\n        " + ',\n        '.join(select) + "\n"
+            "    FROM asteriskcdrdb.cdr\n"
+            "    WHERE " + WINDOW + where_sql(spec.filters, profile).replace('\n', '\n    ') + "\n"
+            "    GROUP BY " + ', '.join(key_group) + ", register\n"
+        )
+
+    select = [f"sketch.{key}" for key in spec.keys]
+    select += [
+        f"GROUP_CONCAT(CASE WHEN sketch.{sketch} > 0 THEN CONCAT(sketch.register, ':', sketch.{sketch}) "
+        f"ELSE NULL END SEPARATOR ',') AS {sketch}"
+        for sketch, _, _ in spec.sketches
+    ]
+    select += [f"SUM(sketch.{metric}) AS {metric}" for metric in spec.sums]
+    return (
+        "SELECT\n    " + ',\n    '.join(select) + "\n"
+        "FROM (\n" + "    UNION ALL\n".join(branches) + ") AS sketch\n"
+        "GROUP BY " + ', '.join(f"sketch.{key}" for key in spec.keys) + "\n"
+    )
+
+
+def sketch_params(name, start, end):
+    """Parameters of compile_sketch_query(name, ...): the window of every branch"""
+    return (start, end) * len(sketch_values(SKETCH_QUERIES[name]))
+
+
+def batch_params(windows, families):
+    """Parameters of compile_batch(len(windows), families): each metric column's window, then the WHERE windows"""
+    params = []
+    for start, end in windows:
+        for family in families:
+            params.extend((start, end) * len(BATCH_FAMILIES[family][1]))
+    for start, end in windows:
+        params.extend((start, end))
+    return tuple(params)
+
+
+def cache_stats():
+    """Hits and misses of the compiled statement caches"""
+    infos = [compile_query.cache_info(), compile_batch.cache_info(), compile_sketch_query.cache_info()]
+    return {
+        'hits': sum(info.hits for info in infos),
+        'misses': sum(info.misses for info in infos),
+        'entries': sum(info.currsize for info in infos),
+    }
+
+
+class PreparedStatements:
+    """Run statements as server-side prepared statements, prepared once per connection.
+
+    PREPARE takes the statement text with ? placeholders; each execution then sets the
+    parameters as user variables and runs EXECUTE ... USING, so the server skips parsing.
+    When disabled, or when a statement cannot be prepared (e.g. max_prepared_stmt_count is
+    reached), the statement is executed directly.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._names = weakref.WeakKeyDictionary()  # connection -> {sql: statement name}
+        self._lock = threading.Lock()
+
+    def execute(self, cursor, sql, params=()):
+        if not self.enabled:
+            cursor.execute(sql, params)
+            return
+
+        connection = cursor.connection
+        with self._lock:
+            names = self._names.setdefault(connection, {})
+        name = names.get(sql)
+        if name is None:
+            name = f"callstat_stmt_{len(names)}"
+            try:
+                cursor.execute(f"PREPARE {name} FROM %s", (sql.replace('%s', '?'),))
+            except Exception as e:
+                logger.warning(f"Could not prepare statement, executing it directly: {str(e)}")
+                metrics.prepared_statements.inc(event='fallback')
+                cursor.execute(sql, params)
+                return
+            names[sql] = name
+            metrics.prepared_statements.inc(event='prepare')
+
+        try:
+            if params:
+                variables = [f"@callstat_p{i}" for i in range(len(params))]
+                cursor.execute("SET " + ', '.join(f"{variable} = %s" for variable in variables), params)
+                cursor.execute(f"EXECUTE {name} USING {', '.join(variables)}")
+            else:
+                cursor.execute(f"EXECUTE {name}")
+        except Exception:
+            # The session may have lost its statements (e.g. after a reconnect); prepare again next time
+            names.clear()
+            raise
+        metrics.prepared_statements.inc(event='execute')
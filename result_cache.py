@@ -0,0 +1,136 @@
+"""Size-bounded result cache with per-entry expiry and pluggable storage backends"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    """In-process LRU store; entries live as long as the worker process"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, expires_at):
+        """Store an entry and return how many entries were evicted to make room"""
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class DiskBackend:
+    """SQLite-backed LRU store so cached results survive restarts and are shared by workers.
+
+    Values must be JSON serializable.
+    """
+
+    def __init__(self, path, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS result_cache_lru ON result_cache (last_access)")
+
+    def get(self, key):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM result_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE result_cache SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires_at):
+        """Store an entry and return how many entries were evicted to make room"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO result_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, time.time())
+            )
+            evicted = self._db.execute("""
+                DELETE FROM result_cache WHERE key IN (
+                    SELECT key FROM result_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,)).rowcount
+        return evicted
+
+    def delete(self, key):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+
+
+class ResultCache:
+    """Cache of query results, each stored with an absolute expiry time (epoch seconds)"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'evictions': 0}
+
+    def get(self, key):
+        """Return the cached value, or None when missing or past its expiry"""
+        entry = self.backend.get(key)
+        if entry is not None and entry[1] <= time.time():
+            self.backend.delete(key)
+            self._count('expired')
+            entry = None
+        self._count('hits' if entry is not None else 'misses')
+        return entry[0] if entry is not None else None
+
+    def set(self, key, value, expires_at):
+        if expires_at <= time.time():
+            return
+        evicted = self.backend.set(key, value, expires_at)
+        self._count('stores')
+        self._count('evictions', evicted)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['entries'] = len(self.backend)
+        stats['max_entries'] = self.backend.max_entries
+        stats['backend'] = type(self.backend).__name__
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
@@ -0,0 +1,165 @@
+"""Local store of per-day, per-extension call aggregates used to answer long date ranges.
+
+Each day is stored per database and (cnum, cnam) with additive counters plus the exact set of
+distinct destinations, so aggregates of any number of days can be merged without losing
+`unique_calls` accuracy.
+"""
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+
+def new_aggregate():
+    """An empty aggregate for one extension"""
+    return {
+        'call_count': 0,
+        'billsec': 0,
+        'long_calls_count': 0,
+        'long_billsec': 0,
+        'dsts': set(),
+    }
+
+
+def merge_aggregates(target, source):
+    """Merge aggregates keyed by (cnum, cnam) from source into target (in place)"""
+    for key, agg in source.items():
+        merged = target.get(key)
+        if merged is None:
+            merged = target[key] = new_aggregate()
+        merged['call_count'] += agg['call_count']
+        merged['billsec'] += agg['billsec']
+        merged['long_calls_count'] += agg['long_calls_count']
+        merged['long_billsec'] += agg['long_billsec']
+        merged['dsts'].update(agg['dsts'])
+    return target
+
+
+def aggregates_to_rows(aggregates):
+    """Convert merged aggregates into callstat rows, ordered like the SQL query"""
+    rows = [
+        {
+            'cnum': cnum,
+            'cnam': cnam,
+            'unique_calls': len(agg['dsts']),
+            'call_count': agg['call_count'],
+            'total_call_time_minutes': round(agg['billsec'] / 60, 2),
+            'long_calls_count': agg['long_calls_count'],
+            'total_long_calls_minutes': round(agg['long_billsec'] / 60, 2),
+        }
+        for (cnum, cnam), agg in aggregates.items()
+    ]
+    rows.sort(key=lambda row: row['total_call_time_minutes'], reverse=True)
+    return rows
+
+
+def iter_days(first_day, end_day):
+    """Yield dates from first_day up to (excluding) end_day"""
+    day = first_day
+    while day < end_day:
+        yield day
+        day += timedelta(days=1)
+
+
+def contiguous_runs(days):
+    """Split a sorted list of dates into [(first_day, end_day)) runs of consecutive days"""
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] == day:
+            runs[-1][1] = day + timedelta(days=1)
+        else:
+            runs.append([day, day + timedelta(days=1)])
+    return [tuple(run) for run in runs]
+
+
+class RollupStore:
+    """SQLite-backed daily rollups, shared by all threads and Gunicorn workers on the host"""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_days (
+                    db_name TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    built_at REAL NOT NULL,
+                    PRIMARY KEY (db_name, day)
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS rollup_ext_daily (
+                    db_name TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    cnum TEXT NOT NULL,
+                    cnam TEXT NOT NULL,
+                    call_count INTEGER NOT NULL,
+                    billsec INTEGER NOT NULL,
+                    long_calls_count INTEGER NOT NULL,
+                    long_billsec INTEGER NOT NULL,
+                    dsts TEXT NOT NULL,
+                    PRIMARY KEY (db_name, day, cnum, cnam)
+                )
+            """)
+
+    def missing_days(self, db_name, first_day, end_day):
+        """Days in [first_day, end_day) that have not been rolled up yet"""
+        with self._lock:
+            built = {
+                row[0] for row in self._db.execute(
+                    "SELECT day FROM rollup_days WHERE db_name = ? AND day >= ? AND day < ?",
+                    (db_name, first_day.isoformat(), end_day.isoformat())
+                )
+            }
+        return [day for day in iter_days(first_day, end_day) if day.isoformat() not in built]
+
+    def store_days(self, db_name, days, aggregates_by_day):
+        """Replace the rollups of `days` (dates) with aggregates_by_day[date] (empty if absent)"""
+        now = time.time()
+        with self._lock, self._db:
+            for day in days:
+                key = day.isoformat()
+                self._db.execute("DELETE FROM rollup_ext_daily WHERE db_name = ? AND day = ?", (db_name, key))
+                self._db.executemany(
+                    """INSERT INTO rollup_ext_daily
+                       (db_name, day, cnum, cnam, call_count, billsec, long_calls_count, long_billsec, dsts)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    [
+                        (db_name, key, cnum, cnam, agg['call_count'], agg['billsec'],
+                         agg['long_calls_count'], agg['long_billsec'], json.dumps(sorted(agg['dsts'])))
+                        for (cnum, cnam), agg in aggregates_by_day.get(day, {}).items()
+                    ]
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rollup_days (db_name, day, built_at) VALUES (?, ?, ?)",
+                    (db_name, key, now)
+                )
+
+    def load(self, db_name, first_day, end_day):
+        """Merged aggregates keyed by (cnum, cnam) for days in [first_day, end_day)"""
+        merged = {}
+        for aggregates in self.load_by_day(db_name, first_day, end_day).values():
+            merge_aggregates(merged, aggregates)
+        return merged
+
+    def load_by_day(self, db_name, first_day, end_day):
+        """Aggregates of days in [first_day, end_day) as {date: {(cnum, cnam): aggregate}}"""
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT day, cnum, cnam, call_count, billsec, long_calls_count, long_billsec, dsts
+                   FROM rollup_ext_daily WHERE db_name = ? AND day >= ? AND day < ?""",
+                (db_name, first_day.isoformat(), end_day.isoformat())
+            ).fetchall()
+
+        by_day = {}
+        for day, cnum, cnam, call_count, billsec, long_calls_count, long_billsec, dsts in rows:
+            by_day.setdefault(date.fromisoformat(day), {})[(cnum, cnam)] = {
+                'call_count': call_count,
+                'billsec': billsec,
+                'long_calls_count': long_calls_count,
+                'long_billsec': long_billsec,
+                'dsts': set(json.loads(dsts)),
+            }
+        return by_day
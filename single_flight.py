@@ -0,0 +1,126 @@
+"""Coalescing of identical concurrent computations (single-flight).
+
+Within a process, the first caller of a key runs the computation and concurrent callers of
+the same key wait for its result. With a shared directory, workers on the same host also
+coordinate through a per-key lock file and a short-lived SQLite result store, so a result
+computed by one worker is reused by the others that were waiting for it.
+"""
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+from result_cache import DiskBackend
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run func once per key at a time; results are shared with concurrent callers and must be
+    treated as read-only.
+
+    Args:
+        shared_dir: directory for lock files and the shared result store; None keeps
+            coalescing within the process.
+        shared_ttl: seconds a result stays in the shared store for workers that waited on it.
+        lock_timeout: seconds to wait for another worker before computing anyway.
+    """
+
+    def __init__(self, shared_dir=None, shared_ttl=5, lock_timeout=30):
+        self.shared_dir = shared_dir
+        self.shared_ttl = shared_ttl
+        self.lock_timeout = lock_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'followers': 0, 'shared_hits': 0, 'lock_timeouts': 0}
+        self._shared = None
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            self._shared = DiskBackend(os.path.join(shared_dir, 'single_flight.sqlite'), max_entries=1024)
+
+    def do(self, key, func):
+        """Return func(), sharing one execution among concurrent callers of the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._stats['leaders' if leader else 'followers'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, func) if self._shared is not None else func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, func):
+        """Compute under the cross-worker lock of `key`, reusing a result another worker stored"""
+        result = self._shared_get(key)
+        if result is not None:
+            return result
+
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        with open(os.path.join(self.shared_dir, f"{digest}.lock"), 'w') as lock_file:
+            locked = self._acquire(lock_file)
+            try:
+                if locked:
+                    # Another worker may have finished while we waited for the lock
+                    result = self._shared_get(key)
+                    if result is not None:
+                        return result
+                result = func()
+                if 'error' not in result:
+                    try:
+                        self._shared.set(key, result, time.time() + self.shared_ttl)
+                    except (TypeError, ValueError):
+                        pass  # not JSON serializable; only this worker gets it
+                return result
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _acquire(self, lock_file):
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    self._count('lock_timeouts')
+                    return False
+                time.sleep(0.05)
+
+    def _shared_get(self, key):
+        entry = self._shared.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        self._count('shared_hits')
+        return entry[0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,116 @@
+"""HyperLogLog sketches of distinct counts (approx=1 mode).
+
+The databases compute the sketch registers themselves (query_compiler.compile_sketch_query).
+A value is hashed to 32 bits as CRC32 multiplied by 2654435761 mod 2^32; the plain CRC32 of
+Asterisk uniqueids ("<epoch>.<sequence>") is too regular to spread them evenly. The top
+`precision` bits pick one of 2^precision registers, and the register keeps the highest rank
+(position of the first set bit) seen in the remaining bits. Registers are sent as sparse
+"register:rank" lists, one per group (extension or destination prefix) and database.
+
+Every group of every database is estimated on its own and the estimates are added up, like
+the exact counts are: an extension's counts over the databases, a country's over its
+destination prefixes. The sum over-counts a value found in several groups (a call that
+dialled numbers of two prefixes counts twice), which is what the exact queries do too.
+
+Counts are estimated with Ertl's improved estimator ("New cardinality estimation algorithms
+for HyperLogLog sketches", 2017), which needs no switch to linear counting for small counts.
+The relative standard error is 1.04 / sqrt(2^precision) (1.6% at the default precision 12);
+about 95% of estimates fall within twice that. Small counts are off by a few at most: at the
+default precision counts up to about twenty are usually exact and counts of a hundred are
+within 2 of the true count 95% of the time.
+"""
+import math
+import zlib
+
+
+DEFAULT_PRECISION = 12
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+HASH_BITS = 32
+# Multiplier spreading CRC32 values over the 32-bit range (Fibonacci hashing)
+HASH_MULTIPLIER = 2654435761
+
+
+def standard_error(precision):
+    """Relative standard error of a HyperLogLog estimate with 2^precision registers"""
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def _sigma(x):
+    z = x
+    y = 1.0
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x in (0.0, 1.0):
+        return 0.0
+    z = 1 - x
+    y = 1.0
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class HyperLogLog:
+    """Distinct count sketch with 2^precision registers, compatible with the registers built in SQL"""
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not MIN_PRECISION <= precision <= MAX_PRECISION:
+            raise ValueError(f"precision must be between {MIN_PRECISION} and {MAX_PRECISION}")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @classmethod
+    def from_registers(cls, text, precision=DEFAULT_PRECISION):
+        """Sketch from a sparse "register:rank,..." list (None or '' for an empty sketch)"""
+        return cls(precision).add_registers(text)
+
+    def add_registers(self, text):
+        """Merge a sparse "register:rank,..." list into this sketch"""
+        if text:
+            registers = self.registers
+            for pair in text.split(','):
+                index, rank = pair.split(':')
+                index = int(index)
+                rank = int(rank)
+                if rank > registers[index]:
+                    registers[index] = rank
+        return self
+
+    def to_registers(self):
+        """Sparse "register:rank,..." list of the non-empty registers"""
+        return ','.join(f"{index}:{rank}" for index, rank in enumerate(self.registers) if rank)
+
+    def add(self, value):
+        """Add a value hashed like the SQL registers (see the module docstring)"""
+        hashed = zlib.crc32(str(value).encode('utf-8')) * HASH_MULTIPLIER & 0xFFFFFFFF
+        width = HASH_BITS - self.precision
+        index = hashed >> width
+        rank = width + 1 - (hashed & ((1 << width) - 1)).bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        """Estimated number of distinct values added"""
+        count = len(self.registers)
+        width = HASH_BITS - self.precision
+        # Registers per rank (bytearray.count runs in C; ranks are at most width + 1)
+        per_rank = [self.registers.count(rank) for rank in range(width + 2)]
+        if per_rank[0] == count:
+            return 0
+        z = count * _tau(1 - per_rank[width + 1] / count)
+        for rank in range(width, 0, -1):
+            z = 0.5 * (z + per_rank[rank])
+        z += count * _sigma(per_rank[0] / count)
+        return round(count * count / (2 * math.log(2)) / z)
@@ -0,0 +1,115 @@
+"""Shared async executions of asgi.query_coalesced and their cancellation"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiomysql')
+pytest.importorskip('starlette')
+
+import asgi  # noqa: E402
+from db_registry import DatabaseRegistry, database_entry  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class SlowQuery:
+    """Query function that takes `seconds` and remembers how it ended"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = 0
+        self.cancelled = 0
+        self.__name__ = 'slow_query'
+
+    async def __call__(self, db_config, value):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.seconds)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {'status': 'success', 'data': value}
+
+
+def test_identical_calls_share_one_execution():
+    query = SlowQuery(0.05)
+    db_config = {'name': 'a', 'timeout': 5}
+
+    async def scenario():
+        return await asyncio.gather(*(asgi.query_coalesced(db_config, query, 1) for _ in range(3)))
+
+    assert run(scenario()) == [{'status': 'success', 'data': 1}] * 3
+    assert query.calls == 1
+    assert asgi.in_flight == {}
+
+
+def test_shared_execution_survives_one_caller_and_is_cancelled_after_the_last():
+    query = SlowQuery(10)
+    db_config = {'name': 'a', 'timeout': 30}
+
+    async def scenario():
+        first = asyncio.ensure_future(asgi.query_coalesced(db_config, query, 1))
+        second = asyncio.ensure_future(asgi.query_coalesced(db_config, query, 1))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        still_running = query.cancelled == 0 and len(asgi.in_flight) == 1
+        second.cancel()
+        await asyncio.sleep(0.01)
+        # Checked before asyncio.run cancels whatever is left
+        return still_running, query.cancelled, dict(asgi.in_flight)
+
+    assert run(scenario()) == (True, 1, {})
+    assert query.calls == 1
+
+
+def test_execution_is_bounded_by_the_database_timeout():
+    query = SlowQuery(10)
+    db_config = {'name': 'a', 'timeout': 0.05}
+
+    with pytest.raises(TimeoutError, match='No answer from a within 0.05s'):
+        run(asgi.query_coalesced(db_config, query, 1))
+    assert query.cancelled == 1
+
+
+class HungCursor:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, *args):
+        await asyncio.sleep(60)
+
+
+class HungConnection:
+    def cursor(self, *args):
+        return HungCursor()
+
+
+def test_fan_out_timeout_of_a_coalesced_query_counts_towards_the_breaker(monkeypatch):
+    registry = DatabaseRegistry([database_entry({'host': 'pbx', 'timeout': 0.05}, 30)], failure_threshold=2)
+    released = []
+
+    async def get_connection(db_config):
+        return HungConnection()
+
+    monkeypatch.setattr(asgi.sync_app, 'SINGLE_FLIGHT', True)
+    monkeypatch.setattr(asgi.sync_app, 'db_registry', registry)
+    monkeypatch.setattr(asgi.sync_app, 'db_configs', registry.databases)
+    monkeypatch.setattr(asgi, 'get_connection', get_connection)
+    monkeypatch.setattr(asgi, 'release_connection', lambda db_config, connection, discard=False: released.append(discard))
+
+    async def scenario():
+        results = await asgi.fan_out(asgi.query_coalesced, asgi.query_database, '2026-10-16')
+        await asyncio.sleep(0.01)
+        # Checked before asyncio.run cancels whatever is left
+        return results, list(released), registry.breakers['pbx'].failures
+
+    results, discarded, failures = run(scenario())
+    assert results['pbx'] == {'error': 'Timed out querying pbx after 0.05s'}
+    assert discarded == [True]
+    assert failures == 1
@@ -0,0 +1,36 @@
+"""Source parameter of /batch"""
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'API_TOKEN', 'secret')
+    return app.app.test_client()
+
+
+@pytest.fixture
+def queried_sources(monkeypatch):
+    sources = []
+
+    def fan_out(run, query_func, periods, metrics, source=None, profile=None):
+        sources.append(source)
+        return {}
+
+    monkeypatch.setattr(app, 'fan_out', fan_out)
+    return sources
+
+
+def test_live_source_is_rejected(client, queried_sources):
+    response = client.get("/api/v1/secret/batch?periods=today&source=live")
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid source. Use remote or local'}
+    assert queried_sources == []
+
+
+def test_live_default_reads_the_databases(monkeypatch, client, queried_sources):
+    monkeypatch.setattr(app, 'STATS_SOURCE', 'live')
+    assert client.get("/api/v1/secret/batch?periods=today").status_code == 200
+    assert client.get("/api/v1/secret/batch?periods=today&source=local").status_code == 200
+    assert queried_sources == ['remote', 'local']
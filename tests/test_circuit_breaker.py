@@ -0,0 +1,40 @@
+"""Which failed attempts count towards a database's circuit breaker"""
+import pytest
+
+import app
+from db_pool import PoolTimeout
+from db_registry import DatabaseRegistry, database_entry
+
+
+class FailingPool:
+    def __init__(self, error):
+        self.error = error
+
+    def acquire(self):
+        raise self.error
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = DatabaseRegistry([database_entry({'host': 'pbx'}, 30)], failure_threshold=2)
+    monkeypatch.setattr(app, 'db_registry', registry)
+    return registry
+
+
+@pytest.fixture
+def db_config(registry):
+    return registry.databases[0]
+
+
+def test_connect_error_counts_towards_the_breaker(monkeypatch, registry, db_config):
+    monkeypatch.setattr(app, 'get_pool', lambda _: FailingPool(OSError('Connection refused')))
+    assert 'error' in app.query_database(db_config, '2026-10-16')
+    assert registry.breakers['pbx'].failures == 1
+
+
+def test_busy_pool_does_not_count_towards_the_breaker(monkeypatch, registry, db_config):
+    monkeypatch.setattr(app, 'get_pool', lambda _: FailingPool(PoolTimeout('No connection to pbx available')))
+    for _ in range(3):
+        assert 'error' in app.query_database(db_config, '2026-10-16')
+    assert registry.breakers['pbx'].failures == 0
+    assert registry.unavailable(db_config) is None
@@ -0,0 +1,70 @@
+"""Merging per-database callstat rows in combine_results"""
+import app
+
+
+def callstat_row(cnum, cnam, minutes, long_minutes=0.0, calls=1):
+    return {'cnum': cnum, 'cnam': cnam, 'unique_calls': calls, 'call_count': calls,
+            'total_call_time_minutes': minutes, 'long_calls_count': 0 if not long_minutes else 1,
+            'total_long_calls_minutes': long_minutes}
+
+
+def baseline_combine_results(all_results):
+    """combine_results as it was before top=N, inlined"""
+    combined = {}
+    errors = []
+    for db_name, result in all_results.items():
+        if 'error' in result:
+            errors.append({db_name: result['error']})
+            continue
+        for row in result['data']:
+            item = combined.setdefault(row['cnum'], {
+                'cnum': row['cnum'], 'cnam': row['cnam'], 'call_count': 0, 'total_call_time_minutes': 0,
+                'long_calls_count': 0, 'total_long_calls_minutes': 0, 'unique_calls': 0})
+            for field in ('unique_calls', 'call_count', 'total_call_time_minutes', 'long_calls_count',
+                          'total_long_calls_minutes'):
+                item[field] += row[field]
+            if not item['cnam'] and row['cnam']:
+                item['cnam'] = row['cnam']
+    combined_list = list(combined.values())
+    for item in combined_list:
+        item['total_call_time_minutes'] = round(item['total_call_time_minutes'], 2)
+        item['total_long_calls_minutes'] = round(item['total_long_calls_minutes'], 2)
+    combined_list.sort(key=lambda x: x['total_call_time_minutes'], reverse=True)
+    return combined_list, errors
+
+
+ALL_RESULTS = {
+    'pbx1': {'status': 'success', 'data': [
+        callstat_row('2001', '', 10.1, 3.333), callstat_row('2002', 'Bob', 5.0),
+        callstat_row('2003', 'Carol', 0.0, calls=0), callstat_row('2005', 'Eve', 7.5)]},
+    'pbx2': {'error': 'Timed out querying pbx2 after 30s'},
+    'pbx3': {'status': 'success', 'data': [
+        callstat_row('2003', '', 7.5), callstat_row('2001', 'Alice', 0.2, 1.111),
+        callstat_row('2004', 'Dave', 15.3)]},
+    'pbx4': {'status': 'success', 'data': [
+        callstat_row('2002', 'Robert', 2.5, 0.005), callstat_row('2001', 'Al', 0.1, 0.001)]},
+}
+
+
+def test_overlapping_extensions_match_the_baseline_merge():
+    combined, errors = app.combine_results(ALL_RESULTS)
+    assert (combined, errors) == baseline_combine_results(ALL_RESULTS)
+    assert errors == [{'pbx2': 'Timed out querying pbx2 after 30s'}]
+    by_cnum = {row['cnum']: row for row in combined}
+    assert by_cnum['2001'] == {'cnum': '2001', 'cnam': 'Alice', 'call_count': 3, 'total_call_time_minutes': 10.4,
+                               'long_calls_count': 3, 'total_long_calls_minutes': 4.45, 'unique_calls': 3}
+    assert by_cnum['2002']['cnam'] == 'Bob'
+    assert by_cnum['2003']['cnam'] == 'Carol'
+
+
+def test_top_returns_the_first_rows_of_the_baseline_merge():
+    combined, errors = baseline_combine_results(ALL_RESULTS)
+    for top in (0, 1, 3, 10):
+        assert app.combine_results(ALL_RESULTS, top=top) == (combined[:top], errors)
+
+
+def test_ties_keep_the_order_of_the_full_sort():
+    all_results = {'pbx1': {'status': 'success', 'data': [
+        callstat_row(str(2000 + offset), '', 1.0) for offset in range(6)]}}
+    combined, _ = baseline_combine_results(all_results)
+    assert app.combine_results(all_results, top=4)[0] == combined[:4]
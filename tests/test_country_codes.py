@@ -0,0 +1,59 @@
+"""Destination-to-country mapping and ASR grouping"""
+from country_codes import CountryPrefixTrie, aggregate_by_country
+
+CODES = [('1', 'United States'), ('1', 'Canada'), ('44', 'United Kingdom'), ('4420', 'London'),
+         ('7', 'Russia'), ('7', 'Kazakhstan'), ('7', 'Russia')]
+
+
+def test_lookup_ignores_a_leading_plus():
+    trie = CountryPrefixTrie(CODES)
+    assert trie.lookup('+442071234567') == trie.lookup('442071234567') == ('4420', ('London',))
+
+
+def test_lookup_takes_the_longest_matching_code():
+    trie = CountryPrefixTrie(CODES)
+    assert trie.lookup('4420') == ('4420', ('London',))
+    assert trie.lookup('4412') == ('44', ('United Kingdom',))
+    assert trie.lookup('442') == ('44', ('United Kingdom',))
+
+
+def test_lookup_without_match():
+    trie = CountryPrefixTrie(CODES)
+    assert trie.lookup('3312345678') == (None, (None,))
+    assert trie.lookup('') == (None, (None,))
+    assert trie.lookup(None) == (None, (None,))
+
+
+def test_shared_codes_keep_every_country_by_name_whatever_the_table_order():
+    assert CountryPrefixTrie(CODES).lookup('15551234') == ('1', ('Canada', 'United States'))
+    assert CountryPrefixTrie(reversed(CODES)).lookup('+79001234567') == ('7', ('Kazakhstan', 'Russia'))
+
+
+def dst_row(dst, answered_calls, total_calls, talk_billsec):
+    return {'dst': dst, 'answered_calls': answered_calls, 'total_calls': total_calls, 'talk_billsec': talk_billsec}
+
+
+def test_aggregate_by_country_sums_destinations_per_code():
+    rows = [dst_row('442071234567', 1, 3, 60), dst_row('+442079876543', 1, 1, 30),
+            dst_row('441612345678', 2, 2, None), dst_row('3312345678', 0, 1, 0)]
+    results = aggregate_by_country(rows, CountryPrefixTrie(CODES))
+    assert results == [
+        {'country_code': '4420', 'country': 'London', 'answered_calls': 2, 'total_calls': 4,
+         'asr_percentage': 50.0, 'unique_destinations': 2, 'total_talk_minutes': 1.5},
+        {'country_code': '44', 'country': 'United Kingdom', 'answered_calls': 2, 'total_calls': 2,
+         'asr_percentage': 100.0, 'unique_destinations': 1, 'total_talk_minutes': 0.0},
+        {'country_code': 'None', 'country': None, 'answered_calls': 0, 'total_calls': 1,
+         'asr_percentage': 0.0, 'unique_destinations': 1, 'total_talk_minutes': 0.0},
+    ]
+
+
+def test_aggregate_by_country_rounds_asr_like_mysql():
+    results = aggregate_by_country([dst_row('4420', 2, 3, 0)], CountryPrefixTrie(CODES))
+    assert results[0]['asr_percentage'] == 66.67
+
+
+def test_shared_code_gives_every_country_the_code_counts():
+    rows = [dst_row('15551234', 1, 2, 120), dst_row('16135550000', 1, 1, 60)]
+    results = aggregate_by_country(rows, CountryPrefixTrie(CODES))
+    assert [(row['country_code'], row['country'], row['total_calls'], row['unique_destinations']) for row in results] \
+        == [('1', 'Canada', 3, 2), ('1', 'United States', 3, 2)]
@@ -0,0 +1,27 @@
+"""Validation of configured filter profiles"""
+import json
+
+import pytest
+
+import filter_profiles
+
+
+def load(tmp_path, entries):
+    path = tmp_path / 'profiles.json'
+    path.write_text(json.dumps(entries))
+    return filter_profiles.load_filter_profiles({'FILTER_PROFILES_FILE': str(path)})
+
+
+def test_internal_dst_lengths_are_sorted_and_deduplicated(tmp_path):
+    profiles = load(tmp_path, [{'name': 'sales', 'extensions': ['5000-5999'], 'internal_dst_lengths': [5, 3, 5]},
+                               {'name': 'all', 'extensions': ['1000'], 'internal_dst_lengths': []}])
+    assert profiles.get('sales').internal_dst_lengths == (3, 5)
+    assert profiles.get('all').internal_dst_lengths == ()
+    assert profiles.get('all').external_dst_sql('cdr.dst') == 'cdr.dst IS NOT NULL'
+
+
+@pytest.mark.parametrize('lengths', ['4', '', 4, None, {'4': 4}, [4.0], ['4'], [True], [0], [-1],
+                                     [filter_profiles.MAX_INTERNAL_DST_LENGTH + 1]])
+def test_invalid_internal_dst_lengths_are_rejected_at_load_time(tmp_path, lengths):
+    with pytest.raises(ValueError, match='Invalid internal_dst_lengths of profile sales'):
+        load(tmp_path, [{'name': 'sales', 'extensions': ['5000-5999'], 'internal_dst_lengths': lengths}])
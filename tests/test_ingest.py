@@ -0,0 +1,112 @@
+"""CdrIngester keyset pagination against a SQLite stand-in for a PBX database"""
+import sqlite3
+from datetime import datetime, timedelta
+
+import ingest
+
+
+class RemoteCursor:
+    """Runs TAIL_QUERY on SQLite; directory queries return no rows"""
+
+    def __init__(self, db, executed):
+        self.db = db
+        self.executed = executed
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=()):
+        if query is not ingest.TAIL_QUERY:
+            self.rows = []
+            return
+        self.executed.append(params)
+        if len(self.executed) > 50:
+            raise AssertionError('ingestion does not advance')
+        params = [value.strftime(ingest.DATETIME_FORMAT) if isinstance(value, datetime) else value
+                  for value in params]
+        rows = self.db.execute(query.replace('asteriskcdrdb.cdr', 'cdr').replace('%s', '?'), params).fetchall()
+        self.rows = [dict(row, calldate=datetime.strptime(row['calldate'], ingest.DATETIME_FORMAT)) for row in rows]
+
+    def fetchall(self):
+        return self.rows
+
+
+class RemoteConnection:
+    open = True
+
+    def __init__(self, db):
+        self.db = db
+        self.executed = []
+
+    def cursor(self):
+        return RemoteCursor(self.db, self.executed)
+
+    def close(self):
+        pass
+
+
+def remote_database(rows):
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    db.execute("CREATE TABLE cdr (calldate TEXT, uniqueid TEXT, sequence INTEGER, cnum TEXT, cnam TEXT, "
+               "dst TEXT, lastapp TEXT, disposition TEXT, billsec INTEGER)")
+    db.executemany("INSERT INTO cdr VALUES (?, ?, ?, '2001', 'A', '5551234', 'Dial', 'ANSWERED', 30)", rows)
+    return db
+
+
+def test_uniqueids_sorting_out_of_order_across_calldates(tmp_path):
+    # '1700000000.99' sorts after '1700000000.100' as a string but has the earlier calldate
+    now = datetime.now().replace(microsecond=0)
+    rows = [
+        ((now - timedelta(minutes=2)).strftime(ingest.DATETIME_FORMAT), '1700000000.99', 0),
+        ((now - timedelta(minutes=1)).strftime(ingest.DATETIME_FORMAT), '1700000000.100', 0),
+    ]
+    connection = RemoteConnection(remote_database(rows))
+    store = ingest.LocalCdrStore(str(tmp_path / 'cdr.sqlite'))
+    ingester = ingest.CdrIngester(store, [{'name': 'db1'}], lambda db_config: connection,
+                                  batch_size=1, backfill_days=1)
+
+    assert ingester.ingest_once({'name': 'db1'}) == 2
+    stored = store._db.execute("SELECT uniqueid FROM cdr ORDER BY calldate").fetchall()
+    assert [row['uniqueid'] for row in stored] == ['1700000000.99', '1700000000.100']
+    mark = store.watermark('db1')
+    assert (mark['uniqueid'], mark['sequence']) == ('1700000000.100', 0)
+
+
+def test_timeseries_groups_missing_and_empty_cnam_together(tmp_path):
+    store = ingest.LocalCdrStore(str(tmp_path / 'cdr.sqlite'))
+    calldate = datetime(2026, 10, 1, 9, 30)
+    rows = [
+        {'calldate': calldate, 'uniqueid': f'1759300000.{i}', 'sequence': 0, 'cnum': '2001', 'cnam': cnam,
+         'dst': dst, 'lastapp': 'Dial', 'disposition': 'ANSWERED', 'billsec': 60}
+        for i, (cnam, dst) in enumerate([(None, '5551001'), ('', '5551001'), ('', '5551002')])
+    ]
+    store.write_batch('db1', rows, '2026-10-01 00:00:00', ('2026-10-01 09:30:00', '1759300000.2', 0))
+
+    buckets = store.timeseries_rows('db1', datetime(2026, 10, 1), datetime(2026, 10, 2), 'day')
+    assert [(row['cnam'], row['unique_calls'], row['call_count']) for row in buckets] == [('', 2, 3)]
+
+
+def test_local_copy_covers_windows_only_while_polls_are_current(tmp_path):
+    now = datetime.now().replace(microsecond=0)
+    connection = RemoteConnection(remote_database([]))
+    store = ingest.LocalCdrStore(str(tmp_path / 'cdr.sqlite'), max_lag=180)
+    ingester = ingest.CdrIngester(store, [{'name': 'db1'}], lambda db_config: connection, backfill_days=1)
+    ingester.ingest_once({'name': 'db1'})
+    yesterday = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0)
+    today = now.replace(hour=0, minute=0, second=0)
+    tomorrow = today + timedelta(days=1)
+
+    assert store.covers('db1', today, tomorrow)
+    assert not store.covers('db1', yesterday - timedelta(days=1), tomorrow)
+
+    # The ingester stalled ten minutes ago: windows up to then are still complete, later ones are not
+    stalled = now - timedelta(minutes=10)
+    store._db.execute("UPDATE watermarks SET updated_at = ?", (stalled.timestamp(),))
+    assert not store.covers('db1', yesterday, tomorrow)
+    assert not store.covers('db1', yesterday, now - timedelta(minutes=5))
+    assert store.covers('db1', yesterday, stalled)
@@ -0,0 +1,54 @@
+"""Result cache of closed week/month periods"""
+import pytest
+
+import app
+from result_cache import MemoryBackend, ResultCache
+
+
+@pytest.fixture(autouse=True)
+def result_cache(monkeypatch):
+    cache = ResultCache(MemoryBackend(max_entries=16))
+    monkeypatch.setattr(app, 'result_cache', cache)
+    monkeypatch.setattr(app, 'STATS_SOURCE', 'remote')
+    return cache
+
+
+class Query:
+    __name__ = 'query'
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, db_config, date_param, source=None):
+        self.calls += 1
+        return {'status': 'success', 'data': [source, self.calls]}
+
+
+def test_period_is_not_cached_before_it_settles(monkeypatch):
+    # 40 days: the previous month ended less than that ago
+    monkeypatch.setattr(app, 'ROLLUP_SETTLE_HOURS', 40 * 24)
+    query = Query()
+    for _ in range(2):
+        app.query_period_cached({'name': 'pbx'}, 'callstat', query, 'month')
+    assert query.calls == 2
+    assert app.closed_window_expiry('month') is None
+
+    monkeypatch.setattr(app, 'ROLLUP_SETTLE_HOURS', 0)
+    for _ in range(2):
+        app.query_period_cached({'name': 'pbx'}, 'callstat', query, 'month')
+    assert query.calls == 3
+    assert app.closed_window_expiry('month') is not None
+
+
+def test_local_results_are_cached_apart_from_remote_ones(monkeypatch):
+    monkeypatch.setattr(app, 'ROLLUP_SETTLE_HOURS', 0)
+    query = Query()
+    local = app.query_period_cached({'name': 'pbx'}, app.period_cache_endpoint('callstat', source='local'),
+                                    query, 'week', source='local')
+    remote = app.query_period_cached({'name': 'pbx'}, app.period_cache_endpoint('callstat', source='remote'),
+                                     query, 'week', source='remote')
+    assert local['data'] == ['local', 1]
+    assert remote['data'] == ['remote', 2]
+    assert app.period_cache_endpoint('callstat') == 'callstat'
+    assert app.period_cache_endpoint('callstat', approx=True, source='live') == \
+        f"callstat:live:approx{app.APPROX_PRECISION}"
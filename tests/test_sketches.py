@@ -0,0 +1,49 @@
+"""HyperLogLog sketches of the approx=1 mode"""
+import pytest
+
+from sketches import DEFAULT_PRECISION, HyperLogLog, standard_error
+
+
+def uniqueids(count, epoch=1760000000):
+    """Asterisk-like uniqueids, several calls per second"""
+    return [f"{epoch + sequence // 4}.{sequence}" for sequence in range(count)]
+
+
+def test_empty_sketch():
+    sketch = HyperLogLog()
+    assert sketch.estimate() == 0
+    assert sketch.to_registers() == ''
+    assert HyperLogLog.from_registers(None).estimate() == 0
+    assert HyperLogLog.from_registers('').estimate() == 0
+
+
+def test_registers_round_trip():
+    sketch = HyperLogLog()
+    for value in uniqueids(5000):
+        sketch.add(value)
+    received = HyperLogLog.from_registers(sketch.to_registers(), DEFAULT_PRECISION)
+    assert received.registers == sketch.registers
+    assert received.estimate() == sketch.estimate()
+
+
+def test_small_counts_are_nearly_exact():
+    for count in (1, 10, 100):
+        sketch = HyperLogLog()
+        for value in uniqueids(count) * 3:
+            sketch.add(value)
+        assert abs(sketch.estimate() - count) <= count // 25
+
+
+@pytest.mark.parametrize('count', [1000, 20000, 100000])
+def test_estimate_is_within_three_standard_errors(count):
+    sketch = HyperLogLog()
+    for value in uniqueids(count):
+        sketch.add(value)
+    assert abs(sketch.estimate() - count) <= 3 * standard_error(DEFAULT_PRECISION) * count
+
+
+def test_precision_is_validated():
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+    with pytest.raises(ValueError):
+        HyperLogLog(17)
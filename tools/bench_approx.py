@@ -0,0 +1,165 @@
+"""Validate approx=1 (HyperLogLog sketches) against the exact distinct counts.
+
+Against a database seeded with tools/seed_cdr.py it runs the exact and the sketch queries
+of /callstat and /asrstat over the same windows, reports the median wall time of each and
+the relative error of every estimated count (median, maximum and the share within two
+standard errors, where about 95% should fall). With --offline the sketches are built in
+Python from synthetic uniqueids (hashed like the SQL registers) for a range of cardinalities,
+split over three databases whose estimates are summed like combine_results does.
+
+Usage:
+    python tools/bench_approx.py --host 127.0.0.1 --user root --password secret [--seed-data] [--precision 12]
+    python tools/bench_approx.py --offline --cardinalities 100,10000,1000000 --trials 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import seed_cdr  # noqa: E402
+import sketches  # noqa: E402
+from country_codes import CountryPrefixTrie, aggregate_by_country, aggregate_sketches_by_country  # noqa: E402
+
+
+def timed(func, repeat):
+    """Median wall time of `repeat` runs and the last result"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def error_summary(errors, precision):
+    """'median / max / within 2 SE' of relative errors"""
+    if not errors:
+        return 'no rows'
+    bound = 2 * sketches.standard_error(precision)
+    errors = [abs(error) for error in errors]
+    within = sum(error <= bound for error in errors) / len(errors)
+    return (f"median {statistics.median(errors) * 100:.2f}%  max {max(errors) * 100:.2f}%  "
+            f"within 2 SE {within * 100:.0f}% ({len(errors)} rows)")
+
+
+def relative_errors(exact_rows, approx_rows, key, fields, min_count):
+    """Relative error per field over the rows present in both results with an exact count >= min_count"""
+    approx_by_key = {row[key]: row for row in approx_rows}
+    errors = {field: [] for field in fields}
+    for row in exact_rows:
+        estimated = approx_by_key.get(row[key])
+        if estimated is None:
+            continue
+        for field in fields:
+            if row[field] >= min_count:
+                errors[field].append((estimated[field] - row[field]) / row[field])
+    return errors
+
+
+def run_callstat(cursor, start, end, approx):
+    if approx:
+        cursor.execute("SET SESSION group_concat_max_len = 4294967295")
+        cursor.execute(*app.build_callstat_sketch_query(start, end))
+        return app.estimate_callstat_sketches(cursor.fetchall())
+    cursor.execute(*app.build_callstat_query(start, end))
+    return cursor.fetchall()
+
+
+def run_asr(cursor, trie, start, end, approx):
+    if approx:
+        cursor.execute("SET SESSION group_concat_max_len = 4294967295")
+        cursor.execute(*app.build_asr_sketch_query(start, end, trie.max_code_length + 1))
+        return aggregate_sketches_by_country(cursor.fetchall(), trie, app.APPROX_PRECISION)
+    cursor.execute(*app.build_asr_query(start, end))
+    return aggregate_by_country(cursor.fetchall(), trie)
+
+
+def bench_database(args):
+    app.APPROX_PRECISION = args.precision
+    connection = seed_cdr.connect(args)
+    try:
+        if args.seed_data:
+            print(f"Seeded {seed_cdr.seed(connection, args)} CDR rows")
+        with connection.cursor() as cursor:
+            cursor.execute(app.CountryCodeDirectory.QUERY)
+            trie = CountryPrefixTrie((row['code'], row['country']) for row in cursor.fetchall())
+
+            now = datetime.now().replace(minute=0, second=0, microsecond=0)
+            windows = [
+                ('week', app.calldate_window('week')),
+                ('month', app.calldate_window('month')),
+                ('90 days', (now - timedelta(days=90), now)),
+                (f"{args.days} days", (now - timedelta(days=args.days), now)),
+            ]
+            print(f"precision {args.precision}: {1 << args.precision} registers, "
+                  f"standard error {sketches.standard_error(args.precision) * 100:.2f}%")
+            for label, (start, end) in windows:
+                exact_time, exact = timed(lambda: run_callstat(cursor, start, end, False), args.repeat)
+                approx_time, approx = timed(lambda: run_callstat(cursor, start, end, True), args.repeat)
+                print(f"\n{label} callstat: exact {exact_time * 1000:.1f}ms, approx {approx_time * 1000:.1f}ms "
+                      f"({exact_time / approx_time:.1f}x)")
+                fields = ('unique_calls', 'call_count', 'long_calls_count')
+                for field, errors in relative_errors(exact, approx, 'cnum', fields, args.min_count).items():
+                    print(f"  {field:<20}{error_summary(errors, args.precision)}")
+
+                exact_time, exact = timed(lambda: run_asr(cursor, trie, start, end, False), args.repeat)
+                approx_time, approx = timed(lambda: run_asr(cursor, trie, start, end, True), args.repeat)
+                print(f"{label} asrstat: exact {exact_time * 1000:.1f}ms, approx {approx_time * 1000:.1f}ms "
+                      f"({exact_time / approx_time:.1f}x)")
+                fields = ('answered_calls', 'total_calls', 'unique_destinations')
+                for field, errors in relative_errors(exact, approx, 'country_code', fields, args.min_count).items():
+                    print(f"  {field:<20}{error_summary(errors, args.precision)}")
+    finally:
+        connection.close()
+
+
+def bench_offline(args):
+    rng = random.Random(args.seed)
+    started = int(time.time())
+    print(f"precision {args.precision}: {1 << args.precision} registers, "
+          f"standard error {sketches.standard_error(args.precision) * 100:.2f}%")
+    for cardinality in [int(value) for value in args.cardinalities.split(',')]:
+        errors = []
+        round_trips = True
+        for _ in range(args.trials):
+            offset = rng.randrange(10 ** 9)
+            # Uniqueids like Asterisk's "<epoch>.<sequence>", split over three databases
+            parts = [sketches.HyperLogLog(args.precision) for _ in range(3)]
+            for sequence in range(offset, offset + cardinality):
+                parts[sequence % 3].add(f"{started - sequence // 4}.{sequence}")
+            # Sent as sparse register lists and estimated per database
+            received = [sketches.HyperLogLog.from_registers(part.to_registers(), args.precision) for part in parts]
+            round_trips = round_trips and all(r.registers == p.registers for r, p in zip(received, parts))
+            estimate = sum(part.estimate() for part in received)
+            errors.append((estimate - cardinality) / cardinality)
+        print(f"{cardinality:>9} values: {error_summary(errors, args.precision)}, "
+              f"mean {statistics.mean(errors) * 100:+.2f}%, registers round trip: {'yes' if round_trips else 'NO'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed_cdr.add_arguments(parser)
+    parser.add_argument('--seed-data', action='store_true', help='(re)create and seed the schema first')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--precision', type=int, default=sketches.DEFAULT_PRECISION)
+    parser.add_argument('--min-count', type=int, default=1, help='ignore rows whose exact count is smaller')
+    parser.add_argument('--offline', action='store_true', help='check the estimator on synthetic values only')
+    parser.add_argument('--cardinalities', default='10,100,1000,10000,100000', help='distinct values for --offline')
+    parser.add_argument('--trials', type=int, default=10, help='sketches per cardinality for --offline')
+    args = parser.parse_args()
+
+    if args.offline:
+        bench_offline(args)
+    else:
+        bench_database(args)
+
+
+if __name__ == '__main__':
+    main()
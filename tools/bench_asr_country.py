@@ -0,0 +1,146 @@
+"""Compare the ASR query using get_country_code() in SQL with the in-service prefix trie.
+
+Runs both approaches over the same date windows against a database seeded with
+tools/seed_cdr.py, reports the median wall time of each and checks that they return the
+same per-country numbers. With --offline only the Python side (trie lookups + grouping of
+synthetic per-destination rows) is timed, no database needed.
+
+Usage:
+    python tools/bench_asr_country.py --host 127.0.0.1 --user root --password secret [--seed-data]
+    python tools/bench_asr_country.py --offline --dsts 200000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import seed_cdr  # noqa: E402
+from country_codes import CountryPrefixTrie, aggregate_by_country  # noqa: E402
+
+
+# The query the service used before the trie: get_country_code() runs in SELECT, JOIN and GROUP BY
+LEGACY_ASR_QUERY = """
+SELECT
+    get_country_code(cdr.dst) AS country_code,
+    cc.country,
+    COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) AS answered_calls,
+    COUNT(DISTINCT cdr.uniqueid) AS total_calls,
+    ROUND((COUNT(DISTINCT CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.uniqueid ELSE NULL END) /
+           COUNT(DISTINCT cdr.uniqueid)) * 100, 2) AS asr_percentage,
+    COUNT(DISTINCT cdr.dst) AS unique_destinations,
+    ROUND(SUM(CASE WHEN cdr.disposition = 'ANSWERED' THEN cdr.billsec ELSE 0 END) / 60, 2) AS total_talk_minutes
+FROM asteriskcdrdb.cdr
+LEFT JOIN asteriskcdrdb.country_codes cc ON cc.code = get_country_code(cdr.dst)
+WHERE cdr.calldate >= %s AND cdr.calldate < %s
+  AND cdr.lastapp = 'Dial'
+  AND cdr.disposition IN ('ANSWERED', 'NO ANSWER', 'BUSY', 'FAILED')
+  AND cdr.dst NOT REGEXP '^[0-9]{4}$'
+GROUP BY get_country_code(cdr.dst), cc.country
+ORDER BY total_calls DESC
+"""
+
+
+def run_legacy(cursor, start, end):
+    cursor.execute("USE asteriskcdrdb")
+    cursor.execute(LEGACY_ASR_QUERY, (start, end))
+    return [
+        {
+            'country_code': str(row['country_code']),
+            'country': row['country'],
+            'answered_calls': int(row['answered_calls']),
+            'total_calls': int(row['total_calls']),
+            'asr_percentage': round(float(row['asr_percentage']), 2),
+            'unique_destinations': int(row['unique_destinations']),
+            'total_talk_minutes': round(float(row['total_talk_minutes']), 2),
+        }
+        for row in cursor.fetchall()
+    ]
+
+
+def run_trie(cursor, trie, start, end):
+    cursor.execute(*app.build_asr_query(start, end))
+    return aggregate_by_country(cursor.fetchall(), trie)
+
+
+def timed(func, repeat):
+    """Median wall time of `repeat` runs and the last result"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def by_code(rows):
+    return {row['country_code']: row for row in rows}
+
+
+def bench_database(args):
+    connection = seed_cdr.connect(args)
+    try:
+        if args.seed_data:
+            print(f"Seeded {seed_cdr.seed(connection, args)} CDR rows")
+        with connection.cursor() as cursor:
+            cursor.execute(app.CountryCodeDirectory.QUERY)
+            trie = CountryPrefixTrie((row['code'], row['country']) for row in cursor.fetchall())
+
+            yesterday = date.today() - timedelta(days=1)
+            windows = [
+                ('day', app.calldate_window(yesterday.isoformat())),
+                ('week', app.calldate_window('week')),
+                ('month', app.calldate_window('month')),
+            ]
+            print(f"{'window':<8}{'get_country_code':>18}{'trie':>12}{'speedup':>10}  result")
+            for label, (start, end) in windows:
+                legacy_time, legacy = timed(lambda: run_legacy(cursor, start, end), args.repeat)
+                trie_time, grouped = timed(lambda: run_trie(cursor, trie, start, end), args.repeat)
+                same = by_code(legacy) == by_code(grouped)
+                print(f"{label:<8}{legacy_time * 1000:>16.1f}ms{trie_time * 1000:>10.1f}ms"
+                      f"{legacy_time / trie_time:>9.1f}x  {'identical' if same else 'DIFFERENT'}")
+    finally:
+        connection.close()
+
+
+def bench_offline(args):
+    rng = random.Random(args.seed)
+    trie = CountryPrefixTrie(seed_cdr.COUNTRY_CODES)
+    prefixes = args.prefixes.split(',')
+    rows = [
+        {
+            'dst': rng.choice(prefixes) + ''.join(rng.choice('0123456789') for _ in range(9)),
+            'answered_calls': rng.randint(0, 3),
+            'total_calls': rng.randint(3, 6),
+            'talk_billsec': rng.randint(0, 900),
+        }
+        for _ in range(args.dsts)
+    ]
+    elapsed, result = timed(lambda: aggregate_by_country(rows, trie), args.repeat)
+    print(f"Grouped {len(rows)} destinations into {len(result)} countries in {elapsed * 1000:.1f}ms "
+          f"({elapsed / len(rows) * 1e6:.2f}us per destination)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed_cdr.add_arguments(parser)
+    parser.add_argument('--seed-data', action='store_true', help='(re)create and seed the schema first')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--offline', action='store_true', help='time only the Python grouping')
+    parser.add_argument('--dsts', type=int, default=100000, help='destinations for --offline')
+    args = parser.parse_args()
+
+    if args.offline:
+        bench_offline(args)
+    else:
+        bench_database(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Time combine_results with and without top=N selection.
+
+Builds synthetic per-database callstat results (one row per extension, like
+merge_extension_rows returns them, in a different order on every database), times the
+full merge and sort against top=N and checks that top=N returns the first N rows of the
+full result. No database needed.
+
+Usage:
+    python tools/bench_combine.py
+    python tools/bench_combine.py --databases 3,12,40 --extensions 2000,20000 --top 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def synthetic_results(rng, databases, extensions, idle_share):
+    """Per-database results with `extensions` rows each; idle_share of them have zero stats"""
+    all_results = {}
+    for index in range(databases):
+        rows = []
+        for offset in range(extensions):
+            idle = rng.random() < idle_share
+            minutes = 0.0 if idle else round(rng.random() * 600, 2)
+            long_minutes = 0.0 if idle else round(minutes * rng.random(), 2)
+            rows.append({
+                'cnum': str(2000 + offset),
+                'cnam': rng.choice(['', f"Ext {offset}"]),
+                'unique_calls': 0 if idle else rng.randint(1, 60),
+                'call_count': 0 if idle else rng.randint(1, 90),
+                'total_call_time_minutes': minutes,
+                'long_calls_count': 0 if idle else rng.randint(0, 8),
+                'total_long_calls_minutes': long_minutes,
+            })
+        rng.shuffle(rows)
+        all_results[f"pbx{index + 1}"] = {'status': 'success', 'data': rows}
+    all_results['unreachable'] = {'error': 'Timed out querying unreachable after 30s'}
+    return all_results
+
+
+def timed(func, repeat):
+    """Median wall time of `repeat` runs and the last result"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--databases', default='3,12,40', help='comma-separated database counts')
+    parser.add_argument('--extensions', default='2000,20000', help='comma-separated extensions per database')
+    parser.add_argument('--idle-share', type=float, default=0.6, help='share of extensions without calls')
+    parser.add_argument('--top', type=int, default=20, help='N of the top=N run')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'databases':>9}{'extensions':>12}{'full sort':>12}{'top=' + str(args.top):>12}{'speedup':>9}  result")
+    for databases in (int(value) for value in args.databases.split(',')):
+        for extensions in (int(value) for value in args.extensions.split(',')):
+            all_results = synthetic_results(rng, databases, extensions, args.idle_share)
+            full_time, full = timed(lambda: app.combine_results(all_results), args.repeat)
+            top_time, top = timed(lambda: app.combine_results(all_results, top=args.top), args.repeat)
+            same = top == (full[0][:args.top], full[1])
+            print(f"{databases:>9}{extensions:>12}{full_time * 1000:>10.1f}ms{top_time * 1000:>10.1f}ms"
+                  f"{full_time / top_time:>8.2f}x  {'identical' if same else 'DIFFERENT'}")
+
+if __name__ == '__main__':
+    main()
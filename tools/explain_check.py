@@ -0,0 +1,128 @@
+"""Fail if any query generated by app.py does a full table scan of the CDR table.
+
+Runs EXPLAIN for every query builder in app.py over every date mode (today, a past date,
+week, month, a custom range) against a local MySQL/MariaDB seeded with tools/seed_cdr.py.
+Small lookup tables (country_codes, asterisk.sip) may be scanned; asteriskcdrdb.cdr may not.
+Profiles configured with FILTER_PROFILES_FILE are checked as well.
+
+Usage:
+    python tools/explain_check.py --host 127.0.0.1 --user root --password secret [--seed-data]
+"""
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import live_stats  # noqa: E402
+import seed_cdr  # noqa: E402
+
+
+# Tables small enough that a full scan is expected and harmless
+LOOKUP_TABLES = {'cc', 'country_codes', 'sip'}
+# Destination prefix of the approx=1 ASR query (longest country code plus a leading '+')
+ASR_SKETCH_PREFIX_LENGTH = 5
+
+
+def generated_queries():
+    """Yield (label, sql, params) for every query the service can send to a CDR database"""
+    yesterday = date.today() - timedelta(days=1)
+    past_day = date.today() - timedelta(days=3)
+    modes = [
+        ('today', {}),
+        ('date', {'date_param': past_day.isoformat()}),
+        ('week', {'date_param': 'week'}),
+        ('month', {'date_param': 'month'}),
+        ('custom', {'start_dt': f"{yesterday} 08:00:00", 'end_dt': f"{yesterday} 18:00:00"}),
+    ]
+    builders = [
+        ('callstat', app.build_callstat_query),
+        ('daily_aggregates', app.build_daily_aggregates_query),
+        ('hourly_aggregates', app.build_hourly_aggregates_query),
+        ('asrstat', app.build_asr_query),
+        ('export', app.build_export_query),
+    ]
+    for mode, kwargs in modes:
+        start, end = app.calldate_window(**kwargs)
+        for name, builder in builders:
+            sql, params = builder(start, end)
+            yield f"{name}/{mode}", sql, params
+
+    # Other filter profiles (FILTER_PROFILES_FILE) change the extension and destination filters
+    for profile in app.filter_profiles.profiles.values():
+        if profile == app.filter_profiles.default:
+            continue
+        for mode, kwargs in modes:
+            start, end = app.calldate_window(**kwargs)
+            for name, builder in builders:
+                sql, params = builder(start, end, profile=profile)
+                yield f"{name}@{profile.name}/{mode}", sql, params
+
+    # approx=1: every UNION ALL branch of the sketch queries scans the window
+    for mode, kwargs in modes:
+        start, end = app.calldate_window(**kwargs)
+        sql, params = app.build_callstat_sketch_query(start, end)
+        yield f"callstat_sketch/{mode}", sql, params
+        sql, params = app.build_asr_sketch_query(start, end, ASR_SKETCH_PREFIX_LENGTH)
+        yield f"asrstat_sketch/{mode}", sql, params
+
+    # The batch endpoint scans every mode's window at once
+    windows = [app.calldate_window(**kwargs) for _, kwargs in modes]
+    sql, params = app.build_batch_query(windows)
+    yield "batch/all", sql, params
+
+    # The live stats poller pages through today by keyset (first page and a later one)
+    start, end = app.calldate_window()
+    for label, key in (('first', (start, '', -1)), ('next', (start + timedelta(hours=1), 'x', 0))):
+        yield f"live_tail/{label}", live_stats.LIVE_TAIL_QUERY, (
+            start, end, key[0], key[0], key[1], key[1], key[2], 5000
+        )
+
+
+def full_scans(cursor, sql, params):
+    """Return EXPLAIN rows that scan a non-lookup table completely"""
+    cursor.execute("EXPLAIN " + cursor.mogrify(sql, params))
+    # <derivedN>/<unionN> are the query's own intermediate results (sketch queries), not tables
+    return [
+        row for row in cursor.fetchall()
+        if row.get('type') == 'ALL' and row.get('table') not in LOOKUP_TABLES
+        and not (row.get('table') or '').startswith('<')
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed_cdr.add_arguments(parser)
+    parser.add_argument('--seed-data', action='store_true', help='(re)create and seed the schema first')
+    args = parser.parse_args()
+
+    connection = seed_cdr.connect(args)
+    try:
+        if args.seed_data:
+            inserted = seed_cdr.seed(connection, args)
+            print(f"Seeded {inserted} CDR rows")
+
+        failures = 0
+        with connection.cursor() as cursor:
+            # get_country_code() is resolved in the asteriskcdrdb schema
+            cursor.execute("USE asteriskcdrdb")
+            for label, sql, params in generated_queries():
+                scans = full_scans(cursor, sql, params)
+                if scans:
+                    failures += 1
+                    tables = ', '.join(sorted({row['table'] for row in scans}))
+                    print(f"FAIL {label}: full table scan on {tables}")
+                else:
+                    print(f"ok   {label}")
+    finally:
+        connection.close()
+
+    if failures:
+        print(f"{failures} quer{'y' if failures == 1 else 'ies'} scan the CDR table")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+"""Load-test /callstat, /asrstat and /batch against a seeded MySQL/MariaDB stand-in.
+
+Starts the service under Gunicorn (or under Uvicorn with --server async, see asgi.py) with
+all three DB*_HOST settings pointing at the seeded database (or targets a running instance
+with --url), drives every scenario at the given concurrency and reports p50/p95/p99
+latency, throughput, errors and the peak RSS of the server processes, plus the time from
+start to /ready and the latency of the first request after it. --functions
+additionally times query_database, query_asr_database and combine_results in-process.
+
+Every run is saved as JSON under --results-dir, named after the current git commit, so
+runs can be compared across commits:
+
+    python tools/load_test.py --host 127.0.0.1 --user root --password secret --seed-data
+    python tools/load_test.py --host 127.0.0.1 --user root --password secret --baseline 5e47349
+    python tools/load_test.py --compare bench-results/OLD.json bench-results/NEW.json
+
+Running the same commit with --server sync and --server async and comparing the two saved
+runs benchmarks the serving modes against each other.
+
+--compare exits with status 1 when p95 latency or throughput of a scenario regressed by
+more than --threshold percent.
+"""
+import argparse
+import glob
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import seed_cdr  # noqa: E402
+
+
+TOKEN = 'load-test-token'
+
+
+def scenarios():
+    """(name, resource, query) of every request the harness sends"""
+    yesterday = date.today() - timedelta(days=1)
+    past_day = date.today() - timedelta(days=3)
+    return [
+        ('callstat/today', 'callstat', {}),
+        ('callstat/date', 'callstat', {'date': past_day.isoformat()}),
+        ('callstat/week', 'callstat', {'date': 'week'}),
+        ('callstat/month', 'callstat', {'date': 'month'}),
+        ('callstat/range', 'callstat', {'start': f"{yesterday} 08:00", 'end': f"{date.today()} 04:00"}),
+        ('asrstat/today', 'asrstat', {}),
+        ('asrstat/week', 'asrstat', {'date': 'week'}),
+        ('asrstat/month', 'asrstat', {'date': 'month'}),
+        ('batch/sheet', 'batch', {'periods': 'today,week,month'}),
+    ]
+
+
+def percentiles(values):
+    """p50/p95/p99 of a list of seconds, in milliseconds"""
+    if len(values) < 2:
+        value = values[0] * 1000 if values else 0.0
+        return {'p50': value, 'p95': value, 'p99': value}
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': cuts[49] * 1000, 'p95': cuts[94] * 1000, 'p99': cuts[98] * 1000}
+
+
+def git_commit():
+    """Short commit hash of the working tree, suffixed with -dirty when it has changes"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+# --- Server under test ---
+
+def set_database_env(env, args):
+    """Point DB1..DB3 at the seeded server, using the --db-hosts aliases"""
+    hosts = (args.db_hosts or ','.join([args.host] * 3)).split(',')
+    for n, host in enumerate(hosts[:3], start=1):
+        env[f'DB{n}_HOST'] = host
+        env[f'DB{n}_PORT'] = str(args.port)
+        env[f'DB{n}_USER'] = args.user
+        env[f'DB{n}_PASSWORD'] = args.password
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid):
+    """pid and all of its descendants (Linux /proc)"""
+    pids = [pid]
+    for child_pid in pids:
+        try:
+            with open(f"/proc/{child_pid}/task/{child_pid}/children") as children:
+                pids.extend(int(child) for child in children.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def peak_rss_kb(pid):
+    """Sum of VmHWM (peak resident set) over a process tree, in KiB; None where unavailable"""
+    total = 0
+    for tree_pid in process_tree(pid):
+        try:
+            with open(f"/proc/{tree_pid}/status") as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total or None
+
+
+def start_server(args):
+    """Run the app under Gunicorn (or Uvicorn) against the seeded database; returns (process, base_url)"""
+    port = free_port()
+    env = dict(os.environ)
+    env['API_TOKEN'] = TOKEN
+    set_database_env(env, args)
+    if args.server == 'async':
+        command = ['uvicorn', '--host', '127.0.0.1', '--port', str(port), '--workers', str(args.workers),
+                   '--log-level', 'warning', 'asgi:app']
+    else:
+        command = ['gunicorn', '--bind', f"127.0.0.1:{port}", '--workers', str(args.workers),
+                   '--threads', str(args.threads), '--log-level', 'warning', 'app:app']
+    started = time.monotonic()
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = started + 30
+    while time.monotonic() < deadline:
+        if server_ready(base_url):
+            return process, base_url, time.monotonic() - started
+        if process.poll() is not None:
+            raise RuntimeError(f"{command[0]} exited during startup")
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{command[0]} did not start within 30s")
+
+
+def server_ready(base_url):
+    """True once /ready answers 200; commits without /ready count as ready when /pool answers"""
+    try:
+        urllib.request.urlopen(f"{base_url}/ready", timeout=2).read()
+        return True
+    except urllib.error.HTTPError as e:
+        if e.code != 404:
+            return False
+    except (urllib.error.URLError, ConnectionError):
+        return False
+    try:
+        urllib.request.urlopen(f"{base_url}/api/v1/{TOKEN}/pool", timeout=2).read()
+        return True
+    except (urllib.error.URLError, ConnectionError):
+        return False
+
+
+# --- Load generation ---
+
+def fetch(url, timeout):
+    """GET url; returns (seconds, ok) where ok means HTTP 200 without per-database errors"""
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            body = response.read()
+            ok = response.status == 200 and b'"errors"' not in body and b'"error"' not in body
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run_scenario(base_url, resource, query, args):
+    """Send `args.requests` requests with `args.concurrency` clients; returns the stats dict"""
+    url = f"{base_url}/api/v1/{TOKEN}/{resource}"
+    if query:
+        url += '?' + urllib.parse.urlencode(query)
+
+    for _ in range(args.warmup):
+        fetch(url, args.timeout)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(_):
+        nonlocal errors
+        elapsed, ok = fetch(url, args.timeout)
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(worker, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    stats = percentiles(latencies)
+    stats['mean'] = statistics.mean(latencies) * 1000
+    stats['throughput'] = len(latencies) / wall
+    stats['requests'] = len(latencies)
+    stats['errors'] = errors
+    return stats
+
+
+# --- In-process function timings ---
+
+def time_functions(args):
+    """Median/p95 of query_database, query_asr_database and combine_results per date mode"""
+    os.environ['API_TOKEN'] = TOKEN
+    set_database_env(os.environ, args)
+    import app
+
+    db_config = app.db_configs[0]
+    modes = [
+        ('today', {}),
+        ('week', {'date_param': 'week'}),
+        ('month', {'date_param': 'month'}),
+    ]
+    results = {}
+    for mode, kwargs in modes:
+        # Called directly, so the week/month result cache is bypassed
+        timings = {'query_database': [], 'query_asr_database': [], 'combine_results': []}
+        for _ in range(args.function_repeat):
+            started = time.perf_counter()
+            callstat = app.query_database(db_config, **kwargs)
+            timings['query_database'].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            app.query_asr_database(db_config, **kwargs)
+            timings['query_asr_database'].append(time.perf_counter() - started)
+
+            all_results = {f"db{n}": callstat for n in (1, 2, 3)}
+            started = time.perf_counter()
+            app.combine_results(all_results)
+            timings['combine_results'].append(time.perf_counter() - started)
+        for name, values in timings.items():
+            results[f"{name}/{mode}"] = percentiles(values)
+    return results
+
+
+# --- Results ---
+
+def save_results(results, args):
+    os.makedirs(args.results_dir, exist_ok=True)
+    path = os.path.join(
+        args.results_dir, f"{results['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def latest_result(results_dir, commit, server='sync'):
+    """Newest saved run of a commit (prefix match) with the given serving mode, or None"""
+    paths = sorted(glob.glob(os.path.join(results_dir, f"{commit}*.json")), key=os.path.getmtime)
+    for path in reversed(paths):
+        with open(path) as f:
+            if json.load(f)['config'].get('server', 'sync') == server:
+                return path
+    return None
+
+
+def print_run(results):
+    print(f"commit {results['commit']}  server {results['config'].get('server', 'sync')}  "
+          f"concurrency {results['config']['concurrency']}  "
+          f"peak RSS {results['peak_rss_mb'] or 'n/a'} MB")
+    if 'first_request_ms' in results:
+        print(f"boot to ready {results.get('boot_seconds', 'n/a')} s  first request {results['first_request_ms']} ms")
+    print(f"{'scenario':<18}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'errors':>8}")
+    for name, stats in results['scenarios'].items():
+        print(f"{name:<18}{stats['p50']:>7.1f}ms{stats['p95']:>7.1f}ms{stats['p99']:>7.1f}ms"
+              f"{stats['throughput']:>9.1f}{stats['errors']:>8}")
+    for name, stats in results.get('functions', {}).items():
+        print(f"{name:<34}{stats['p50']:>9.1f}ms p50{stats['p95']:>9.1f}ms p95")
+
+
+def compare(base_path, new_path, threshold):
+    """Print per-scenario deltas; returns True when no scenario regressed beyond threshold (%)"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f"{base['commit']} -> {new['commit']}")
+    print(f"{'scenario':<18}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>10}")
+    ok = True
+    for name, stats in new['scenarios'].items():
+        old = base['scenarios'].get(name)
+        if old is None:
+            continue
+        deltas = {
+            key: (stats[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            for key in ('p50', 'p95', 'p99', 'throughput')
+        }
+        regressed = deltas['p95'] > threshold or -deltas['throughput'] > threshold
+        ok = ok and not regressed
+        print(f"{name:<18}" + ''.join(f"{deltas[key]:>+9.1f}%" for key in ('p50', 'p95', 'p99', 'throughput'))
+              + ('  REGRESSION' if regressed else ''))
+    if base.get('first_request_ms') and new.get('first_request_ms'):
+        print(f"first request {base['first_request_ms']} ms -> {new['first_request_ms']} ms, "
+              f"boot to ready {base.get('boot_seconds', 'n/a')} s -> {new.get('boot_seconds', 'n/a')} s")
+    if base.get('peak_rss_mb') and new.get('peak_rss_mb'):
+        print(f"peak RSS {base['peak_rss_mb']} MB -> {new['peak_rss_mb']} MB")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    seed_cdr.add_arguments(parser)
+    parser.add_argument('--seed-data', action='store_true', help='(re)create and seed the schema first')
+    parser.add_argument('--server', choices=('sync', 'async'), default='sync',
+                        help='serving mode to start: Gunicorn with app:app or Uvicorn with asgi:app')
+    parser.add_argument('--url', help='target a running instance instead of starting a server '
+                                      '(its API_TOKEN must be passed with --token)')
+    parser.add_argument('--token', default=None, help='API token for --url')
+    parser.add_argument('--db-hosts', help='three comma-separated names of the seeded server for DB1..DB3; '
+                                           'distinct aliases (e.g. 127.0.0.1,localhost,<hostname>) give '
+                                           'three pools and result entries like production (default: --host x3)')
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn/Uvicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='Gunicorn threads per worker (sync mode)')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=3, help='unmeasured requests per scenario')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--only', help='comma-separated scenario names to run')
+    parser.add_argument('--functions', action='store_true', help='also time the query functions in-process')
+    parser.add_argument('--function-repeat', type=int, default=5)
+    parser.add_argument('--results-dir', default=os.path.join(ROOT, 'bench-results'))
+    parser.add_argument('--baseline', help='commit whose latest saved run to compare against')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two saved runs and exit')
+    parser.add_argument('--threshold', type=float, default=10, help='allowed regression in percent')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(*args.compare, args.threshold) else 1)
+
+    if args.seed_data:
+        connection = seed_cdr.connect(args)
+        try:
+            print(f"Seeded {seed_cdr.seed(connection, args)} CDR rows")
+        finally:
+            connection.close()
+
+    global TOKEN
+    process = None
+    boot_seconds = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        TOKEN = args.token or TOKEN
+    else:
+        process, base_url, boot_seconds = start_server(args)
+
+    selected = set(args.only.split(',')) if args.only else None
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'rows': args.rows, 'days': args.days, 'concurrency': args.concurrency,
+            'requests': args.requests, 'workers': args.workers, 'threads': args.threads,
+            'server': args.server,
+        },
+        'scenarios': {},
+    }
+    if boot_seconds is not None:
+        results['boot_seconds'] = round(boot_seconds, 2)
+    try:
+        # First request after startup, before any scenario warms the service up
+        first_request, _ = fetch(f"{base_url}/api/v1/{TOKEN}/callstat", args.timeout)
+        results['first_request_ms'] = round(first_request * 1000, 1)
+        for name, resource, query in scenarios():
+            if selected and name not in selected:
+                continue
+            results['scenarios'][name] = run_scenario(base_url, resource, query, args)
+            print(f"done {name}")
+        rss = peak_rss_kb(process.pid) if process else None
+        results['peak_rss_mb'] = round(rss / 1024, 1) if rss else None
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+
+    if args.functions:
+        results['functions'] = time_functions(args)
+
+    print_run(results)
+    path = save_results(results, args)
+    print(f"Saved {path}")
+
+    if args.baseline:
+        base_path = latest_result(args.results_dir, args.baseline, args.server)
+        if base_path is None:
+            print(f"No saved {args.server} run for {args.baseline} in {args.results_dir}")
+            sys.exit(1)
+        sys.exit(0 if compare(base_path, path, args.threshold) else 1)
+
+
+if __name__ == '__main__':
+    main()
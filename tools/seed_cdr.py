@@ -0,0 +1,248 @@
+"""Create a stand-in Asterisk schema on a local MySQL/MariaDB and fill it with synthetic CDR rows.
+
+Creates asteriskcdrdb.cdr (with the calldate index FreePBX ships), asteriskcdrdb.country_codes,
+the get_country_code() function from the README and asterisk.sip callerid entries, so the
+queries in app.py can run unchanged against it.
+
+Usage:
+    python tools/seed_cdr.py --host 127.0.0.1 --user root --password secret --rows 200000 --days 400
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pymysql
+
+
+SCHEMA = [
+    "CREATE DATABASE IF NOT EXISTS asteriskcdrdb",
+    "CREATE DATABASE IF NOT EXISTS asterisk",
+    "DROP TABLE IF EXISTS asteriskcdrdb.cdr",
+    """
+    CREATE TABLE asteriskcdrdb.cdr (
+        calldate DATETIME NOT NULL DEFAULT '0000-00-00 00:00:00',
+        clid VARCHAR(80) NOT NULL DEFAULT '',
+        src VARCHAR(80) NOT NULL DEFAULT '',
+        dst VARCHAR(80) NOT NULL DEFAULT '',
+        dcontext VARCHAR(80) NOT NULL DEFAULT '',
+        channel VARCHAR(80) NOT NULL DEFAULT '',
+        dstchannel VARCHAR(80) NOT NULL DEFAULT '',
+        lastapp VARCHAR(80) NOT NULL DEFAULT '',
+        lastdata VARCHAR(80) NOT NULL DEFAULT '',
+        duration INT NOT NULL DEFAULT 0,
+        billsec INT NOT NULL DEFAULT 0,
+        disposition VARCHAR(45) NOT NULL DEFAULT '',
+        amaflags INT NOT NULL DEFAULT 0,
+        accountcode VARCHAR(20) NOT NULL DEFAULT '',
+        uniqueid VARCHAR(32) NOT NULL DEFAULT '',
+        userfield VARCHAR(255) NOT NULL DEFAULT '',
+        cnum VARCHAR(80) NOT NULL DEFAULT '',
+        cnam VARCHAR(80) NOT NULL DEFAULT '',
+        sequence INT NOT NULL DEFAULT 0,
+        KEY calldate (calldate),
+        KEY dst (dst),
+        KEY accountcode (accountcode),
+        KEY uniqueid (uniqueid)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    "DROP TABLE IF EXISTS asteriskcdrdb.country_codes",
+    """
+    CREATE TABLE asteriskcdrdb.country_codes (
+        code VARCHAR(10) PRIMARY KEY,
+        country VARCHAR(100) NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    "DROP FUNCTION IF EXISTS asteriskcdrdb.get_country_code",
+    """
+    CREATE FUNCTION asteriskcdrdb.get_country_code(phone_number VARCHAR(50))
+    RETURNS VARCHAR(10)
+    DETERMINISTIC
+    READS SQL DATA
+    BEGIN
+        DECLARE country_code VARCHAR(10);
+        DECLARE clean_number VARCHAR(50);
+
+        IF LEFT(phone_number, 1) = '+' THEN
+            SET clean_number = SUBSTRING(phone_number, 2);
+        ELSE
+            SET clean_number = phone_number;
+        END IF;
+
+        SELECT code INTO country_code
+        FROM asteriskcdrdb.country_codes
+        WHERE clean_number LIKE CONCAT(code, '%')
+        ORDER BY LENGTH(code) DESC
+        LIMIT 1;
+
+        RETURN country_code;
+    END
+    """,
+    "DROP TABLE IF EXISTS asterisk.sip",
+    """
+    CREATE TABLE asterisk.sip (
+        id VARCHAR(20) NOT NULL DEFAULT '-1',
+        keyword VARCHAR(30) NOT NULL DEFAULT '',
+        data VARCHAR(255) NOT NULL,
+        flags INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (id, keyword)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+]
+
+COUNTRY_CODES = [
+    ('1', 'United States/Canada'), ('7', 'Russia/Kazakhstan'), ('20', 'Egypt'), ('33', 'France'),
+    ('34', 'Spain'), ('39', 'Italy'), ('44', 'United Kingdom'), ('48', 'Poland'), ('49', 'Germany'),
+    ('90', 'Turkey'), ('353', 'Ireland'), ('371', 'Latvia'), ('372', 'Estonia'), ('373', 'Moldova'),
+    ('374', 'Armenia'), ('375', 'Belarus'), ('380', 'Ukraine'), ('995', 'Georgia'), ('998', 'Uzbekistan'),
+    ('1242', 'Bahamas'), ('1876', 'Jamaica'),
+]
+
+DEFAULT_DISPOSITIONS = 'ANSWERED=60,NO ANSWER=25,BUSY=10,FAILED=5'
+DEFAULT_LASTAPPS = 'Dial=88,Busy=4,Congestion=3,Playback=3,Queue=2'
+DEFAULT_PREFIXES = '1,7,33,44,49,90,353,371,375,380,995,1876'
+
+INSERT_CDR = """
+    INSERT INTO asteriskcdrdb.cdr
+        (calldate, clid, src, dst, dcontext, channel, lastapp, duration, billsec, disposition, uniqueid, cnum, cnam, sequence)
+    VALUES (%s, %s, %s, %s, 'from-internal', %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def parse_mix(value):
+    """Parse 'A=60,B=40' into ([names], [weights])"""
+    names, weights = [], []
+    for part in value.split(','):
+        name, weight = part.rsplit('=', 1)
+        names.append(name.strip())
+        weights.append(float(weight))
+    return names, weights
+
+
+def create_schema(connection):
+    """(Re)create the stand-in schema, country codes included"""
+    with connection.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        cursor.executemany(
+            "INSERT INTO asteriskcdrdb.country_codes (code, country) VALUES (%s, %s)", COUNTRY_CODES
+        )
+    connection.commit()
+
+
+def seed_extensions(connection, ext_first, ext_last, rng):
+    """Add asterisk.sip callerid entries for every extension in the range"""
+    rows = [
+        (str(ext), 'callerid', f"Agent {ext} <{ext}>" if rng.random() < 0.9 else f"<{ext}>")
+        for ext in range(ext_first, ext_last + 1)
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany("INSERT INTO asterisk.sip (id, keyword, data) VALUES (%s, %s, %s)", rows)
+    connection.commit()
+
+
+def generate_cdr_rows(rows, days, extensions, dispositions, lastapps, prefixes, rng, end=None):
+    """Yield synthetic cdr tuples (matching INSERT_CDR) spread over the `days` days before `end`"""
+    end = end or datetime.now()
+    span = days * 86400
+    disposition_names, disposition_weights = dispositions
+    lastapp_names, lastapp_weights = lastapps
+    produced = 0
+    sequence = 0
+    while produced < rows:
+        calldate = (end - timedelta(seconds=rng.randrange(span))).replace(microsecond=0)
+        cnum = str(rng.choice(extensions)) if rng.random() < 0.9 else str(rng.randint(100000, 999999))
+        if rng.random() < 0.15:
+            dst = str(rng.randint(1000, 9999))  # internal 4-digit call
+        else:
+            dst = rng.choice(prefixes) + ''.join(rng.choice('0123456789') for _ in range(9))
+        disposition = rng.choices(disposition_names, disposition_weights)[0]
+        lastapp = rng.choices(lastapp_names, lastapp_weights)[0]
+        billsec = int(rng.expovariate(1 / 120)) if disposition == 'ANSWERED' else 0
+        uniqueid = f"{int(calldate.timestamp())}.{sequence}"
+        # Some calls leave several CDR rows under the same uniqueid (transfers, forks)
+        legs = 2 if rng.random() < 0.1 else 1
+        for leg in range(legs):
+            sequence += 1
+            produced += 1
+            yield (
+                calldate, f'"{cnum}" <{cnum}>', cnum, dst, f"SIP/{cnum}-{sequence:08x}", lastapp,
+                billsec + 5, billsec if leg == 0 else 0, disposition, uniqueid, cnum, f"Agent {cnum}", sequence
+            )
+
+
+def seed_cdr(connection, row_iter, batch_size=5000):
+    """Insert generated rows in batches; returns the number of rows inserted"""
+    inserted = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in row_iter:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(INSERT_CDR, batch)
+                connection.commit()
+                inserted += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(INSERT_CDR, batch)
+            connection.commit()
+            inserted += len(batch)
+        cursor.execute("ANALYZE TABLE asteriskcdrdb.cdr")
+    return inserted
+
+
+def add_arguments(parser):
+    """Connection and dataset options shared by the tools that seed a database"""
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--rows', type=int, default=200000, help='number of CDR rows')
+    parser.add_argument('--days', type=int, default=400, help='spread rows over this many days before now')
+    parser.add_argument('--ext-first', type=int, default=2000)
+    parser.add_argument('--ext-last', type=int, default=3999)
+    parser.add_argument('--active-extensions', type=int, default=300,
+                        help='how many extensions of the range place calls')
+    parser.add_argument('--dispositions', default=DEFAULT_DISPOSITIONS, help='weighted disposition mix')
+    parser.add_argument('--lastapps', default=DEFAULT_LASTAPPS, help='weighted lastapp mix')
+    parser.add_argument('--prefixes', default=DEFAULT_PREFIXES, help='comma-separated dst country prefixes')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (same seed, same dataset)')
+
+
+def connect(args):
+    return pymysql.connect(
+        host=args.host, port=args.port, user=args.user, password=args.password,
+        charset='utf8mb4', cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def seed(connection, args):
+    """Create the schema and load a dataset described by parsed command-line args"""
+    rng = random.Random(args.seed)
+    create_schema(connection)
+    seed_extensions(connection, args.ext_first, args.ext_last, rng)
+    extensions = rng.sample(range(args.ext_first, args.ext_last + 1),
+                            min(args.active_extensions, args.ext_last - args.ext_first + 1))
+    rows = generate_cdr_rows(
+        args.rows, args.days, extensions, parse_mix(args.dispositions), parse_mix(args.lastapps),
+        args.prefixes.split(','), rng
+    )
+    return seed_cdr(connection, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    connection = connect(args)
+    started = time.time()
+    try:
+        inserted = seed(connection, args)
+    finally:
+        connection.close()
+    print(f"Seeded {inserted} CDR rows in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()